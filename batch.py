@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+Measure a folder of images without a display, using a saved set-up and the droop point of each image:
+
+    python batch.py <folder> --setup setup.json [--points points.json] [--detect] [--output DIR] [--workers N]
+                    [--records-only]
+
+The set-up file holds the calibration line, its known length in mm and the horizontal line (see
+droop_core.save_setup). The points file maps each image file name to the [x, y] droop point in full resolution
+pixels; with --detect, images without a point are measured at the automatically detected droop point. Annotated
+PNGs and measurement records (see records.py) are written next to the images (or to --output), and the result rows
+to a CSV file. With --records-only, only the records are written.
+"""
+import argparse
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from PIL import Image
+import droop_core
+from droop_detect import detect_droop_point
+from image_source import ImageSource
+import records
+
+HEADERS = ["Image", "Lot #", "Subject", "Droop Length (mm)"]
+
+
+# Open an image with a copy at half of its resolution, which is what the droop point is detected on
+def open_source(file):
+    with Image.open(file) as image:
+        half_size = (max(1, image.width // 2), max(1, image.height // 2))
+    return ImageSource(file, half_size)
+
+
+# Detect the droop point of an image from its half resolution copy
+def detect_point(source, horizontal_line):
+    point = detect_droop_point(source.display, horizontal_line, scale=source.display_scale)
+    if point is None:
+        raise ValueError("no droop point detected")
+    return point
+
+
+# Measure a single image and write its record and, unless save_image is False, its annotated output, returning its
+# result row. The droop point is detected when point is None.
+def measure_image(file, point, setup, output_dir=None, save_image=True):
+    source = open_source(file)
+    if point is None:
+        point = detect_point(source, setup["horizontal_line"])
+    cal_value = droop_core.points_to_value(setup["calibration_line"], setup["calibration_length"])
+    distance, intersection = droop_core.distance_to_line(point, setup["horizontal_line"], cal_value)
+    image_lot = os.path.splitext(os.path.basename(file))[0]
+    annotations = (image_lot, setup["calibration_line"], f"{setup['calibration_length']:g} mm",
+                   setup["horizontal_line"], point, intersection, distance)
+    s, when = droop_core.annotation_scale(source.full_size), datetime.now()
+    record_path = records.record_path(file, output_dir, when)
+    record = records.make_record(record_path, file, source.full_size, *annotations, s, when)
+    if save_image:
+        path = droop_core.save_annotated(source, droop_core.output_path(file, output_dir, when), *annotations, s=s)
+        record.update(output=os.path.basename(path), output_sha256=records.file_hash(path))
+    records.save_record(record_path, record)
+    lot, subject = droop_core.parse_image_lot(image_lot)
+    return [os.path.basename(file), lot, subject, distance]
+
+
+# List the images of a folder with their droop point, reporting the ones without a point unless it is detected
+def find_tasks(folder, points, detect=False):
+    tasks = []
+    for name in sorted(os.listdir(folder)):
+        if not name.lower().endswith(droop_core.IMAGE_TYPES) or os.path.splitext(name)[0].endswith("_M"):
+            continue
+        if name in points:
+            tasks.append((os.path.join(folder, name), tuple(points[name])))
+        elif detect:
+            tasks.append((os.path.join(folder, name), None))
+        else:
+            print(f"Skipped {name}: no point in the points file")
+    return tasks
+
+
+# Measure every task across a pool of worker processes, returning the result rows in folder order
+def run_batch(tasks, setup, output_dir=None, workers=None, save_images=True):
+    rows = []
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(measure_image, file, point, setup, output_dir, save_images)
+                   for file, point in tasks]
+        for (file, _), future in zip(tasks, futures):
+            try:
+                rows.append(future.result())
+            except Exception as e:
+                print(f"Error: {os.path.basename(file)}: {e}")
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the material droop of a folder of images without a display")
+    parser.add_argument("folder", help="folder of .jpg, .tif or .png images")
+    parser.add_argument("--setup", required=True, help="saved calibration and horizontal line (.json)")
+    parser.add_argument("--points", help="droop point per image file name (.json)")
+    parser.add_argument("--detect", action="store_true", help="detect the droop point of images without a point")
+    parser.add_argument("--output", help="folder for the annotated images (default: the image folder)")
+    parser.add_argument("--results", help="CSV file for the result rows (default: <lot>_Batch_Measurements.csv in "
+                                          "the image folder)")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: one per CPU)")
+    parser.add_argument("--records-only", action="store_true", help="write the measurement records without the "
+                                                                     "annotated images")
+    args = parser.parse_args(argv)
+
+    folder = os.path.abspath(args.folder)
+    setup = droop_core.load_setup(args.setup)
+    if args.points is None and not args.detect:
+        parser.error("either --points or --detect is required")
+    points = {}
+    if args.points:
+        with open(args.points) as file:
+            points = json.load(file)
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    results = args.results or os.path.join(folder, os.path.basename(folder) + "_Batch_Measurements.csv")
+
+    tasks = find_tasks(folder, points, args.detect)
+    rows = run_batch(tasks, setup, args.output, args.workers, not args.records_only)
+    with open(results, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(HEADERS)
+        writer.writerows(rows)
+    print(f"Measured {len(rows)} of {len(tasks)} images, results written to {results}")
+    return 0 if len(rows) == len(tasks) else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
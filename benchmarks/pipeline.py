@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+"""
+Time the hot paths of the measurement pipeline on synthetic images and journals, without a display:
+
+    python benchmarks/pipeline.py [--quick] [--repeat N] [--save results.json] [--compare baseline.json]
+
+Cases are run for images of increasing resolution and journals of increasing row count. Results are printed and can
+be saved as JSON; --compare prints the change of each case against an earlier run, such as benchmarks/baseline.json.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import numpy as np  # noqa: E402
+from PIL import Image  # noqa: E402
+import droop_core  # noqa: E402
+from image_source import ImageSource  # noqa: E402
+from measurement_store import MeasurementStore  # noqa: E402
+from overlay import OverlayLayer  # noqa: E402
+from viewport import ZoomPyramid  # noqa: E402
+
+RESOLUTIONS = [(1280, 960), (2592, 1944), (4000, 3000), (6000, 4000)]
+ROW_COUNTS = [100, 1000, 10000, 100000]
+POINT_COUNTS = [2, 10, 100, 1000]
+QUICK_RESOLUTIONS = [(1280, 960), (2592, 1944)]
+QUICK_ROW_COUNTS = [100, 1000]
+VIEW_SIZE = (1280, 720)  # Canvas size of a typical window
+ZOOM_STEPS = 10  # Wheel steps of the zoom benchmark, 1.25X each
+
+
+# Stand-in for a Tk canvas that only hands out item ids and records coordinates, so the overlay bookkeeping can be
+# timed without a display. Drawing time on a real canvas comes on top.
+class RecordingCanvas:
+    def __init__(self):
+        self.next_id = 0
+        self.coordinates = {}
+        self.options = {}
+
+    def create(self, *coords, **options):
+        self.next_id += 1
+        self.coordinates[self.next_id] = coords
+        self.options[self.next_id] = dict(options)
+        return self.next_id
+
+    create_line = create_text = create_oval = create
+
+    def coords(self, item, *coords):
+        self.coordinates[item] = coords
+
+    def itemconfig(self, item, **options):
+        self.options[item].update(options)
+
+    def itemcget(self, item, option):
+        return self.options[item].get(option, "normal")
+
+    def delete(self, item):
+        self.coordinates.pop(item, None)
+        self.options.pop(item, None)
+
+
+# Run func repeat times after a warm up call and return the median and fastest time in seconds. setup is called before
+# each run, outside the timing, and its result is passed to func.
+def measure(func, repeat, setup=None):
+    times = []
+    for i in range(repeat + 1):
+        argument = setup() if setup is not None else None
+        start = time.perf_counter()
+        func(argument) if setup is not None else func()
+        elapsed = time.perf_counter() - start
+        if i > 0:
+            times.append(elapsed)
+    return {"median": statistics.median(times), "min": min(times), "repeat": repeat}
+
+
+# Write a synthetic photo of the rig: a noisy background with a scale of 1 mm ticks and a hanging leaflet
+def synthetic_image(path, size):
+    width, height = size
+    rng = np.random.default_rng(0)
+    array = rng.normal(90, 12, (height, width)).clip(0, 255)
+    ys, xs = np.ogrid[:height, :width]
+    array[(abs(xs - width / 2) < width / 6) & (ys > height / 3) & (ys < height / 3 + height / 4 + (xs % 50))] = 220
+    tick = max(3, width // 200)
+    for x in range(width // 10, width // 2, tick * 3):
+        array[height - height // 10:height - height // 20, x:x + tick] = 255
+    Image.fromarray(array.astype(np.uint8)).convert("RGB").save(path, quality=90)
+
+
+# Time decoding an image for display and at full resolution
+def bench_open(path, repeat):
+    def full():
+        with Image.open(path) as image:
+            image.load()
+    return {"thumbnail": measure(lambda: ImageSource(path, VIEW_SIZE), repeat), "full_decode": measure(full, repeat)}
+
+
+# Time one zoom step, averaged over zooming from 1X to about 9X on the full resolution image
+def bench_zoom(image, repeat):
+    scale = min(VIEW_SIZE[0] / image.width, VIEW_SIZE[1] / image.height)
+
+    def zoom_in(pyramid):
+        zoom = scale
+        for _ in range(ZOOM_STEPS):
+            zoom *= 1.25
+            pyramid.render(zoom, -image.width * zoom / 4, -image.height * zoom / 4, *VIEW_SIZE)
+    result = measure(zoom_in, repeat, setup=lambda: ZoomPyramid(image))
+    return {key: value / ZOOM_STEPS if key != "repeat" else value for key, value in result.items()}
+
+
+# Time repositioning the overlay with n points and three lines after a zoom or pan
+def bench_overlay(n, repeat):
+    view = {"scale": 1.0}
+    overlay = OverlayLayer(RecordingCanvas(), lambda x, y: (x * view["scale"], y * view["scale"]),
+                           droop_core.place_text_along_line, "TkDefaultFont")
+    rng = np.random.default_rng(n)
+    overlay.set_points([tuple(point) for point in rng.uniform(0, 4000, (n, 2))])
+    for name in ("calibration", "horizontal", "distance"):
+        overlay.set_line(name, tuple(rng.uniform(0, 4000, 4)), label=name)
+
+    def redraw():
+        view["scale"] *= 1.25
+        overlay.refresh()
+    return measure(redraw, repeat)
+
+
+# Time fitting a line through n points
+def bench_fit(n, repeat):
+    rng = np.random.default_rng(n)
+    xs = rng.uniform(0, 4000, n)
+    points = [(float(x), float(0.01 * x + 500 + rng.normal())) for x in xs]
+    return measure(lambda: droop_core.define_line(points), repeat)
+
+
+# Time drawing the annotations onto a full resolution image and saving it as the program does
+def bench_export(image, folder, repeat):
+    width, height = image.size
+    s = droop_core.annotation_scale(image.size)
+    annotated = droop_core.render_annotated(image, "LOT1_S1_A", (width * 0.1, height * 0.9, width * 0.4, height * 0.9),
+                                            "10 mm", (0, height / 3, width, height / 3), (width / 2, height * 0.7),
+                                            (width / 2, height / 3), 12.34, s=s)
+    path = os.path.join(folder, "export.png")
+    render = measure(lambda: droop_core.render_annotated(image, "LOT1_S1_A",
+                                                         (width * 0.1, height * 0.9, width * 0.4, height * 0.9),
+                                                         "10 mm", (0, height / 3, width, height / 3),
+                                                         (width / 2, height * 0.7), (width / 2, height / 3), 12.34,
+                                                         s=s), repeat)
+    save = measure(lambda: annotated.save(path, format="PNG", compress_level=1), repeat)
+    return {"render": render, "save_png": save, "png_bytes": os.path.getsize(path)}
+
+
+# Time appending one measurement to a journal holding rows measurements, and exporting the journal to the workbook
+def bench_append(rows, folder, repeat):
+    lot_folder = os.path.join(folder, f"LOT{rows}")
+    os.makedirs(lot_folder)
+    store = MeasurementStore(lot_folder)
+    with store.connection:
+        store.connection.executemany("INSERT INTO measurements (lot, subject, distance, image) VALUES (?, ?, ?, ?)",
+                                     ((f"LOT{rows}", f"S{i}", i * 0.01, None) for i in range(rows)))
+    try:
+        append = measure(lambda: store.append(f"LOT{rows}", "S", 1.0), repeat)
+        export = measure(store.export_to_excel, 1 if rows > 10000 else repeat)
+    finally:
+        store.close()
+    return {"append": append, "export_excel": export}
+
+
+# Flatten the nested results into "case/metric" keys holding the median time
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict) and "median" in value:
+            flat[prefix + key] = value["median"]
+        elif isinstance(value, dict):
+            flat.update(flatten(value, prefix + key + "/"))
+    return flat
+
+
+def run(resolutions, row_counts, repeat):
+    results = {"machine": {"python": sys.version.split()[0], "platform": platform.platform(),
+                           "processor": platform.processor() or platform.machine(), "cpus": os.cpu_count()},
+               "cases": {}}
+    cases = results["cases"]
+    with tempfile.TemporaryDirectory() as folder:
+        for size in resolutions:
+            name = f"{size[0]}x{size[1]}"
+            print(f"Image {name}")
+            path = os.path.join(folder, name + ".jpg")
+            synthetic_image(path, size)
+            with Image.open(path) as image:
+                image.load()
+                cases[f"open/{name}"] = bench_open(path, repeat)
+                cases[f"zoom_step/{name}"] = bench_zoom(image, repeat)
+                cases[f"export/{name}"] = bench_export(image, folder, repeat)
+        for n in POINT_COUNTS:
+            cases[f"overlay_redraw/{n}_points"] = bench_overlay(n, repeat * 10)
+            cases[f"line_fit/{n}_points"] = bench_fit(n, repeat * 10)
+        for rows in row_counts:
+            print(f"Journal of {rows} rows")
+            cases[f"results/{rows}_rows"] = bench_append(rows, folder, repeat)
+    return results
+
+
+# Print the median of every case, with the change against a baseline when one is given
+def report(results, baseline=None):
+    flat = flatten(results["cases"])
+    previous = flatten(baseline["cases"]) if baseline else {}
+    for key, seconds in flat.items():
+        line = f"{key:<40} {seconds * 1000:10.3f} ms"
+        if previous.get(key):
+            change = seconds / previous[key] - 1
+            line += f"  {change:+7.1%}" + ("  slower" if change > 0.1 else "  faster" if change < -0.1 else "")
+        print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the hot paths of the measurement pipeline without a display")
+    parser.add_argument("--quick", action="store_true", help="only the smaller images and journals")
+    parser.add_argument("--repeat", type=int, default=5, help="timed runs per case (default: 5)")
+    parser.add_argument("--save", help="write the results to this file (.json)")
+    parser.add_argument("--compare", help="results of an earlier run to compare against (.json)")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as file:
+            baseline = json.load(file)
+    results = run(QUICK_RESOLUTIONS if args.quick else RESOLUTIONS, QUICK_ROW_COUNTS if args.quick else ROW_COUNTS,
+                  args.repeat)
+    report(results, baseline)
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
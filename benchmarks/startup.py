@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+"""
+Measure the cold start of the measurement window:
+
+    python benchmarks/startup.py [--repeat N] [--json results.json]
+
+Every measurement runs in a fresh interpreter so nothing is already imported. The import time of each dependency is
+reported on its own, followed by the time from interpreter start to the first drawn window and the heavy libraries
+that were loaded by then. The window measurement is skipped when no display is available.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEPENDENCIES = ["tkinter", "numpy", "PIL.Image", "PIL.ImageTk", "pandas", "openpyxl", "sqlite3", "droop_core",
+                "measurement_store", "output_writer", "overlay", "setup_profile", "viewport", "image_source",
+                "scale_detect", "droop_detect", "registration", "main"]
+HEAVY = ["numpy", "pandas", "PIL.Image", "PIL.ImageTk", "openpyxl"]
+
+IMPORT_SCRIPT = """
+import time
+start = time.perf_counter()
+import {name}
+print(time.perf_counter() - start)
+"""
+
+# Runs in the child: time from interpreter start (measured by the parent) to the first drawn window
+WINDOW_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import main
+imported = time.perf_counter()
+app = main.MaterialMeasurement()
+app.update()
+drawn = time.perf_counter()
+print(json.dumps({{"import": imported - start, "window": drawn - start,
+                  "loaded": [name for name in {heavy!r} if name in sys.modules]}}))
+app.writer.close()
+app.destroy()
+"""
+
+
+# Run a script in a fresh interpreter from the repository folder and return its output, or None if it failed
+def run_child(script):
+    result = subprocess.run([sys.executable, "-c", script], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip().splitlines()[-1]
+
+
+# Median import time in seconds of a module over repeat fresh interpreters, or None if it cannot be imported
+def import_time(name, repeat):
+    times = []
+    for _ in range(repeat):
+        output = run_child(IMPORT_SCRIPT.format(name=name))
+        if output is None:
+            return None
+        times.append(float(output))
+    return statistics.median(times)
+
+
+# Median times to import main and to draw the first window, and the heavy modules loaded when it was drawn
+def window_time(repeat):
+    runs = []
+    for _ in range(repeat):
+        output = run_child(WINDOW_SCRIPT.format(heavy=HEAVY))
+        if output is None:
+            return None  # No display
+        runs.append(json.loads(output))
+    return {"import": statistics.median(run["import"] for run in runs),
+            "window": statistics.median(run["window"] for run in runs), "loaded": runs[-1]["loaded"]}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the import time of each dependency and the time to the "
+                                                 "first window")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per measurement (default: 5)")
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args(argv)
+
+    results = {"python": sys.version.split()[0], "repeat": args.repeat, "imports": {}}
+    for name in DEPENDENCIES:
+        seconds = import_time(name, args.repeat)
+        results["imports"][name] = seconds
+        print(f"{name:<20} {'not available' if seconds is None else f'{seconds * 1000:8.1f} ms'}")
+
+    results["first_window"] = window_time(args.repeat)
+    if results["first_window"] is None:
+        print("First window: skipped, no display available")
+    else:
+        first = results["first_window"]
+        print(f"First window: import main {first['import'] * 1000:.1f} ms, drawn after {first['window'] * 1000:.1f} "
+              f"ms, heavy modules loaded: {', '.join(first['loaded']) or 'none'}")
+
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
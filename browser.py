@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import math
+import os
+import queue
+import threading
+import tkinter as tk
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image, ImageTk
+import droop_core
+from image_source import ImageSource
+
+THUMBNAIL_DIR = os.path.join(os.path.expanduser("~"), ".leaflet_droop", "thumbnails")
+THUMBNAIL_SIZE = (160, 120)
+CELL_PADDING = 8
+LABEL_HEIGHT = 36  # Room under each thumbnail for the file name and badge
+# Badge text and colour of each image status
+BADGES = {"unmeasured": ("Unmeasured", "gray40"), "measured": ("Measured", "green4"),
+          "flagged": ("Flagged", "red")}
+
+
+# List the images of a lot folder in name order as (path, name, stat), leaving out annotated outputs
+def list_images(folder):
+    entries = [entry for entry in os.scandir(folder) if entry.name.lower().endswith(droop_core.IMAGE_TYPES)
+               and not os.path.splitext(entry.name)[0].endswith("_M")]
+    return [(entry.path, entry.name, entry.stat()) for entry in sorted(entries, key=lambda entry: entry.name)]
+
+
+# Status of each image name from the journal rows of the lot (MeasurementStore.merged_rows): unmeasured, measured, or
+# flagged when its latest measurement failed the scale check or was made on a drifted image. Rows with an image only
+# count for that image; rows imported from a workbook, which have none, count for every image of their subject.
+def image_status(names, rows):
+    latest, subjects = {}, set()
+    for _, lot, subject, _, image, _, flags in rows:
+        if image:
+            latest[os.path.basename(image)] = flags
+        else:
+            subjects.add((lot, subject))
+    statuses = {}
+    for name in names:
+        if name in latest:
+            statuses[name] = "flagged" if latest[name] else "measured"
+            continue
+        try:
+            measured = droop_core.parse_image_lot(os.path.splitext(name)[0]) in subjects
+        except ValueError:
+            measured = False  # Not named LOT_SUBJECT_X, so it can only be matched by file name
+        statuses[name] = "measured" if measured else "unmeasured"
+    return statuses
+
+
+# Path of the cached thumbnail of an image, which changes whenever the image file does
+def thumbnail_path(path, stat, cache_dir=THUMBNAIL_DIR):
+    key = hashlib.sha1(f"{os.path.abspath(path)}|{stat.st_mtime_ns}|{stat.st_size}".encode()).hexdigest()
+    return os.path.join(cache_dir, key[:2], key + ".jpg")
+
+
+# Return the thumbnail of an image, from the cache when there is one, else decoded at reduced size and cached
+def load_thumbnail(path, stat, cache_dir=THUMBNAIL_DIR):
+    cached = thumbnail_path(path, stat, cache_dir)
+    try:
+        with Image.open(cached) as image:
+            image.load()
+            return image
+    except OSError:
+        pass  # Not cached yet, or a partial file from an interrupted run
+    image = ImageSource(path, THUMBNAIL_SIZE).display
+    image = image if image.mode == "RGB" else image.convert("RGB")
+    os.makedirs(os.path.dirname(cached), exist_ok=True)
+    temp_path = f"{cached}.{threading.get_ident()}.tmp"
+    image.save(temp_path, format="JPEG", quality=85)
+    os.replace(temp_path, cached)
+    return image
+
+
+# Window showing a grid of thumbnails of the images of a lot folder with their measured status. Only the rows in view
+# are drawn; their thumbnails are read from the disk cache, or made, on a thread pool, so a folder of thousands of
+# images opens at once. rows are the journal rows of the lot (MeasurementStore.merged_rows), and clicking a thumbnail
+# calls open_image with the path of the image.
+class LotBrowser(tk.Toplevel):
+    def __init__(self, master, folder, rows, open_image, workers=4):
+        images = list_images(folder)  # Before the window is made, so an unreadable folder leaves no window
+        super().__init__(master)
+        self.title(f"Lot {os.path.basename(folder)}")
+        self.geometry("760x600")
+        self.folder = folder
+        self.images = images
+        self.statuses = image_status([name for _, name, _ in self.images], rows)
+        self.open_image = open_image
+        self.cell_width = THUMBNAIL_SIZE[0] + 2 * CELL_PADDING
+        self.cell_height = THUMBNAIL_SIZE[1] + LABEL_HEIGHT + 2 * CELL_PADDING
+        self.columns = 1
+        self.summary = tk.Label(self)
+        self.summary.pack(side=tk.TOP, fill=tk.X)
+        self.canvas = tk.Canvas(self, bg="white", highlightthickness=0)
+        scrollbar = tk.Scrollbar(self, command=self.canvas.yview)
+        self.canvas.configure(yscrollcommand=self.scrolled)
+        self.scrollbar = scrollbar
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        self.canvas.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+        self.cells = {}  # Canvas items of each image index in view
+        self.photos = {}  # Thumbnail of each image index in view
+        self.results = queue.Queue()  # Thumbnails made by the thread pool, shown by the window
+        self.draw_pending = False
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="thumbnail")
+        self.canvas.bind("<Configure>", self.layout)
+        self.canvas.bind("<MouseWheel>", lambda event: self.canvas.yview_scroll(-int(event.delta / 120), "units"))
+        self.canvas.bind("<Button-4>", lambda event: self.canvas.yview_scroll(-1, "units"))
+        self.canvas.bind("<Button-5>", lambda event: self.canvas.yview_scroll(1, "units"))
+        self.canvas.bind("<Button-1>", self.click)
+        self.protocol("WM_DELETE_WINDOW", self.close)
+        self.update_summary()
+        self.poll_id = self.after(50, self.poll)
+
+    # Count the images of each status
+    def update_summary(self):
+        counts = Counter(self.statuses.get(name, "unmeasured") for _, name, _ in self.images)
+        self.summary.config(text=f"{len(self.images)} images - " + ", ".join(
+            f"{counts[status]} {BADGES[status][0].lower()}" for status in BADGES))
+
+    # Fit the grid to the width of the window
+    def layout(self, event=None):
+        columns = max(1, self.canvas.winfo_width() // self.cell_width)
+        if columns != self.columns:
+            self.columns = columns
+            for index in list(self.cells):
+                self.remove_cell(index)
+        rows = math.ceil(len(self.images) / self.columns)
+        self.canvas.configure(scrollregion=(0, 0, self.columns * self.cell_width, rows * self.cell_height),
+                              yscrollincrement=self.cell_height // 4)
+        self.schedule_draw()
+
+    def scrolled(self, first, last):
+        self.scrollbar.set(first, last)
+        self.schedule_draw()
+
+    # Redraw once per pass of the event loop however many scroll events arrive
+    def schedule_draw(self):
+        if not self.draw_pending:
+            self.draw_pending = True
+            self.after_idle(self.draw)
+
+    # Draw the cells of the rows in view, with a row to spare on each side, and remove the others
+    def draw(self):
+        self.draw_pending = False
+        top = self.canvas.canvasy(0)
+        first_row = max(0, int(top // self.cell_height) - 1)
+        last_row = int((top + self.canvas.winfo_height()) // self.cell_height) + 1
+        wanted = set(range(first_row * self.columns, min(len(self.images), (last_row + 1) * self.columns)))
+        for index in set(self.cells) - wanted:
+            self.remove_cell(index)
+        for index in sorted(wanted - set(self.cells)):
+            self.add_cell(index)
+
+    # Upper left corner of the thumbnail of an image index on the canvas
+    def corner(self, index):
+        row, column = divmod(index, self.columns)
+        return column * self.cell_width + CELL_PADDING, row * self.cell_height + CELL_PADDING
+
+    def add_cell(self, index):
+        path, name, stat = self.images[index]
+        x, y = self.corner(index)
+        width, height = THUMBNAIL_SIZE
+        label, color = BADGES[self.statuses.get(name, "unmeasured")]
+        self.cells[index] = [
+            self.canvas.create_rectangle(x, y, x + width, y + height, outline="gray80", fill="gray95"),
+            self.canvas.create_text(x + width / 2, y + height + 4, text=name, anchor=tk.N, width=width,
+                                    font="TkDefaultFont 8"),
+            self.canvas.create_text(x + width / 2, y + height + 20, text=label, anchor=tk.N, fill=color,
+                                    font="TkDefaultFont 8 bold"),
+        ]
+        future = self.executor.submit(self.load, index, path, stat)
+        future.add_done_callback(lambda future: self.results.put((index, future)))
+
+    def remove_cell(self, index):
+        for item in self.cells.pop(index, ()):
+            self.canvas.delete(item)
+        self.photos.pop(index, None)
+
+    # Make the thumbnail of an image on the thread pool, unless it was scrolled out of view while waiting
+    def load(self, index, path, stat):
+        if index not in self.cells:
+            return None
+        return load_thumbnail(path, stat)
+
+    # Show the thumbnails made since the last poll, in the Tk thread
+    def poll(self):
+        while not self.results.empty():
+            index, future = self.results.get()
+            if index not in self.cells or index in self.photos:
+                continue  # Scrolled out of view, or shown by an earlier request
+            try:
+                image = future.result()
+            except Exception as e:
+                x, y = self.corner(index)
+                self.cells[index].append(self.canvas.create_text(x + THUMBNAIL_SIZE[0] / 2, y + THUMBNAIL_SIZE[1] / 2,
+                                                                 text="Unreadable", fill="red"))
+                print(f"Error: {self.images[index][1]}: {e}")
+                continue
+            if image is None:
+                continue
+            x, y = self.corner(index)
+            self.photos[index] = ImageTk.PhotoImage(image)
+            self.cells[index].append(self.canvas.create_image(x + THUMBNAIL_SIZE[0] / 2, y + THUMBNAIL_SIZE[1] / 2,
+                                                              image=self.photos[index]))
+        self.poll_id = self.after(50, self.poll)
+
+    # Open the image under the mouse
+    def click(self, event):
+        column = int(self.canvas.canvasx(event.x) // self.cell_width)
+        index = int(self.canvas.canvasy(event.y) // self.cell_height) * self.columns + column
+        if column < self.columns and 0 <= index < len(self.images):
+            self.open_image(self.images[index][0])
+
+    # Record a new measurement of an image, flagged when it failed any of the checks in flags
+    def mark_measured(self, file, flags=()):
+        name = os.path.basename(file)
+        self.statuses[name] = "flagged" if flags else "measured"
+        for index, (_, image_name, _) in enumerate(self.images):
+            if image_name == name and index in self.cells:
+                self.remove_cell(index)
+                self.add_cell(index)
+        self.update_summary()
+
+    def close(self):
+        self.after_cancel(self.poll_id)
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.destroy()
@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+import json
+import math
+import os
+from datetime import datetime
+# numpy and Pillow are imported where they are used so that the window can open before they are loaded
+
+IMAGE_TYPES = (".jpg", ".jpeg", ".tif", ".tiff", ".png")  # Extensions of the images that can be measured
+
+
+# Fit a line to a list of points using Linear Regression Model and LSR to optimize the line
+def fit_line(points):
+    if len(points) < 2:
+        return None  # You need at least 2 points to fit a line
+
+    import numpy as np
+    # Linear regression to fit a line (y = mx + b)
+    X = np.array([x for x, _ in points])
+    Y = np.array([y for _, y in points])
+    A = np.vstack([X, np.ones(len(X))]).T
+    m, b = np.linalg.lstsq(A, Y, rcond=None)[0]
+    return m, b  # Returns slope and y-int of the fitted line
+
+
+# Defines the fitted line in terms of coordinates
+def define_line(points):
+    m, b = fit_line(points)
+    x1, y1 = min(points, key=lambda p: p[0])
+    x2, y2 = max(points, key=lambda p: p[0])
+    y1_line = m * x1 + b
+    y2_line = m * x2 + b
+    return x1, y1_line, x2, y2_line  # Return the two points used to construct the line
+
+
+# Convert a calibration line and its known length in mm to a pixel/mm value
+def points_to_value(line, known_length):
+    x1, y1_line, x2, y2_line = line
+    distance = math.sqrt((x2 - x1) ** 2 + (y2_line - y1_line) ** 2)
+    return distance / float(known_length)
+
+
+# Calculate the distance in mm from a point (x, y) to a line defined by two points (x1, y1) and (x2, y2), returning
+# the distance and the intersection of the perpendicular with the line
+def distance_to_line(point, line, cal_value):
+    x, y = point
+    x1, y1, x2, y2 = line
+    A = y2 - y1
+    B = x1 - x2
+    C = x2 * y1 - x1 * y2
+    distance = abs(A * x + B * y + C) / ((A ** 2 + B ** 2) ** 0.5)
+
+    # Calculate the coordinates for the line
+    intersection_x = (B * (B * x - A * y) - A * C) / (A ** 2 + B ** 2)
+    intersection_y = (A * (-B * x + A * y) - B * C) / (A ** 2 + B ** 2)
+    return distance / cal_value, (intersection_x, intersection_y)
+
+
+# Calculate the x and y to place text along a line using the bisecting line as reference
+def place_text_along_line(x1, y1, x2, y2, distance=10):
+    # Calculate the midpoint of the line
+    mid_x = (x1 + x2) / 2
+    mid_y = (y1 + y2) / 2
+
+    # Calculate the angle of the line and find the bisecting line angle
+    angle = math.atan2(y2 - y1, x2 - x1)
+    angle_bisector = angle + math.pi / 2
+
+    # Calculate the new coordinates for placing text above the line
+    text_x = mid_x - distance * math.cos(angle_bisector)
+    text_y = mid_y - distance * math.sin(angle_bisector)
+
+    return text_x, text_y  # Returns the x and y coordinates for the text
+
+
+# Split an image name of the form <lot>_<subject>_<suffix> into its lot and subject identifiers
+def parse_image_lot(image_lot):
+    lot, subject, _ = image_lot.split("_")
+    return lot, subject
+
+
+# Scale factor for annotations on an image of the given (width, height) drawn without a display, sized as if shown
+# display_width pixels wide
+def annotation_scale(size, display_width=1200):
+    return max(1.0, size[0] / display_width)
+
+
+# Load the annotation font, falling back on Pillow's built in font where Arial is not installed
+def load_font(size):
+    from PIL import ImageFont
+    try:
+        return ImageFont.truetype("arial.ttf", size=size)
+    except OSError:
+        return ImageFont.load_default(size=size)
+
+
+# Draw text on a white box with a black outline
+def draw_label(draw, xy, text, font, fill):
+    bbox = draw.textbbox(xy, text=text, font=font)
+    draw.rectangle((bbox[0] - 2, bbox[1] - 2, bbox[2] + 2, bbox[3] + 2), fill="white", outline="black", width=1)
+    draw.text(xy, text=text, font=font, fill=fill)
+
+
+# Draw the calibration, horizontal line and droop measurement onto an RGB copy of the image. All coordinates are in
+# image pixels and s scales the annotation sizes. The image may be a strip of a larger image whose upper left corner
+# is at origin, in which case only the part of the annotations over the strip is drawn.
+def render_annotated(image, image_lot, calibration_line, calibration_text, horizontal_line, point, intersection,
+                     distance, s=1.0, origin=(0, 0)):
+    from PIL import ImageDraw
+    image = image.convert('RGB') if image.mode != 'RGB' else image.copy()
+    draw = ImageDraw.Draw(image)
+    width = max(3, round(3 * s))
+    ox, oy = origin
+
+    # Move coordinate pairs from the full image into the strip
+    def at(*coords):
+        return tuple(value - (ox if i % 2 == 0 else oy) for i, value in enumerate(coords))
+
+    # Add an image label to the output image
+    font = load_font(round(16 * s))
+    draw_label(draw, at(10 * s, 10 * s), image_lot, font, "black")
+
+    # Draw the calibration line and calibration value
+    x1, y1, x2, y2 = calibration_line
+    draw.line(at(x1, y1, x2, y2), fill="green", width=width)
+    draw_label(draw, at(*place_text_along_line(x1, y1, x2, y2, distance=24 * s)), calibration_text, font, "green")
+
+    # Draw the horizontal line
+    x1, y1, x2, y2 = horizontal_line
+    draw.line(at(x1, y1, x2, y2), fill="green", width=width)
+    # Draw the selected point and corresponding distance lines
+    x, y = point
+    intersection_x, intersection_y = intersection
+    draw.line(at(intersection_x, intersection_y, x1, y1), fill="blue", width=width)
+    draw.line(at(x, y, intersection_x, intersection_y), fill="blue", width=width)
+    draw.ellipse(at(x - 2 * s, y - 2 * s, x + 2 * s, y + 2 * s), fill="red")
+    text_x, text_y = place_text_along_line(x, y, intersection_x, intersection_y,
+                                           distance=10 * s)  # Calculate the xy for text
+    draw_label(draw, at(text_x - 70 * s, text_y - 20 * s), f"{distance:.2f} mm", font, "red")
+    draw_label(draw, at(10 * s, 40 * s), f"Horizontal Droop (mm): {distance:.2f}", font, "red")
+    return image
+
+
+# Draw the annotations onto the full resolution image of an ImageSource and save it. Images read from disk as needed
+# are annotated and written as a PNG one strip at a time, so the full image is never held in memory. Returns the path
+# written, with its extension changed to .png for streamed images.
+def save_annotated(source, path, image_lot, calibration_line, calibration_text, horizontal_line, point, intersection,
+                   distance, s=1.0, output_format="PNG", **options):
+    annotations = (image_lot, calibration_line, calibration_text, horizontal_line, point, intersection, distance)
+    if source.pixels is None:
+        image = render_annotated(source.full(), *annotations, s=s)
+        image.save(path, format=output_format, **options)
+        return path
+    import large_image
+    path = os.path.splitext(path)[0] + ".png"
+    strips = (render_annotated(strip, *annotations, s=s, origin=(0, y)) for y, strip in source.pixels.strips())
+    large_image.write_png(path, source.full_size, strips, compress_level=options.get("compress_level", 1))
+    return path
+
+
+# Name the annotated output for an image file, marked with the date & time and "_M"
+def output_path(file, output_dir=None, when=None, ext=".png"):
+    file_path, _ = os.path.splitext(file)
+    if output_dir is not None:
+        file_path = os.path.join(output_dir, os.path.basename(file_path))
+    formatted_datetime = (when or datetime.now()).strftime("_%Y-%m-%d_%H-%M-%S")
+    return file_path + formatted_datetime + "_M" + ext
+
+
+# Save the calibration and horizontal line of a set-up so they can be reused without re-selecting the points. Any
+# extra keyword arguments are saved alongside them.
+def save_setup(path, calibration_line, calibration_length, horizontal_line, **extra):
+    setup = {"calibration_line": list(calibration_line), "calibration_length": float(calibration_length),
+             "horizontal_line": list(horizontal_line), **extra}
+    with open(path, "w") as file:
+        json.dump(setup, file, indent=2)
+
+
+# Load a set-up written by save_setup
+def load_setup(path):
+    with open(path) as file:
+        setup = json.load(file)
+    return {"calibration_line": tuple(setup["calibration_line"]),
+            "calibration_length": float(setup["calibration_length"]),
+            "horizontal_line": tuple(setup["horizontal_line"])}
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+from PIL import ImageFilter
+
+
+# Otsu's threshold separating an array of 0-255 intensities into two classes, or None when they are all equal
+def otsu_threshold(values):
+    hist = np.bincount(values.astype(np.uint8).ravel(), minlength=256).astype(np.float64)
+    p = hist / hist.sum()
+    omega = np.cumsum(p)  # Probability of the lower class at each threshold
+    mu = np.cumsum(p * np.arange(256))  # Mean of the lower class (unnormalized) at each threshold
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sigma_b = (mu[-1] * omega - mu) ** 2 / (omega * (1 - omega))  # Between class variance
+    if np.isnan(sigma_b).all():
+        return None
+    return float(np.nanargmax(sigma_b)) + 0.5
+
+
+# Propose the lowest point of the material below the horizontal line. The image is segmented against the background
+# in the band under the line, after a box blur of radius blur pixels against noise, and the point of the material
+# furthest from the line that is still connected to it is returned at sub-pixel precision. The image may be a reduced
+# copy with scale image pixels per full resolution pixel; the horizontal line is given and the point returned in full
+# resolution pixels. Returns None when no material is found under the line.
+def detect_droop_point(image, horizontal_line, scale=1.0, margin=3, min_width=2, blur=2):
+    gray = image.convert("L")
+    gray = np.asarray(gray.filter(ImageFilter.BoxBlur(blur)) if blur else gray, dtype=np.float32)
+    height, width = gray.shape
+    x1, y1, x2, y2 = (value * scale for value in horizontal_line)
+    length = math.hypot(x2 - x1, y2 - y1)
+    if length == 0:
+        return None
+    # Unit normal of the line pointing down the image
+    nx, ny = -(y2 - y1) / length, (x2 - x1) / length
+    if ny < 0:
+        nx, ny = -nx, -ny
+    # Distance of every pixel below the line, binned into whole pixels
+    xs, ys = np.arange(width, dtype=np.float32) + 0.5, np.arange(height, dtype=np.float32) + 0.5  # Pixel centres
+    d = (xs[None, :] - x1) * nx + (ys[:, None] - y1) * ny
+    band = d > margin  # Skip the pixels on the line itself
+    if band.sum() < 2 * min_width:
+        return None
+    bins = np.where(band, d, 0).astype(np.int32)
+    n_bins = int(bins.max()) + 1
+
+    # Split the band into bright and dark pixels
+    threshold = otsu_threshold(gray[band])
+    if threshold is None:
+        return None  # Nothing to separate from the background
+    bright = gray > threshold
+    total = np.bincount(bins[band], minlength=n_bins)
+    bright_count = np.bincount(bins[band & bright], minlength=n_bins)
+    # The material hangs from the line, so it is the class that is more common next to the line than far below it
+    occupied = np.flatnonzero(total)
+    k = max(1, len(occupied) // 10)
+    top, bottom = occupied[:k], occupied[-k:]
+    material_bright = bright_count[top].sum() / total[top].sum() > bright_count[bottom].sum() / total[bottom].sum()
+    material = band & (bright if material_bright else ~bright)
+
+    # Which columns hold material in each bin
+    rows, columns = np.nonzero(material)
+    present = np.zeros((n_bins, width), dtype=bool)
+    present[bins[rows, columns], columns] = True
+    counts = present.sum(axis=1)
+    if not (counts >= min_width).any():
+        return None
+    # Follow the material down from the line, keeping only the columns that touch the material of the bin above, until
+    # a bin holds too few of them. Material elsewhere in the band, or noise taken for it, does not extend the walk.
+    lowest = int(np.argmax(counts >= min_width))
+    connected = present[lowest]
+    for k in range(lowest + 1, n_bins):
+        reach = connected.copy()
+        reach[1:] |= connected[:-1]
+        reach[:-1] |= connected[1:]
+        reach &= present[k]
+        if reach.sum() < min_width:
+            break
+        lowest, connected = k, reach
+
+    # Centre of the connected material in the lowest bin
+    rows, columns = np.nonzero(material & (bins == lowest) & connected[None, :])
+    x = float(columns.mean()) + 0.5  # Pixel centres are at half pixels
+    column = int(x)
+    # Refine along the column to where the intensity crosses halfway between the material and the background, between
+    # the centres of the last material pixel and the next pixel down
+    level = (np.median(gray[band & bright]) + np.median(gray[band & ~bright])) / 2
+    in_column = np.flatnonzero(material[:, column] & (bins[:, column] <= lowest))
+    y_last = int(in_column.max()) if in_column.size else int(round(rows.mean()))
+    y = y_last + 0.5
+    if y_last + 1 < height:
+        v0, v1 = gray[y_last, column], gray[y_last + 1, column]
+        if v0 != v1 and (v0 - level) * (v1 - level) <= 0:
+            y = y_last + 0.5 + (v0 - level) / (v0 - v1)
+    return x / scale, float(y) / scale
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+
+MIN_EDGE_STRENGTH = 40.0  # Smallest gradient magnitude (Sobel, 8-bit levels) a point is snapped to
+STRIP_ROWS = 512  # Rows of the image whose gradient is computed at a time, bounding the temporary arrays
+
+
+# Gradient magnitude of a grayscale float array by the Sobel operator, with the edge pixels repeated at the border
+def gradient_magnitude(gray):
+    g = np.pad(gray, 1, mode="edge")
+    gx = (g[:-2, 2:] + 2 * g[1:-1, 2:] + g[2:, 2:]) - (g[:-2, :-2] + 2 * g[1:-1, :-2] + g[2:, :-2])
+    gy = (g[2:, :-2] + 2 * g[2:, 1:-1] + g[2:, 2:]) - (g[:-2, :-2] + 2 * g[:-2, 1:-1] + g[:-2, 2:])
+    return np.hypot(gx, gy)
+
+
+# Gradient magnitude of the rows y0 to y1 of a grayscale array, reading one row on either side
+def gradient_rows(gray, y0, y1):
+    a, b = max(0, y0 - 1), min(gray.shape[0], y1 + 1)
+    return gradient_magnitude(np.asarray(gray[a:b], dtype=np.float32))[y0 - a:y0 - a + y1 - y0]
+
+
+# Map of the edge strength of an image, used to snap clicked points to the nearest strong edge. Images in memory
+# have their gradient magnitude computed once, in strips, and kept at half precision; images read from disk
+# (large_image.MappedImage) have it computed around each click instead.
+class EdgeMap:
+    def __init__(self, magnitude=None, pixels=None):
+        self.magnitude = magnitude  # Gradient magnitude of every pixel, or None for images read from disk
+        self.pixels = pixels
+        self.height, self.width = magnitude.shape if magnitude is not None else (pixels.height, pixels.width)
+
+    # Compute the edge map of a PIL image
+    @classmethod
+    def from_image(cls, image):
+        gray = np.asarray(image if image.mode == "L" else image.convert("L"))
+        magnitude = np.empty(gray.shape, dtype=np.float16)
+        for y in range(0, gray.shape[0], STRIP_ROWS):
+            magnitude[y:y + STRIP_ROWS] = gradient_rows(gray, y, min(gray.shape[0], y + STRIP_ROWS))
+        return cls(magnitude)
+
+    # Gradient magnitude of the pixels x0 to x1 and y0 to y1
+    def window(self, x0, y0, x1, y1):
+        if self.magnitude is not None:
+            return self.magnitude[y0:y1, x0:x1].astype(np.float32)
+        # Gray levels of the window of an image read from disk, with a pixel on every side, scaled to 8 bits
+        a, b = max(0, x0 - 1), min(self.width, x1 + 1)
+        block = np.asarray(self.pixels.array[max(0, y0 - 1):min(self.height, y1 + 1), a:b], dtype=np.float32)
+        if block.ndim == 3:
+            block = block[..., :3].mean(axis=2)
+        magnitude = gradient_magnitude(block * (255 / self.pixels.white))
+        top = y0 - max(0, y0 - 1)
+        return magnitude[top:top + y1 - y0, x0 - a:x0 - a + x1 - x0]
+
+    # Return the point of the nearest strong edge within radius pixels of an image point, refined to a fraction of a
+    # pixel across the edge, or None when there is no edge there. The edge taken is the one of the strongest gradient
+    # within the radius, and the point moves across it rather than along it. Only the pixels within the radius, and
+    # one more on every side, are read.
+    def snap(self, x, y, radius):
+        r = max(1, int(math.ceil(radius))) + 1
+        cx, cy = int(math.floor(x)), int(math.floor(y))
+        x0, y0 = max(0, cx - r), max(0, cy - r)
+        x1, y1 = min(self.width, cx + r + 1), min(self.height, cy + r + 1)
+        if x1 - x0 < 3 or y1 - y0 < 3:
+            return None
+        m = self.window(x0, y0, x1, y1)
+        # Squared distance of every pixel centre from the point; pixel centres are at half pixels
+        ys, xs = np.ogrid[y0:y1, x0:x1]
+        distance = (xs + 0.5 - x) ** 2 + (ys + 0.5 - y) ** 2
+        strength = np.where(distance <= radius ** 2, m, 0)
+        strength[[0, -1], :] = strength[:, [0, -1]] = 0  # Only pixels with all their neighbours in the window
+        peak = float(strength.max())
+        if peak < MIN_EDGE_STRENGTH:
+            return None
+        # The ridge pixel of the strongest edge nearest to the point
+        i, j = np.unravel_index(int(np.argmin(np.where(strength >= 0.8 * peak, distance, np.inf))), m.shape)
+        normal, offset = ridge_normal(m, i, j)
+        # Climb across the edge to the top of the ridge, then refine the offset along the normal
+        for _ in range(r):
+            di, dj = int(round(normal[1] * math.copysign(1, offset))), int(round(normal[0] * math.copysign(1, offset)))
+            if abs(offset) <= 0.5 or not (0 < i + di < m.shape[0] - 1 and 0 < j + dj < m.shape[1] - 1) or \
+                    m[i + di, j + dj] <= m[i, j]:
+                break
+            i, j = i + di, j + dj
+            normal, offset = ridge_normal(m, i, j)
+        offset = float(np.clip(offset, -1.0, 1.0))
+        return float(x0 + j + 0.5 + offset * normal[0]), float(y0 + i + 0.5 + offset * normal[1])
+
+
+# Direction (x, y) across the ridge of a gradient magnitude array m at pixel (i, j), the direction of its strongest
+# downward curvature, and the offset of the top of the ridge from the pixel along it
+def ridge_normal(m, i, j):
+    c = m[i, j]
+    gx, gy = (m[i, j + 1] - m[i, j - 1]) / 2, (m[i + 1, j] - m[i - 1, j]) / 2
+    dxx, dyy = m[i, j + 1] - 2 * c + m[i, j - 1], m[i + 1, j] - 2 * c + m[i - 1, j]
+    dxy = (m[i + 1, j + 1] - m[i + 1, j - 1] - m[i - 1, j + 1] + m[i - 1, j - 1]) / 4
+    values, vectors = np.linalg.eigh(np.array([[dxx, dxy], [dxy, dyy]], dtype=np.float64))
+    normal = vectors[:, 0]
+    curvature = values[0]
+    offset = -(gx * normal[0] + gy * normal[1]) / curvature if curvature < 0 else 0.0
+    return normal, float(offset)
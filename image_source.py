@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+from PIL import Image
+import large_image
+import perf
+
+
+# An image opened at screen size for display with a lazily loaded full resolution copy for measurement and output.
+# High bit depth images and images larger than memory_ceiling bytes decoded are not loaded; their pixels are read
+# from disk through pixels, a large_image.MappedImage, and full() is not available.
+class ImageSource:
+    def __init__(self, path, display_size, memory_ceiling=None):
+        self.path = path
+        self._full = None
+        self._lock = threading.Lock()
+        self._edges = None
+        self._edges_lock = threading.Lock()
+        with perf.span("decode_display", file=os.path.basename(path)) as span:
+            self.pixels = large_image.open_mapped(path, memory_ceiling)
+            if self.pixels is not None:
+                self.full_size = self.pixels.size
+                self.display = self.pixels.thumbnail(display_size)
+            else:
+                with Image.open(path) as image:
+                    self.full_size = image.size
+                    # JPEGs are decoded directly at 1/2, 1/4 or 1/8 scale when that still covers the display size
+                    image.draft(None, display_size)
+                    image.thumbnail(display_size, Image.Resampling.LANCZOS)
+                    self.display = image.copy()
+            span.set(width=self.full_size[0], height=self.full_size[1], display=self.display.size,
+                     mapped=self.pixels is not None)
+        self.display_scale = self.display.width / self.full_size[0]  # Display pixels per full resolution pixel
+
+    # Return the full resolution image, decoding it on first use
+    def full(self):
+        if self.pixels is not None:
+            raise MemoryError(f"{os.path.basename(self.path)} is read from disk as needed, not loaded")
+        with self._lock:
+            if self._full is None:
+                with perf.span("decode_full", file=os.path.basename(self.path), width=self.full_size[0],
+                               height=self.full_size[1]):
+                    image = Image.open(self.path)
+                    image.load()  # Decode now so the file handle is released
+                self._full = image
+            return self._full
+
+    # Whether the full resolution image has been decoded, or is read from disk as needed
+    @property
+    def loaded(self):
+        return self._full is not None or self.pixels is not None
+
+    # Decode the full resolution image in the background so it is ready when it is first needed
+    def preload(self):
+        if not self.loaded:
+            threading.Thread(target=self.full, daemon=True).start()
+
+    # Return the edge map of the full resolution image (an edge_snap.EdgeMap), computing it on first use
+    def edges(self):
+        with self._edges_lock:
+            if self._edges is None:
+                import edge_snap
+                with perf.span("edge_map", file=os.path.basename(self.path), width=self.full_size[0],
+                               height=self.full_size[1]):
+                    if self.pixels is not None:
+                        self._edges = edge_snap.EdgeMap(pixels=self.pixels)  # Computed around each click
+                    else:
+                        self._edges = edge_snap.EdgeMap.from_image(self.full())
+            return self._edges
+
+    # Whether the edge map is ready, so a click can be snapped without waiting for it
+    @property
+    def edges_ready(self):
+        return self._edges is not None
+
+    # Compute the edge map in the background so it is ready by the first click
+    def preload_edges(self):
+        if not self.edges_ready:
+            threading.Thread(target=self.edges, daemon=True).start()
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+import math
+import os
+import struct
+import tempfile
+import zlib
+import numpy as np
+from PIL import Image
+
+MEMORY_CEILING = 1024 * 2 ** 20  # Largest decoded image in bytes held in memory by default
+STRIP_BYTES = 16 * 2 ** 20  # Size of the strips an image is converted or written in
+# numpy type and number of bands of the raw pixel layouts of uncompressed TIFFs that can be mapped
+RAW_LAYOUTS = {"L": ("u1", 1), "I;16": ("<u2", 1), "I;16B": (">u2", 1), "RGB": ("u1", 3), "RGBX": ("u1", 4),
+               "RGBA": ("u1", 4), "RGB;16L": ("<u2", 3), "RGB;16B": (">u2", 3), "RGBA;16L": ("<u2", 4),
+               "RGBA;16B": (">u2", 4)}
+EIGHT_BIT_MODES = ("1", "L", "P", "LA", "PA", "RGB", "RGBA", "RGBX", "CMYK", "YCbCr")
+
+
+# Pixels of an image held in a numpy array of shape (height, width) or (height, width, bands), usually memory mapped
+# from the image file, so only the rows that are looked at are read. High bit depth pixels are scaled to 8 bits from
+# white, the level shown as full white.
+class MappedImage:
+    def __init__(self, array, white=None):
+        self.array = array
+        self.height, self.width = array.shape[:2]
+        self.size = (self.width, self.height)
+        self.white = white or (255 if array.dtype == np.uint8 else white_level(array))
+
+    # Convert a block of pixels to an 8-bit RGB image
+    def to_rgb(self, block):
+        if block.ndim == 3:
+            block = block[..., :3]
+        if self.white != 255 or block.dtype != np.uint8:
+            block = np.clip(block.astype(np.float32) * (255 / self.white), 0, 255).astype(np.uint8)
+        image = Image.fromarray(np.ascontiguousarray(block))
+        return image if image.mode == "RGB" else image.convert("RGB")
+
+    # Return the region box (x0, y0, x1, y1) of the image as an RGB image of the given size. When the region is
+    # reduced, only every step-th row and column is read, with oversample times as many as the output size needs.
+    def region(self, box, size, resample=Image.Resampling.BILINEAR, oversample=1):
+        x0, y0, x1, y1 = (int(math.floor(box[0])), int(math.floor(box[1])), int(math.ceil(box[2])),
+                          int(math.ceil(box[3])))
+        x0, y0 = max(0, x0), max(0, y0)
+        x1, y1 = min(self.width, max(x0 + 1, x1)), min(self.height, max(y0 + 1, y1))
+        step = max(1, int(min((x1 - x0) / size[0], (y1 - y0) / size[1]) / oversample))
+        block = self.to_rgb(self.array[y0:y1:step, x0:x1:step])
+        # Box of the requested region within the block that was read
+        inner = ((box[0] - x0) / step, (box[1] - y0) / step, (box[2] - x0) / step, (box[3] - y0) / step)
+        inner = tuple(min(max(value, 0), limit) for value, limit in zip(inner, block.size * 2))
+        return block.resize(size, resample, box=inner)
+
+    # Return the region box (x0, y0, x1, y1) in whole pixels as an RGB image, black outside the image, like
+    # Image.crop
+    def crop(self, box):
+        x0, y0, x1, y1 = (int(value) for value in box)
+        image = Image.new("RGB", (x1 - x0, y1 - y0))
+        left, top, right, bottom = max(0, x0), max(0, y0), min(self.width, x1), min(self.height, y1)
+        if right > left and bottom > top:
+            image.paste(self.to_rgb(self.array[top:bottom, left:right]), (left - x0, top - y0))
+        return image
+
+    # Return an RGB copy that fits within size, keeping the aspect ratio
+    def thumbnail(self, size):
+        ratio = min(size[0] / self.width, size[1] / self.height, 1.0)
+        target = (max(1, round(self.width * ratio)), max(1, round(self.height * ratio)))
+        return self.region((0, 0, self.width, self.height), target, Image.Resampling.LANCZOS, oversample=2)
+
+    # Render the part of the image under a view_width x view_height viewport with the image's upper left corner at
+    # (image_x, image_y), like ZoomPyramid.render
+    def render(self, zoom, image_x, image_y, view_width, view_height, resample=Image.Resampling.BILINEAR):
+        dx0 = max(0, math.floor(image_x))
+        dy0 = max(0, math.floor(image_y))
+        dx1 = min(view_width, math.ceil(image_x + self.width * zoom))
+        dy1 = min(view_height, math.ceil(image_y + self.height * zoom))
+        if dx1 <= dx0 or dy1 <= dy0:
+            return None, 0, 0
+        box = ((dx0 - image_x) / zoom, (dy0 - image_y) / zoom, (dx1 - image_x) / zoom, (dy1 - image_y) / zoom)
+        return self.region(box, (dx1 - dx0, dy1 - dy0), resample), dx0, dy0
+
+    # Yield (top row, RGB strip) over the full resolution image in strips of about STRIP_BYTES
+    def strips(self):
+        rows = max(1, STRIP_BYTES // (self.width * 3))
+        for y in range(0, self.height, rows):
+            yield y, self.to_rgb(self.array[y:y + rows])
+
+
+# Level of high bit depth pixels shown as white, from a sample of the array: the 99.9th percentile, so a 12-bit sensor
+# stored in 16 bits is not shown almost black
+def white_level(array):
+    step = max(1, int(math.sqrt(array.shape[0] * array.shape[1] / 1e6)))
+    sample = np.asarray(array[::step, ::step])
+    sample = sample[..., :3] if sample.ndim == 3 else sample
+    return max(1.0, float(np.percentile(sample, 99.9)))
+
+
+# Memory map the pixels of an uncompressed TIFF whose strips are stored one after another, or return None
+def map_tiff(path, image):
+    if image.format != "TIFF" or image.info.get("compression") != "raw" or getattr(image, "n_frames", 1) != 1:
+        return None
+    tiles = sorted(image.tile, key=lambda tile: tile[2])
+    rawmode = tiles[0][3][0] if isinstance(tiles[0][3], tuple) else tiles[0][3]
+    if rawmode not in RAW_LAYOUTS:
+        return None
+    dtype, bands = RAW_LAYOUTS[rawmode]
+    row_bytes = image.width * bands * np.dtype(dtype).itemsize
+    offset, y = tiles[0][2], 0
+    for codec, extents, tile_offset, args in tiles:
+        # Every strip must be whole rows, top down, without padding, directly after the previous one
+        if codec != "raw" or args[0] != rawmode or (len(args) > 1 and args[1] not in (0, row_bytes)) or \
+                (len(args) > 2 and args[2] != 1) or extents[0] != 0 or extents[2] != image.width or \
+                extents[1] != y or tile_offset != offset + y * row_bytes:
+            return None
+        y = extents[3]
+    if y != image.height:
+        return None
+    shape = (image.height, image.width) if bands == 1 else (image.height, image.width, bands)
+    return np.memmap(path, dtype=dtype, mode="r", offset=offset, shape=shape)
+
+
+# Mode an opened image is converted to for its pixels to be held in an array: 8-bit images as L, RGB or RGBA, 16-bit
+# images as they are, and other high bit depth images as 32-bit integers
+def array_mode(image):
+    if image.mode in ("L", "RGB", "RGBA") or image.mode.startswith("I;16"):
+        return image.mode
+    return "RGB" if image.mode in EIGHT_BIT_MODES else "I"
+
+
+# Decode an image into an array of the given mode in strips of about STRIP_BYTES, so no full size copy is made beside
+# the decoded image. Images that would take more than memory_ceiling bytes are written to a temporary file through
+# the file rather than a writable map, so the pixels written do not count against the memory of the program, and
+# mapped from it.
+def decode_strips(image, mode, memory_ceiling):
+    sample = np.asarray(Image.new(mode, (1, 1)))  # Type and bands of the array without decoding the image
+    shape = (image.height, image.width) + sample.shape[2:]
+    row_bytes = image.width * sample[0].nbytes
+    rows = max(1, STRIP_BYTES // max(1, row_bytes))
+    spill = image.height * row_bytes > memory_ceiling
+    if spill:
+        file = tempfile.TemporaryFile(prefix="droop_", suffix=".raw")
+    else:
+        array = np.empty(shape, dtype=sample.dtype)
+    for y in range(0, image.height, rows):
+        strip = image.crop((0, y, image.width, min(image.height, y + rows)))
+        strip = np.asarray(strip if strip.mode == mode else strip.convert(mode), dtype=sample.dtype)
+        if spill:
+            file.write(np.ascontiguousarray(strip))
+        else:
+            array[y:y + rows] = strip
+    if spill:
+        file.flush()
+        array = np.memmap(file, dtype=sample.dtype, mode="r", shape=shape)
+    return array
+
+
+# Open an image as a MappedImage when it has a high bit depth or would take more than memory_ceiling bytes decoded,
+# or return None when it is simply decoded into memory
+def open_mapped(path, memory_ceiling=None):
+    memory_ceiling = MEMORY_CEILING if memory_ceiling is None else memory_ceiling
+    with Image.open(path) as image:
+        bands = len(image.getbands())
+        if image.mode in EIGHT_BIT_MODES and image.width * image.height * bands <= memory_ceiling:
+            return None
+        array = map_tiff(path, image)
+        if array is None:
+            # Compressed images are decoded once, then read from disk when they do not fit in memory
+            array = decode_strips(image, array_mode(image), memory_ceiling)
+    return MappedImage(array)
+
+
+# Write an RGB image of the given size as a PNG from the strips yielded by strips, without holding the whole image
+def write_png(path, size, strips, compress_level=1):
+    width, height = size
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    compressor = zlib.compressobj(compress_level)
+    rows = 0
+    with open(path, "wb") as file:
+        file.write(b"\x89PNG\r\n\x1a\n")
+        file.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        for strip in strips:
+            pixels = np.asarray(strip.convert("RGB"), dtype=np.uint8).reshape(strip.height, width * 3)
+            # Every row starts with its filter type, 0 for none
+            data = np.hstack([np.zeros((strip.height, 1), dtype=np.uint8), pixels]).tobytes()
+            rows += strip.height
+            compressed = compressor.compress(data)
+            if compressed:
+                file.write(chunk(b"IDAT", compressed))
+        file.write(chunk(b"IDAT", compressor.flush()))
+        file.write(chunk(b"IEND", b""))
+    if rows != height:
+        os.remove(path)
+        raise ValueError(f"expected {height} rows, got {rows}")
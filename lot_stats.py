@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+"""
+Summarize the droop measurements of one or more lot folders per lot and subject:
+
+    python lot_stats.py <lot folder> [...] [--output statistics.csv]
+
+Every folder's journals are read (or its workbook when it has no journal). Count, mean, standard deviation, min, max,
+control limits and control limit violations are printed per lot and written per lot and subject to the CSV file.
+"""
+import argparse
+import csv
+import math
+import os
+import tkinter as tk
+from tkinter import messagebox
+from tkinter import ttk
+import numpy as np
+import measurement_store
+
+CONTROL_SIGMA = 3.0  # Control limits are the mean plus and minus this many standard deviations
+MIN_BASELINE = 5  # Measurements of a group before its control limits are used
+HEADERS = ["Lot #", "Subject", "Count", "Mean (mm)", "Std (mm)", "Min (mm)", "Max (mm)", "LCL (mm)", "UCL (mm)",
+           "Violations"]
+
+
+# Count, mean, spread and range of a stream of measurements, updated one value at a time (Welford's algorithm). A
+# value is a control limit violation when it falls outside the control limits of the values before it.
+class RunningStats:
+    def __init__(self, count=0, mean=0.0, m2=0.0, minimum=math.inf, maximum=-math.inf, violations=0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2  # Sum of squared differences from the mean
+        self.minimum = minimum
+        self.maximum = maximum
+        self.violations = violations
+
+    @property
+    def std(self):
+        return math.sqrt(self.m2 / (self.count - 1)) if self.count > 1 else 0.0
+
+    # Lower and upper control limits, or None while there are too few values
+    def limits(self):
+        if self.count < MIN_BASELINE:
+            return None
+        return self.mean - CONTROL_SIGMA * self.std, self.mean + CONTROL_SIGMA * self.std
+
+    # Add a value and return whether it violates the control limits
+    def add(self, value):
+        limits = self.limits()
+        violation = limits is not None and not limits[0] <= value <= limits[1]
+        self.violations += violation
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.minimum = min(self.minimum, value)
+        self.maximum = max(self.maximum, value)
+        return violation
+
+
+# Number the distinct labels in order of first appearance, returning the labels and the code of each one given
+def encode(labels):
+    numbers = {}
+    codes = np.fromiter((numbers.setdefault(str(label), len(numbers)) for label in labels), dtype=np.int64)
+    return list(numbers), codes
+
+
+# Statistics of the measurements per lot and per (lot, subject), with the series of every lot for its control chart
+class LotStatistics:
+    def __init__(self):
+        self.groups = {}  # RunningStats of each (lot, None) and (lot, subject)
+        self.series = {}  # Values of each lot in the order they were measured, with whether each was a violation
+
+    # Build the statistics of journal rows (MeasurementStore.merged_rows) at once with numpy. The result is the same
+    # as adding the rows one at a time.
+    @classmethod
+    def from_rows(cls, rows):
+        statistics = cls()
+        if not rows:
+            return statistics
+        lot_names, lots = encode(row[1] for row in rows)
+        subject_names, subjects = encode(row[2] for row in rows)
+        values = np.fromiter((row[3] for row in rows), dtype=np.float64, count=len(rows))
+        n = len(subject_names)
+        statistics.add_groups(lots * n + subjects, values, lambda code: (lot_names[code // n], subject_names[code % n]))
+        violations, order, starts = statistics.add_groups(lots, values, lambda code: (lot_names[code], None))
+        # The values and violations of each lot, in the order they were measured
+        for lot, indexes in zip(lot_names, np.split(order, starts[1:])):
+            statistics.series[lot] = list(zip(values[indexes].tolist(), violations[indexes].tolist()))
+        return statistics
+
+    # Add the groups of values given by integer codes, from arrays in measurement order, with key returning the group
+    # key of a code. Every value's control limits come from the values of its group before it, using cumulative sums.
+    # Returns whether each value violates them, the order that sorts the values by group and where each group starts
+    # in that order.
+    def add_groups(self, codes, values, key):
+        order = np.argsort(codes, kind="stable")
+        grouped = values[order]
+        starts = np.flatnonzero(np.r_[True, np.diff(codes[order]) != 0])
+        counts = np.diff(np.r_[starts, len(grouped)])
+        # Position of each value within its group, and the sums of the values of its group before it
+        position = np.arange(len(grouped)) - np.repeat(starts, counts)
+        sums = np.cumsum(grouped) - grouped
+        squares = np.cumsum(grouped * grouped) - grouped * grouped
+        sums -= np.repeat(sums[starts], counts)
+        squares -= np.repeat(squares[starts], counts)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            mean = sums / position
+            std = np.sqrt(np.maximum(squares - position * mean * mean, 0) / (position - 1))
+        violation = (position >= MIN_BASELINE) & (np.abs(grouped - mean) > CONTROL_SIGMA * std)
+        totals = np.add.reduceat(grouped, starts)
+        group_mean = totals / counts
+        deviations = grouped - np.repeat(group_mean, counts)
+        m2 = np.add.reduceat(deviations * deviations, starts)
+        minimum, maximum = np.minimum.reduceat(grouped, starts), np.maximum.reduceat(grouped, starts)
+        group_violations = np.add.reduceat(violation.astype(np.int64), starts)
+        for i, code in enumerate(codes[order][starts].tolist()):
+            self.groups[key(code)] = RunningStats(int(counts[i]), float(group_mean[i]), float(m2[i]),
+                                                   float(minimum[i]), float(maximum[i]), int(group_violations[i]))
+        violations = np.empty(len(values), dtype=bool)
+        violations[order] = violation
+        return violations, order, starts
+
+    # Add a single measurement, returning whether it violates the control limits of its lot
+    def add(self, lot, subject, distance):
+        distance = float(distance)
+        self.groups.setdefault((lot, subject), RunningStats()).add(distance)
+        violation = self.groups.setdefault((lot, None), RunningStats()).add(distance)
+        self.series.setdefault(lot, []).append((distance, violation))
+        return violation
+
+    # Row of the summary for a group
+    def row(self, key):
+        stats = self.groups[key]
+        limits = stats.limits() or (None, None)
+        return [key[0], key[1] or "All", stats.count, stats.mean, stats.std, stats.minimum, stats.maximum, *limits,
+                stats.violations]
+
+    # Keys of the groups, each lot followed by its subjects
+    def keys(self):
+        return sorted(self.groups, key=lambda key: (key[0], key[1] or ""))
+
+    # Rows of the summary, each lot followed by its subjects
+    def rows(self):
+        return [self.row(key) for key in self.keys()]
+
+    # Write the summary to a CSV file
+    def export(self, path):
+        with open(path, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(HEADERS)
+            for row in self.rows():
+                writer.writerow([f"{value:.4f}" if isinstance(value, float) else value for value in row])
+        return path
+
+
+# Window with the statistics of every lot and subject and the control chart of the selected lot, updated as
+# measurements are added
+class StatisticsPanel(tk.Toplevel):
+    def __init__(self, master, statistics, title, export_path):
+        super().__init__(master)
+        self.title(title)
+        self.geometry("820x660")
+        self.statistics = statistics
+        self.export_path = export_path
+        self.selected_lot = None
+        self.items = {}  # Table row of each group key
+        self.item_keys = {}  # Group key of each table row
+        self.table = ttk.Treeview(self, columns=HEADERS, show="headings", height=10)
+        for header in HEADERS:
+            self.table.heading(header, text=header)
+            self.table.column(header, width=76, anchor=tk.E)
+        self.table.pack(side=tk.TOP, fill=tk.X, padx=10, pady=10)
+        self.table.bind("<<TreeviewSelect>>", self.select)
+        self.chart = tk.Canvas(self, bg="white", height=320)
+        self.chart.pack(side=tk.TOP, fill=tk.BOTH, expand=True, padx=10, pady=10)
+        self.chart.bind("<Configure>", lambda event: self.draw_chart())
+        tk.Button(self, text="Export Statistics", command=self.export).pack(pady=(0, 10))
+        self.table.tag_configure("violation", foreground="red")
+        for key in self.statistics.keys():
+            self.show_row(key)
+        if self.statistics.series:
+            self.selected_lot = next(iter(self.statistics.series))
+
+    # Show the lot of a selected row on the chart
+    def select(self, event=None):
+        selection = self.table.selection()
+        if selection:
+            self.selected_lot = self.item_keys[selection[0]][0]
+            self.draw_chart()
+
+    # Add or update the table row of a group
+    def show_row(self, key):
+        values = [f"{value:.3f}" if isinstance(value, float) else "-" if value is None else value
+                  for value in self.statistics.row(key)]
+        tags = ("violation",) if self.statistics.groups[key].violations else ()
+        if key in self.items:
+            self.table.item(self.items[key], values=values, tags=tags)
+        else:
+            self.items[key] = self.table.insert("", tk.END, values=values, tags=tags)
+            self.item_keys[self.items[key]] = key
+
+    # Add a measurement, updating only the rows of its lot and subject, and the chart
+    def add(self, lot, subject, distance):
+        self.statistics.add(lot, subject, distance)
+        self.show_row((lot, None))
+        self.show_row((lot, subject))
+        self.selected_lot = lot
+        self.draw_chart()
+
+    def export(self):
+        self.statistics.export(self.export_path)
+        messagebox.showinfo("Export Statistics", f"Statistics written to {os.path.basename(self.export_path)}")
+
+    # Draw the individual measurements of the selected lot in order, with its centre line and control limits and the
+    # violations in red
+    def draw_chart(self):
+        self.chart.delete("all")
+        series = self.statistics.series.get(self.selected_lot)
+        if not series:
+            return
+        stats = self.statistics.groups[(self.selected_lot, None)]
+        width, height, margin = self.chart.winfo_width(), self.chart.winfo_height(), 50
+        values = [value for value, _ in series]
+        limits = stats.limits()
+        low, high = min(values + list(limits or ())), max(values + list(limits or ()))
+        span = (high - low) or 1.0
+        low, high = low - 0.05 * span, high + 0.05 * span
+
+        def at(index, value):
+            x = margin + (width - 2 * margin) * (index / max(1, len(series) - 1))
+            return x, height - margin - (height - 2 * margin) * (value - low) / (high - low)
+        self.chart.create_text(width / 2, 15, text=f"Lot {self.selected_lot} - {stats.count} measurements")
+        lines = [("Mean", stats.mean, "green")]
+        if limits is not None:
+            lines += [("LCL", limits[0], "red"), ("UCL", limits[1], "red")]
+        for label, value, color in lines:
+            y = at(0, value)[1]
+            self.chart.create_line(margin, y, width - margin, y, fill=color, dash=(4, 4))
+            self.chart.create_text(width - margin + 4, y, text=f"{label}\n{value:.2f}", anchor=tk.W, fill=color,
+                                   font="TkDefaultFont 8")
+        # Only about one point per pixel is drawn for long series
+        step = max(1, len(series) // max(1, width - 2 * margin))
+        points = [coordinate for index in range(0, len(series), step) for coordinate in at(index, values[index])]
+        if len(points) >= 4:
+            self.chart.create_line(*points, fill="gray40")
+        for index, (value, violation) in enumerate(series):
+            if violation or (step == 1 and len(series) <= 500):
+                x, y = at(index, value)
+                color = "red" if violation else "blue"
+                self.chart.create_oval(x - 3, y - 3, x + 3, y + 3, fill=color, outline=color)
+        self.chart.create_text(margin - 4, at(0, high)[1], text=f"{high:.2f}", anchor=tk.E, font="TkDefaultFont 8")
+        self.chart.create_text(margin - 4, at(0, low)[1], text=f"{low:.2f}", anchor=tk.E, font="TkDefaultFont 8")
+
+
+# Journal rows of a lot folder, or the rows of its workbook when it has no journal
+def read_folder(folder):
+    if measurement_store.journal_paths(folder):
+        return measurement_store.merged_rows(folder)
+    excel_path = os.path.join(folder, os.path.basename(folder) + "_Droop_Measurements.xlsx")
+    if not os.path.exists(excel_path):
+        return []
+    import pandas as pd
+    df = pd.read_excel(excel_path)
+    return [(None, str(lot), str(subject), float(distance), None, None)
+            for lot, subject, distance in df[measurement_store.HEADERS].itertuples(index=False)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Summarize the droop measurements of lot folders")
+    parser.add_argument("folders", nargs="+", help="lot folders")
+    parser.add_argument("--output", help="CSV file for the summary per lot and subject")
+    args = parser.parse_args(argv)
+
+    rows = []
+    for folder in args.folders:
+        try:
+            rows.extend(read_folder(os.path.abspath(folder)))
+        except OSError as e:
+            print(f"Error: {folder}: {e}")
+    statistics = LotStatistics.from_rows(rows)
+    print(f"{'Lot #':<16}{'Count':>8}{'Mean':>10}{'Std':>10}{'Min':>10}{'Max':>10}{'Violations':>12}")
+    for row in statistics.rows():
+        if row[1] == "All":
+            print(f"{row[0]:<16}{row[2]:>8}{row[3]:>10.3f}{row[4]:>10.3f}{row[5]:>10.3f}{row[6]:>10.3f}{row[9]:>12}")
+    if args.output:
+        statistics.export(args.output)
+        print(f"Summary written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+import math
+import tkinter as tk
+from PIL import Image, ImageDraw, ImageTk
+
+
+# Magnified view of the image pixels around the mouse, drawn next to the cursor with a crosshair and the overlay
+# lines and points. Each move crops a few source pixels from a buffer that is already in memory (or mapped), scales
+# them up and pastes them into a single canvas image, and moves are coalesced to one redraw per pass of the event loop.
+class Loupe:
+    def __init__(self, canvas, get_source, overlay, size=160, zoom=8):
+        self.canvas = canvas
+        self.get_source = get_source  # Returns the source buffer and its pixels per full resolution pixel
+        self.overlay = overlay  # OverlayLayer whose lines and points are shown in the loupe
+        self.size = size  # Side of the loupe in canvas pixels
+        self.zoom = zoom  # Loupe pixels per full resolution pixel
+        self.photo = ImageTk.PhotoImage("RGB", (size, size))
+        self.image_item = canvas.create_image(0, 0, anchor=tk.NW, image=self.photo, state=tk.HIDDEN, tags="loupe")
+        self.border = canvas.create_rectangle(0, 0, 0, 0, outline="black", width=2, state=tk.HIDDEN, tags="loupe")
+        self.position = None  # Latest canvas and image position of the mouse
+        self.pending = False
+
+    # Show the loupe for the mouse at canvas position (x, y) over the full resolution image point (image_x, image_y)
+    def move(self, x, y, image_x, image_y):
+        self.position = (x, y, image_x, image_y)
+        if not self.pending:
+            self.pending = True
+            self.canvas.after_idle(self.draw)
+
+    def hide(self):
+        self.position = None
+        self.canvas.itemconfig("loupe", state=tk.HIDDEN)
+
+    # Change the magnification and redraw at the latest mouse position
+    def set_zoom(self, zoom):
+        self.zoom = zoom
+        if self.position is not None:
+            self.move(*self.position)
+
+    # Crop and magnify the source around the latest mouse position
+    def draw(self):
+        self.pending = False
+        if self.position is None:
+            return
+        x, y, image_x, image_y = self.position
+        self.photo.paste(self.render(image_x, image_y))
+        # Keep the loupe beside the cursor, on the side where it fits in the canvas
+        offset = 24
+        left = x + offset if x + offset + self.size <= self.canvas.winfo_width() else x - offset - self.size
+        top = y - offset - self.size if y - offset - self.size >= 0 else y + offset
+        self.canvas.coords(self.image_item, left, top)
+        self.canvas.coords(self.border, left, top, left + self.size, top + self.size)
+        self.canvas.itemconfig("loupe", state=tk.NORMAL)
+        self.canvas.tag_raise("loupe")
+
+    # Return the magnified RGB view of size x size pixels centred on a full resolution image point
+    def render(self, image_x, image_y):
+        source, scale = self.get_source()
+        half = self.size / self.zoom / 2  # Full resolution pixels from the centre to the edge of the loupe
+        # Crop whole source pixels around the view, then scale the exact view up without smoothing the pixels
+        box = ((image_x - half) * scale, (image_y - half) * scale, (image_x + half) * scale, (image_y + half) * scale)
+        x0, y0 = math.floor(box[0]), math.floor(box[1])
+        crop = source.crop((x0, y0, math.ceil(box[2]) + 1, math.ceil(box[3]) + 1))
+        crop = crop if crop.mode == "RGB" else crop.convert("RGB")
+        view = crop.resize((self.size, self.size), Image.Resampling.NEAREST,
+                           box=(box[0] - x0, box[1] - y0, box[2] - x0, box[3] - y0))
+
+        draw = ImageDraw.Draw(view)
+
+        # Position of a full resolution image point in the loupe
+        def at(px, py):
+            return (px - image_x) * self.zoom + self.size / 2, (py - image_y) * self.zoom + self.size / 2
+        for item in self.overlay.items.values():
+            if item["kind"] == "line" and item["coords"] is not None:
+                x1, y1, x2, y2 = item["coords"]
+                draw.line(at(x1, y1) + at(x2, y2), fill=item["color"], width=1)
+        for click in self.overlay.clicks:
+            if click is not None:
+                cx, cy = at(*click)
+                draw.ellipse((cx - 4, cy - 4, cx + 4, cy + 4), outline="gray50", width=1)
+        for px, py in self.overlay.points:
+            cx, cy = at(px, py)
+            draw.ellipse((cx - 3, cy - 3, cx + 3, cy + 3), outline="red", width=2)
+        # Crosshair with a gap, so the pixel under the mouse stays visible
+        c, gap = self.size / 2, max(3, self.zoom)
+        for line in ((0, c, c - gap, c), (c + gap, c, self.size, c), (c, 0, c, c - gap), (c, c + gap, c, self.size)):
+            draw.line(line, fill="cyan", width=1)
+        return view
@@ -4,27 +4,78 @@ Created on Tue Mar 19 08:03:01 2024
 
 @author: jeizadi
 """
+import importlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-import math, os
-import numpy as np
-import pandas as pd
 import tkinter as tk
 from tkinter import filedialog
 from tkinter import messagebox
-from PIL import Image, ImageTk, ImageDraw, ImageFont
+from tkinter import simpledialog
+import droop_core
+from measurement_store import MeasurementStore
+from output_writer import OutputWriter
+from overlay import OverlayLayer
+import perf
+import setup_profile
+
+# Modules that load numpy, Pillow or pandas are imported where they are first used so the window opens without
+# waiting for them, and are warmed in the background once the window is up
+DEFERRED_IMPORTS = ["PIL.Image", "PIL.ImageTk", "image_source", "viewport", "numpy", "registration", "scale_detect",
+                    "droop_detect", "work_queue", "loupe", "PIL.ImageDraw", "PIL.ImageFont", "pandas",
+                    "sequence", "browser", "lot_stats",
+                    "edge_snap"]
+
+ZOOM_STEP = 1.25  # Zoom change per mouse wheel step
+MAX_ZOOM = 8.0  # Largest zoom relative to the displayed image size
+SCALE_TICK_MM = 1.0  # Spacing of the ticks on the calibration scale
+SCALE_CONFIDENCE = 0.3  # Smallest confidence at which a detected scale is proposed or checked
+SCALE_TOLERANCE = 0.02  # Relative difference between the detected scale and the calibration that is flagged
+DRIFT_PIXELS = 10.0  # Camera shift in full resolution pixels that is flagged
+DRIFT_DEGREES = 0.5  # Camera rotation in degrees that is flagged
+MIN_MATCH = 0.1  # Smallest registration peak at which an image is considered to match the reference
+OUTPUT_FORMAT = "PNG"  # Format of the annotated output image, "PNG" or "JPEG"
+PNG_COMPRESS_LEVEL = 1  # 0 (largest, fastest) to 9 (smallest, slowest)
+JPEG_QUALITY = 95
+MAX_PENDING_SAVES = 4  # Accepted measurements that may wait to be saved before accepting blocks
+# Write the annotated image of each measurement; its record is always written, and images can be rendered from the
+# records later with records.py
+SAVE_ANNOTATED = True
+PREFETCH_IMAGES = 3  # Upcoming images of a lot folder prepared in the background
+PREFETCH_WORKERS = 2  # Threads decoding the upcoming images
+PREFETCH_MEMORY_MB = 512  # Largest memory held by prefetched full resolution images
+# Largest decoded image held in memory; larger and high bit depth images are read from disk as they are viewed
+MEMORY_CEILING_MB = 1024
+LOUPE_SIZE = 160  # Side of the magnifier loupe in screen pixels
+LOUPE_ZOOM = 8  # Initial loupe magnification, in screen pixels per full resolution pixel
+LOUPE_MIN_ZOOM = 4
+LOUPE_MAX_ZOOM = 16
+SNAP_RADIUS = 8  # Distance in screen pixels from a click within which it snaps to an edge
+FILE_TYPES = [("Image files", " ".join("*" + ext for ext in droop_core.IMAGE_TYPES)), ("JPG files", "*.jpg")]
+STATION = None  # Name of this bench in the journals of a shared lot folder, the computer name when None
+# Log the time of every stage to perf.LOG_DIR (~/.leaflet_droop/logs/perf.jsonl), also turned on by setting the
+# DROOP_PERF environment variable
+PERF_LOG = False
 
 
 class MaterialMeasurement(tk.Tk):
     def __init__(self):
         super().__init__()
         self.tk_image = None
-        self.tk_img = None
         self.image_y = None
         self.image_x = None
-        self.offset_y = None
-        self.offset_x = None
         self.canvas = None
+        self.image_item = None
         self.image = None
+        self.source = None
+        self.pyramid = None
+        self.full_pyramid = None
+        self.render_pending = False
+        self.pan_start = None
+        self.overlay = None
+        self.fitted_line = None  # Line fit through the points of the current routine
+        self.drag_index = None  # Index of the point being dragged
         self.image_lot = None
         self.folder_path = None
         self.file_path = None
@@ -34,7 +85,11 @@ class MaterialMeasurement(tk.Tk):
         self.image_width = None
         self.zoom_mode = None
         self.zoom_factor = 1.0
+        self.loupe = None
+        self.loupe_zoom = LOUPE_ZOOM
         self.title("Measurement Window")
+        if PERF_LOG or os.environ.get("DROOP_PERF"):
+            perf.enable(perf.LOG_DIR)
         # Calculate a reasonable size and position for the window
         screen_width = self.winfo_screenwidth()
         screen_height = self.winfo_screenheight()
@@ -54,8 +109,25 @@ class MaterialMeasurement(tk.Tk):
         # Create a button to open another video file
         open_button = tk.Button(self.control_panel, text="Select An Image File", command=self.open_file)
         open_button.pack(padx=10, pady=10)
+        # Or work through every unmeasured image of a lot folder in turn
+        tk.Button(self.control_panel, text="Open Lot Folder", command=self.open_folder).pack(padx=10, pady=10)
+        # Or pick images from thumbnails of a lot folder showing which are measured
+        tk.Button(self.control_panel, text="Browse Lot", command=self.browse_lot).pack(padx=10, pady=10)
+        self.browser = None
+        self.work_queue = None
+        # Decodes the selected image off the event loop, so opening a large image does not freeze the window
+        self.loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="open")
+        self.loading = None  # Future of the image being opened
+        self.queue_label = tk.Label(self.control_panel)  # Images left in the lot folder
+        self.queue_label.pack(pady=10)
+        self.skip_button = tk.Button(self.control_panel, text="Skip Image", command=self.open_next)
         self.label = tk.Label(self.control_panel)
         self.label.pack(pady=10)
+        self.scale_check_label = tk.Label(self.control_panel)  # Result of checking the calibration on each image
+        self.scale_check_label.pack(pady=10)
+        self.drift_label = tk.Label(self.control_panel)  # Result of registering each image against the reference
+        self.drift_label.pack(pady=10)
+        self.image_flags = set()  # Checks the current image failed, saved with its measurement: "scale", "drift"
 
         self.cal_flag = False  # Track calibration identifier
         self.horz_flag = False  # Track horizontal identifier
@@ -66,43 +138,212 @@ class MaterialMeasurement(tk.Tk):
         self.re_cal_button = tk.Button(self.control_panel, text="Re-Calibrate", command=self.calibration)
         self.re_horz_button = tk.Button(self.control_panel, text="Re-Draw Horizontal", command=self.draw_horizontal)
         self.entry = tk.Entry(self.control_panel)
+        self.export_button = tk.Button(self.control_panel, text="Export to Excel", command=self.export_measurements)
+        self.statistics_button = tk.Button(self.control_panel, text="Lot Statistics", command=self.show_statistics)
+        self.statistics = None  # Statistics of the current lot, built on first view and updated with each measurement
+        self.statistics_panel = None
+        # Follow the droop point through the images of the folder from the current one on
+        self.track_button = tk.Button(self.control_panel, text="Track Image Sequence", command=self.toggle_tracking)
+        self.tracking = None  # Progress of the sequence being tracked in the background
+        # Optionally propose the droop point from the image when a measurement starts
+        self.auto_detect = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.control_panel, text="Auto-detect droop point", variable=self.auto_detect,
+                       command=self.toggle_auto_detect).pack(pady=10)
+        # Optionally magnify the pixels around the mouse for precise point picking
+        self.show_loupe = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.control_panel, text="Magnifier loupe", variable=self.show_loupe,
+                       command=self.toggle_loupe).pack(pady=10)
+        # Optionally move clicked points onto the strongest nearby edge of the image
+        self.snap_edges = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.control_panel, text="Snap points to edges", variable=self.snap_edges,
+                       command=self.toggle_snap).pack(pady=10)
+        # Optionally show the latest frame, decode and save times over the image
+        self.show_hud = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.control_panel, text="Show performance", variable=self.show_hud,
+                       command=self.toggle_hud).pack(pady=10)
         self.points = []
+        self.store = None  # Measurement journal for the current lot folder
+        # Saves accepted measurements in the background
+        self.writer = OutputWriter(OUTPUT_FORMAT, compress_level=PNG_COMPRESS_LEVEL, quality=JPEG_QUALITY,
+                                   max_pending=MAX_PENDING_SAVES, save_images=SAVE_ANNOTATED)
+        self.after(1000, self.check_writer)
+        self.after(100, self.warm_imports)  # Load the heavy libraries once the window is up
+        self.protocol("WM_DELETE_WINDOW", self.on_close)  # Export the measurements when the window is closed
+
+        # Fixed rig set-up: reference image and the lines drawn on it, saved as a named profile
+        self.profile_name = setup_profile.DEFAULT_PROFILE
+        self.reference = None
+        self.reference_path = None  # Reference image of a loaded profile, read on first use
+        self.reference_factor = None
+        self.reference_lines = None
+        tk.Button(self.control_panel, text="Load Setup Profile", command=self.load_profile).pack(pady=10)
+        tk.Button(self.control_panel, text="Save Setup Profile As", command=self.save_profile_as).pack(pady=10)
+        name = setup_profile.last_profile()
+        if name is not None:
+            self.apply_profile(name)  # Restore the last set-up so a restart does not require a recalibration
 
     def open_file(self):
+        file = filedialog.askopenfilename(title="Select an image file", filetypes=FILE_TYPES)
+        if file:
+            self.close_queue()  # A single selected image leaves the lot folder queue
+            self.load_image(file)
+
+    # Queue every unmeasured image of a lot folder and open the first one
+    def open_folder(self):
+        folder = filedialog.askdirectory(title="Select a lot folder")
+        if not folder:
+            return
+        from work_queue import WorkQueue, unmeasured_images
+        self.close_queue()
+        self.folder_path = folder
+        self.find_or_create_store()
+        self.writer.flush()  # Count the measurements still being saved as measured
+        try:
+            files = unmeasured_images(folder, self.store.measured())
+        except OSError as e:
+            return messagebox.showerror("Folder not found", f"The lot folder could not be read: {e}")
+        self.work_queue = WorkQueue(files, self.display_size(), prefetch=PREFETCH_IMAGES, workers=PREFETCH_WORKERS,
+                                    memory_budget=PREFETCH_MEMORY_MB * 2 ** 20,
+                                    memory_ceiling=MEMORY_CEILING_MB * 2 ** 20)
+        self.skip_button.pack(pady=10)
+        self.open_next()
+
+    # Show the images of a lot folder as thumbnails marked measured, unmeasured or flagged
+    def browse_lot(self):
+        folder = filedialog.askdirectory(title="Select a lot folder", initialdir=self.folder_path)
+        if not folder:
+            return
+        from browser import LotBrowser
+        self.folder_path = folder
+        self.find_or_create_store()
+        self.writer.flush()  # Count the measurements still being saved as measured
+        self.close_browser()
+        try:
+            self.browser = LotBrowser(self, folder, self.store.merged_rows(), self.browse_open)
+        except OSError as e:
+            messagebox.showerror("Folder not found", f"The lot folder could not be read: {e}")
+
+    # Open an image picked in the lot browser, leaving the lot folder queue
+    def browse_open(self, file):
+        self.close_queue()
+        self.load_image(file)
+
+    def close_browser(self):
+        if self.browser is not None and self.browser.winfo_exists():
+            self.browser.close()
+        self.browser = None
+
+    # Open the next image of the lot folder queue, which has usually been decoded in the background already
+    def open_next(self):
+        if self.work_queue is None:
+            return
+        item = self.work_queue.next()
+        if item is None:
+            self.close_queue()
+            self.label.config(text="Every image in the lot folder has been measured")
+            return
+        self.queue_label.config(text=f"{len(self.work_queue)} images left in the lot folder")
+        self.load_image(*item)
+
+    # Decode an image on the loader thread, unless a future of its ImageSource is given, and show it once it is ready.
+    # The image on screen can no longer be measured in the meantime.
+    def load_image(self, file, future=None):
+        if future is None:
+            from image_source import ImageSource
+            future = self.loader.submit(ImageSource, file, self.display_size(), MEMORY_CEILING_MB * 2 ** 20)
+        self.loading = future
+        if future.done():
+            return self.loaded_image(file, future)
+        self.accept_points_button.config(state=tk.DISABLED)
+        if self.canvas is not None:
+            for sequence in self.canvas.bind():
+                self.canvas.unbind(sequence)
+        self.label.config(text=f"Opening {os.path.basename(file)}...")
+        self.after(20, self.loaded_image, file, future)
+
+    # Show an image once its ImageSource is decoded, unless another image was opened since
+    def loaded_image(self, file, future):
+        if future is not self.loading:
+            return
+        if not future.done():
+            return self.after(20, self.loaded_image, file, future)
+        self.loading = None
         try:
-            self.file = filedialog.askopenfilename(title="Select an image file", filetypes=[("JPG files", "*.jpg")])
-            if self.file:
-                if hasattr(self, 'canvas'):
-                    self.canvas.destroy()  # Delete the previous canvas if it exists
-                    self.image_label.pack_forget()
-                self.file_path, ext = os.path.splitext(self.file)
-                self.folder_path, self.image_lot = os.path.split(self.file_path)  # Isolate the folder path
-                # Create a new canvas and display the selected image
-                self.image = Image.open(self.file)
-                self.resize_image()
-                self.canvas = tk.Canvas(self.image_display, width=self.image_width, height=self.image_height)
-                self.canvas.pack(side=tk.TOP, padx=10, fill=tk.BOTH, expand=True)
-                self.offset_x = self.image_width / 2
-                self.offset_y = self.image_height / 2
-                self.image_x = 0
-                self.image_y = 0
-                self.tk_img = ImageTk.PhotoImage(self.image)
-                self.canvas.create_image(self.offset_x, self.offset_y, anchor=tk.CENTER, image=self.tk_img)
-                self.setup_zoom()  # set up the zoom function
-                # Add the lot to the image display
-                self.image_label = tk.Label(self.image_display, text=self.image_lot, font=self.font)
-                self.image_label.pack(pady=10)
-                # Decide which routine to initialize
-                if not self.cal_flag:
-                    self.calibration()
-                elif not self.horz_flag:
-                    self.draw_horizontal()
-                else:
-                    self.measure_droop()
-                # Bind a click event to the canvas
-                self.canvas.bind("<Button-1>", self.add_point)
-        except FileNotFoundError:
-            messagebox.showerror("File not found", "The selected file was not found.")
+            source = future.result()
+        except OSError as e:
+            if self.work_queue is not None:
+                messagebox.showwarning("Image skipped", f"The image could not be opened: {e}")
+                return self.open_next()
+            messagebox.showerror("Image not opened", f"The image could not be opened: {e}")
+            if self.canvas is not None:
+                self.show_image(self.file, self.source)  # Carry on with the image that was open
+            return
+        self.show_image(file, source)
+
+    # Stop preparing the images of the lot folder queue
+    def close_queue(self):
+        if self.work_queue is None:
+            return
+        self.work_queue.close()
+        self.work_queue = None
+        self.queue_label.config(text="")
+        self.skip_button.pack_forget()
+
+    # Display an image decoded by load_image and start the next routine on it
+    def show_image(self, file, source):
+        self.file = file
+        with perf.span("open_image", file=os.path.basename(file)):
+            try:
+                if self.file:
+                    if self.canvas is not None:
+                        self.canvas.destroy()  # Delete the previous canvas if it exists
+                        self.image_label.pack_forget()
+                    self.file_path, ext = os.path.splitext(self.file)
+                    self.folder_path, self.image_lot = os.path.split(self.file_path)  # Isolate the folder path
+                    # Create a new canvas and display the selected image
+                    self.resize_image(source)
+                    self.canvas = tk.Canvas(self.image_display, width=self.image_width, height=self.image_height)
+                    self.canvas.pack(side=tk.TOP, padx=10, fill=tk.BOTH, expand=True)
+                    self.zoom_factor = 1.0
+                    self.image_x = 0
+                    self.image_y = 0
+                    from viewport import ZoomPyramid
+                    self.pyramid = ZoomPyramid(self.image)
+                    # Built from the full resolution image on the first zoom past the display size
+                    self.full_pyramid = None
+                    # A single image item holds the visible region and is updated in place
+                    self.image_item = self.canvas.create_image(0, 0, anchor=tk.NW, tags="image")
+                    self.overlay = OverlayLayer(self.canvas, self.convert_to_canvas, self.place_text_along_line,
+                                                self.font)
+                    from loupe import Loupe
+                    self.loupe = Loupe(self.canvas, self.loupe_source, self.overlay, LOUPE_SIZE, self.loupe_zoom)
+                    self.render_view()
+                    self.setup_zoom()  # set up the zoom function
+                    # Add the lot to the image display
+                    self.image_label = tk.Label(self.image_display, text=self.image_lot, font=self.font)
+                    self.image_label.pack(pady=10)
+                    self.register_image()
+                    self.check_calibration()
+                    # Decide which routine to initialize
+                    if not self.cal_flag:
+                        self.calibration()
+                    elif not self.horz_flag:
+                        self.draw_horizontal()
+                    else:
+                        self.measure_droop()
+                    # Bind a click event to the canvas and allow existing points to be dragged
+                    self.canvas.bind("<Button-1>", self.add_point)
+                    self.canvas.bind("<B1-Motion>", self.drag_point)
+                    self.canvas.bind("<ButtonRelease-1>", self.end_drag)
+                    # Follow the mouse with the loupe; Shift and the scroll wheel change its magnification
+                    self.canvas.bind("<Motion>", self.move_loupe)
+                    self.canvas.bind("<Leave>", lambda event: self.loupe.hide())
+                    self.canvas.bind("<Shift-MouseWheel>", self.zoom_loupe)
+                    # Nudge the last point by one full resolution pixel with the arrow keys
+                    for key, step in (("Left", (-1, 0)), ("Right", (1, 0)), ("Up", (0, -1)), ("Down", (0, 1))):
+                        self.canvas.bind(f"<{key}>", lambda event, step=step: self.nudge_point(*step))
+            except FileNotFoundError:
+                messagebox.showerror("File not found", "The selected file was not found.")
 
     # Link zoom function to the canvas 
     def setup_zoom(self):
@@ -110,12 +351,32 @@ class MaterialMeasurement(tk.Tk):
         self.bind_all("<KeyPress-Control_L>", self.start_zoom)
         self.bind_all("<KeyRelease-Control_L>", self.reset_cursor)
         self.canvas.bind("<MouseWheel>", self.zoom)
+        # Pan the view by dragging with the middle or right mouse button
+        for button in (2, 3):
+            self.canvas.bind(f"<ButtonPress-{button}>", self.start_pan)
+            self.canvas.bind(f"<B{button}-Motion>", self.pan)
+            self.canvas.bind(f"<ButtonRelease-{button}>", self.end_pan)
+        self.canvas.bind("<Configure>", lambda event: self.schedule_render())  # Fill the canvas when resized
         self.zoom_mode = False
 
-    def resize_image(self):
-        target_size = (int(self.window_width * 2 / 3), int(self.window_height * 2 / 3))
-        self.image.thumbnail(target_size, Image.Resampling.LANCZOS)
-        self.image_width, self.image_height = self.image.size
+    # Largest size at which images are displayed
+    def display_size(self):
+        return int(self.window_width * 2 / 3), int(self.window_height * 2 / 3)
+
+    # Show the display copy of a decoded image and start loading the full resolution image used for measurement
+    def resize_image(self, source):
+        with perf.span("resize_image") as span:
+            self.source = source
+            self.source.preload()  # Returns straight away when the full resolution image is already decoded
+            if self.snap_edges.get():
+                self.source.preload_edges()
+            self.image = self.source.display
+            self.image_width, self.image_height = self.image.size
+            span.set(width=self.source.full_size[0], height=self.source.full_size[1])
+
+    # Canvas pixels per full resolution image pixel at the current zoom
+    def view_scale(self):
+        return self.zoom_factor * self.source.display_scale
 
     # Start the zoom event cascade 
     def start_zoom(self, event):
@@ -137,79 +398,102 @@ class MaterialMeasurement(tk.Tk):
     def zoom_in(self, x, y):
         if not self.zoom_mode:
             return
-        if self.zoom_factor >= 6.0: return  # Cap zoom at 6.0X
-        # Zoom in by a factor of 2.0
-        zoom_factor = 2.0
-        self.zoom_factor *= zoom_factor
-        width = int(self.image.width * self.zoom_factor)
-        height = int(self.image.height * self.zoom_factor)
-
-        # Get the mouse coordinates
-        x = self.canvas.canvasx(x)
-        y = self.canvas.canvasy(y)
-        cx = self.canvas.winfo_width() / 2
-        cy = self.canvas.winfo_height() / 2
-
-        # Adjust the current offset based on the previous offset, mouse selected center
-        # point and zoom factor
-        self.offset_x = self.offset_x + int(cx - x) * self.zoom_factor / zoom_factor
-        self.offset_y = self.offset_y + int(cy - y) * self.zoom_factor / zoom_factor
-        # Store the upper left coordinates for the image separately from the image center
-        self.image_x = self.offset_x - (width / 2)
-        self.image_y = self.offset_y - (height / 2)
-        # Ensure the image remains within the canvas boundaries
-        if self.offset_x > width - self.canvas.winfo_width():
-            self.offset_x = 0
-        elif self.offset_x < self.canvas.winfo_width() - width:
-            self.offset_x = self.canvas.winfo_width() - width
-        if self.offset_y > height - self.canvas.winfo_height():
-            self.offset_y = height - self.canvas.winfo_height()
-        elif self.offset_y < self.canvas.winfo_height() - height:
-            self.offset_y = self.canvas.winfo_height() - height
-
-        # Apply the resizing to the image
-        resized_image = self.image.resize((width, height), Image.Resampling.LANCZOS)
-        self.tk_image = ImageTk.PhotoImage(resized_image)
-        self.canvas.create_image(self.offset_x, self.offset_y, anchor=tk.CENTER, image=self.tk_image)
-        self.scale_points()
+        self.set_zoom(min(self.zoom_factor * ZOOM_STEP, MAX_ZOOM), x, y)
 
     def zoom_out(self, x, y):
         if not self.zoom_mode:
             return
-        self.zoom_factor = 1.0  # Zoom back to original image size
-        width = int(self.image.width * self.zoom_factor)
-        height = int(self.image.height * self.zoom_factor)
-        self.offset_x = width / 2
-        self.offset_y = height / 2
-        self.image_x = 0
-        self.image_y = 0
-        # Resize the image with the factored width and height
-        resized_image = self.image.resize((width, height), Image.Resampling.LANCZOS)
-        self.tk_image = ImageTk.PhotoImage(resized_image)
-        self.canvas.create_image(self.offset_x, self.offset_y, anchor=tk.CENTER, image=self.tk_image)
-        self.scale_points()  # Rescale the points and redraw onto the new image scale
-
-    def update_image(self):
-        width = int(self.image_width * self.zoom_factor)
-        height = int(self.image_height * self.zoom_factor)
-        self.offset_x = self.offset_x * (width / self.image_width)
-        self.offset_y = self.offset_y * (height / self.image_height)
-        self.image_width, self.image_height = width, height
-        self.image = self.image.resize((width, height), Image.LANCZOS)
-        self.tk_img = ImageTk.PhotoImage(self.image)
-        self.canvas.delete("all")
-        self.canvas.create_image(self.offset_x, self.offset_y, anchor=tk.CENTER, image=self.tk_img)
-
-    # Given two points from the canvas coordinate system, convert them into the image coordinate system
+        self.set_zoom(max(self.zoom_factor / ZOOM_STEP, 1.0), x, y)  # Never zoom out past the original image size
+
+    # Change the zoom while keeping the image point under the mouse fixed on the canvas
+    def set_zoom(self, zoom_factor, x, y):
+        if zoom_factor == self.zoom_factor:
+            return
+        x = self.canvas.canvasx(x)
+        y = self.canvas.canvasy(y)
+        self.image_x = x - (x - self.image_x) * zoom_factor / self.zoom_factor
+        self.image_y = y - (y - self.image_y) * zoom_factor / self.zoom_factor
+        self.zoom_factor = zoom_factor
+        self.schedule_render()
+
+    # Record the start of a drag to pan the view
+    def start_pan(self, event):
+        self.pan_start = (event.x, event.y)
+        self.canvas.config(cursor="fleur")
+
+    # Move the view along with the mouse
+    def pan(self, event):
+        if self.pan_start is None:
+            return
+        self.image_x += event.x - self.pan_start[0]
+        self.image_y += event.y - self.pan_start[1]
+        self.pan_start = (event.x, event.y)
+        self.schedule_render()
+
+    def end_pan(self, event):
+        self.pan_start = None
+        self.canvas.config(cursor="plus" if self.zoom_mode else "")
+
+    # Return the size of the canvas, falling back on the requested size before it is drawn
+    def view_size(self):
+        width, height = self.canvas.winfo_width(), self.canvas.winfo_height()
+        if width <= 1 or height <= 1:
+            width, height = int(self.canvas.cget("width")), int(self.canvas.cget("height"))
+        return width, height
+
+    # Keep the image covering the canvas when zoomed and anchored to the upper left corner otherwise
+    def clamp_view(self):
+        view_width, view_height = self.view_size()
+        width = self.image_width * self.zoom_factor
+        height = self.image_height * self.zoom_factor
+        self.image_x = 0 if width <= view_width else min(0, max(view_width - width, self.image_x))
+        self.image_y = 0 if height <= view_height else min(0, max(view_height - height, self.image_y))
+
+    # Render at most once per pass of the event loop, however many zoom or pan events arrive
+    def schedule_render(self):
+        if self.render_pending or self.pyramid is None:
+            return
+        self.render_pending = True
+        self.after_idle(self.render_view)
+
+    # Draw only the region of the image visible in the canvas at the current zoom
+    def render_view(self):
+        self.render_pending = False
+        self.clamp_view()
+        view_width, view_height = self.view_size()
+        with perf.span("frame", zoom=round(self.zoom_factor, 3)):
+            if self.zoom_factor > 1 and self.source.display_scale < 1:
+                # Past the display size, draw from the full resolution image so fine detail is visible
+                if self.full_pyramid is None and self.source.pixels is not None:
+                    self.full_pyramid = self.source.pixels  # Renders straight from the file
+                elif self.full_pyramid is None:
+                    from viewport import ZoomPyramid
+                    self.full_pyramid = ZoomPyramid(self.source.full())
+                view, x, y = self.full_pyramid.render(self.view_scale(), self.image_x, self.image_y, view_width,
+                                                      view_height)
+            else:
+                view, x, y = self.pyramid.render(self.zoom_factor, self.image_x, self.image_y, view_width,
+                                                 view_height)
+            if view is not None:
+                from PIL import ImageTk
+                self.tk_image = ImageTk.PhotoImage(view)
+                self.canvas.itemconfig(self.image_item, image=self.tk_image)
+                self.canvas.coords(self.image_item, x, y)
+            self.scale_points()  # Rescale the points and redraw onto the new view
+        self.update_hud()
+
+    # Given two points from the canvas coordinate system, convert them into the full resolution image coordinate system
     def convert_to_image(self, x, y):
-        image_x = (x - self.image_x) / self.zoom_factor  # Distance from upper left corner
-        image_y = (y - self.image_y) / self.zoom_factor  # Distance from upper left corner
+        scale = self.view_scale()
+        image_x = (x - self.image_x) / scale  # Distance from upper left corner
+        image_y = (y - self.image_y) / scale  # Distance from upper left corner
         return image_x, image_y
 
-    # Given two points from the image coordinate system, convert them into the canvas coordinate system
+    # Given two points from the full resolution image coordinate system, convert them into the canvas coordinate system
     def convert_to_canvas(self, x, y):
-        canvas_x = x * self.zoom_factor + self.image_x
-        canvas_y = y * self.zoom_factor + self.image_y
+        scale = self.view_scale()
+        canvas_x = x * scale + self.image_x
+        canvas_y = y * scale + self.image_y
         return canvas_x, canvas_y
 
     # Set up the canvas for calibration
@@ -219,10 +503,9 @@ class MaterialMeasurement(tk.Tk):
         self.delete_points_button.pack_forget()
         self.re_cal_button.pack_forget()
         self.re_horz_button.pack_forget()
+        self.track_button.pack_forget()
         # Reset the calibration flag
         self.cal_flag = False
-        # Clear the canvas 
-        self.canvas.delete("oval", "overlay")
         # Create an entry box to take in the value of the feature in mm for calibration
         self.label.config(text="Enter Calibration Value (mm)", relief="flat")
         self.entry.pack(pady=10)
@@ -230,151 +513,204 @@ class MaterialMeasurement(tk.Tk):
         self.delete_points_button.pack(pady=10)
         self.accept_points_button.config(text="Accept Calibration", command=self.end_calibration)
         self.accept_points_button.pack(pady=10)
-        self.points = []  # Reset the points
-        self.scale_points()  # Draw overlays
+        self.reset_points()
+        self.propose_calibration()
+
+    # Seed the calibration with the ends of a scale detected in the image, for the operator to accept or adjust
+    def propose_calibration(self):
+        from scale_detect import detect_scale
+        detected = detect_scale(self.image, tick_mm=SCALE_TICK_MM, scale=self.source.display_scale)
+        if detected is None or detected["confidence"] < SCALE_CONFIDENCE:
+            return
+        self.entry.delete(0, tk.END)
+        self.entry.insert(0, f"{detected['calibration_length']:g}")
+        x1, y1, x2, y2 = detected["calibration_line"]
+        for point in ((x1, y1), (x2, y2)):
+            self.points.append(point)
+            self.overlay.add_point(point)
+        self.points_changed()
+        self.accept_points_button.config(state=tk.NORMAL)
+        self.label.config(text=f"Scale detected (confidence {detected['confidence']:.2f}) - "
+                               f"accept or adjust the calibration")
+
+    # Compare the scale detected in a new image with the calibration carried over from an earlier image
+    def check_calibration(self):
+        self.image_flags.discard("scale")
+        if not self.cal_flag or not getattr(self, "cal_value", None):
+            return self.scale_check_label.config(text="")
+        from scale_detect import detect_scale
+        detected = detect_scale(self.image, tick_mm=SCALE_TICK_MM, scale=self.source.display_scale)
+        if detected is None or detected["confidence"] < SCALE_CONFIDENCE:
+            return self.scale_check_label.config(text="Scale check: no scale detected", fg="black")
+        difference = detected["pixels_per_mm"] / self.cal_value - 1
+        text = f"Scale check: {detected['pixels_per_mm']:.2f} px/mm detected, {self.cal_value:.2f} px/mm calibrated"
+        if abs(difference) > SCALE_TOLERANCE:
+            self.image_flags.add("scale")
+            return self.scale_check_label.config(text=text + f" ({difference:+.1%}) - consider Re-Calibrate", fg="red")
+        self.scale_check_label.config(text=text, fg="black")
 
     # Set up for the horizontal line selection routine
     def draw_horizontal(self):
         # Reset the control panel
         self.re_horz_button.pack_forget()
+        self.track_button.pack_forget()
         self.accept_points_button.config(text="Accept Horizontal", command=self.end_horizontal, state=tk.DISABLED)
         self.label.config(text="Select points to identify the Horizontal Coordinate System", bg="white", relief="solid")
         self.horz_flag = False  # Reset the horizontal line flag
-        # Clear the canvas 
-        self.canvas.delete("oval", "overlay")
-        self.points = []  # Reset the points
-        self.scale_points()  # Draw overlays
+        self.reset_points()
 
-    # Select points and add to the calibration_points list
+    # Select points and add to the calibration_points list, or pick up an existing point to drag it
     def add_point(self, event):
+        index = self.overlay.hit_test(event.x, event.y)
+        if index is not None:
+            self.drag_index = index  # Nudge the existing point instead of adding a new one
+            return
         # Add clicked points to the calibration points list
         if self.cal_flag and self.horz_flag and len(self.points) == 1:
             return  # Only allow for one point to be selected for measurement
-        x, y = event.x, event.y
-        image_x, image_y = self.convert_to_image(x, y)
-        self.canvas.create_oval(x - 3, y - 3, x + 3, y + 3, fill="red", tags="oval")
-        self.points.append((image_x, image_y))
+        self.canvas.focus_set()  # Take the arrow keys for nudging the point
+        click = self.convert_to_image(event.x, event.y)
+        point = self.snap_point(click)
+        self.points.append(point or click)
+        self.overlay.add_point(point or click, click if point is not None else None)
         if len(self.points) >= 2: self.accept_points_button.config(
             state=tk.NORMAL)  # Accept points or lines if 2 or more selected
-        if not self.cal_flag or not self.horz_flag:
-            self.draw_fitted_line()  # Draw fitted line during calibration
-        if self.cal_flag and self.horz_flag:
-            self.accept_points_button.config(state=tk.NORMAL)
-            self.distance_to_line()  # Display the distance
-        self.scale_points()
+        self.points_changed()
+
+    # Return the point on the strongest edge near a click when snapping is on, or None to keep the click. Clicks
+    # made before the edge map is ready are kept as they are rather than waiting for it.
+    def snap_point(self, click):
+        if not self.snap_edges.get() or not self.source.edges_ready:
+            return None
+        return self.source.edges().snap(*click, SNAP_RADIUS / self.view_scale())
+
+    # Start computing the edge map of the current image when snapping is turned on
+    def toggle_snap(self):
+        if self.snap_edges.get() and self.source is not None:
+            self.source.preload_edges()
+
+    # Move the point picked up in add_point along with the mouse
+    def drag_point(self, event):
+        if self.drag_index is None:
+            return
+        point = self.convert_to_image(event.x, event.y)
+        self.points[self.drag_index] = point
+        self.overlay.move_point(self.drag_index, point)
+        self.points_changed()
+        self.move_loupe(event)
+
+    def end_drag(self, event):
+        self.drag_index = None
+
+    # Source the loupe crops from: the full resolution image once it is available, else the display image
+    def loupe_source(self):
+        if self.source.pixels is not None:
+            return self.source.pixels, 1.0
+        if self.source.loaded:
+            return self.source.full(), 1.0
+        return self.image, self.source.display_scale
+
+    # Magnify the pixels under the mouse
+    def move_loupe(self, event):
+        if self.loupe is None or not self.show_loupe.get() or self.pan_start is not None:
+            return
+        self.loupe.move(event.x, event.y, *self.convert_to_image(event.x, event.y))
+
+    def toggle_loupe(self):
+        if self.loupe is not None and not self.show_loupe.get():
+            self.loupe.hide()
+
+    # Double or halve the loupe magnification with the scroll wheel
+    def zoom_loupe(self, event):
+        if event.delta == 0:
+            return
+        zoom = self.loupe_zoom * 2 if event.delta > 0 else self.loupe_zoom / 2
+        self.loupe_zoom = min(LOUPE_MAX_ZOOM, max(LOUPE_MIN_ZOOM, zoom))
+        if self.loupe is not None:
+            self.loupe.set_zoom(self.loupe_zoom)
+
+    # Move the most recently selected point by (dx, dy) full resolution pixels and show it in the loupe
+    def nudge_point(self, dx, dy):
+        if not self.points:
+            return
+        x, y = self.points[-1]
+        point = (x + dx, y + dy)
+        self.points[-1] = point
+        self.overlay.move_point(len(self.points) - 1, point)
+        self.points_changed()
+        if self.loupe is not None and self.show_loupe.get():
+            self.loupe.move(*self.convert_to_canvas(*point), *point)
 
     # Delete the most recently selected point from cal points
     def delete_point(self):
         if self.points:  # Check if there are points in the array
             self.points.pop()  # Remove the last point from the points list
-            self.scale_points()  # Redraw the points to the scale
+            self.overlay.pop_point()
+            self.points_changed()
             # Disable selection if there are not enough points
             if self.horz_flag and len(self.points) < 1:
                 return self.accept_points_button.config(state=tk.DISABLED)
             elif len(self.points) < 2:
                 self.accept_points_button.config(state=tk.DISABLED)
 
+    # Clear the points at the start of a routine
+    def reset_points(self):
+        self.points = []
+        self.overlay.set_points(self.points)
+        self.points_changed()
+
+    # Recompute the fitted line or the distance after the points change and update the affected overlays
+    def points_changed(self):
+        if self.cal_flag and self.horz_flag:
+            self.fitted_line = None
+            if self.points:
+                self.accept_points_button.config(state=tk.NORMAL)
+                self.distance_to_line()  # Display the distance
+        else:
+            self.fitted_line = self.define_line() if len(self.points) >= 2 else None
+        self.update_overlay()
+
+    # Show the overlays that belong to the current routine
+    def update_overlay(self):
+        calibration_text = self.entry.get() + " mm"
+        self.overlay.set_line("calibration", self.calibration_line if self.cal_flag else None, label=calibration_text)
+        self.overlay.set_line("horizontal", self.horizontal_line if self.horz_flag else None)
+        # Draw fitted line during calibration and horizontal selection
+        self.overlay.set_line("fit", self.fitted_line, color="red", label=None if self.cal_flag else calibration_text)
+        if not (self.cal_flag and self.horz_flag and self.points):
+            for name in ("extended", "distance", "distance_text"):
+                self.overlay.hide(name)
+
     # Scale the points shown on the canvas according to the zoom value
     def scale_points(self):
-        # Clear the canvas and redraw the points
-        self.canvas.delete("oval", "overlay")
-        # Draw the applicable lines
-        if self.cal_flag:
-            x1, y1, x2, y2 = self.calibration_line
-            x1, y1 = self.convert_to_canvas(x1, y1)
-            x2, y2 = self.convert_to_canvas(x2, y2)
-            self.canvas.create_line(x1, y1, x2, y2, fill="green", width=2, tags="overlay")  # Draw the line
-            text_x, text_y = self.place_text_along_line(x1, y1, x2, y2)  # Calculate the xy for text
-            self.canvas.create_text(text_x, text_y, text=(self.entry.get() + " mm"), fill="green", font=self.font,
-                                    tags="overlay")  # Define the length
-        if self.horz_flag:
-            x1, y1, x2, y2 = self.horizontal_line
-            x1, y1 = self.convert_to_canvas(x1, y1)
-            x2, y2 = self.convert_to_canvas(x2, y2)
-            self.canvas.create_line(x1, y1, x2, y2, fill="green", width=2, tags="overlay")  # Draw the line
-        if not self.points: return
-        for point in self.points:
-            canvas_x, canvas_y = self.convert_to_canvas(point[0], point[1])
-            # Redraw the points into the current canvas view
-            if 0 < canvas_x < self.canvas.winfo_width() and 0 < canvas_y < self.canvas.winfo_height():
-                self.canvas.create_oval(canvas_x - 3, canvas_y - 3, canvas_x + 3, canvas_y + 3, fill="red", tags="oval")
-        if self.cal_flag and self.horz_flag:
-            self.draw_distance()
-        if not self.cal_flag or not self.horz_flag: self.draw_fitted_line()  # Draw fitted line during calibration
+        if self.overlay is not None:
+            with perf.span("scale_points", points=len(self.overlay.points)):
+                self.overlay.refresh()  # Move the existing items, nothing is refit or recreated
 
-    # Fit a line to a list of points using Linear Regression Model and LSR to optimize the line
+    # Fit a line to the selected points
     def fit_line(self):
-        if len(self.points) < 2:
-            return None  # You need at least 2 points to fit a line
-
-        # Linear regression to fit a line (y = mx + b)
-        X = np.array([x for x, _ in self.points])
-        Y = np.array([y for _, y in self.points])
-        A = np.vstack([X, np.ones(len(X))]).T
-        m, b = np.linalg.lstsq(A, Y, rcond=None)[0]
-        return m, b  # Returns slope and y-int of the fitted line
+        return droop_core.fit_line(self.points)
 
     # Defines the fitted line in terms of coordinates
     def define_line(self):
-        m, b = self.fit_line()
-        x1, y1 = min(self.points, key=lambda p: p[0])
-        x2, y2 = max(self.points, key=lambda p: p[0])
-        y1_line = m * x1 + b
-        y2_line = m * x2 + b
-        return x1, y1_line, x2, y2_line  # Return the two points used to construct the line
-
-    # Draw the line fit through points
-    def draw_fitted_line(self):
-        self.canvas.delete("overlay")  # Clear the existing circle overlay
-        if len(self.points) >= 2:
-            x1, y1, x2, y2 = self.define_line()  # Run the routine to estimate the line through the points
-            # Convert the line parameters to the current zoom factor and draw to the canvas
-            x1, y1 = self.convert_to_canvas(x1, y1)
-            x2, y2 = self.convert_to_canvas(x2, y2)
-            self.canvas.create_line(x1, y1, x2, y2, fill="red", width=2, tags="overlay")  # Draw the line
-            text_x, text_y = self.place_text_along_line(x1, y1, x2, y2)  # Calculate the xy for text
-            if not self.cal_flag: self.canvas.create_text(text_x, text_y, text=(self.entry.get() + " mm"), fill="red",
-                                                          font=self.font, tags="overlay")  # Define the length
-        if self.cal_flag:
-            x1, y1, x2, y2 = self.calibration_line
-            x1, y1 = self.convert_to_canvas(x1, y1)
-            x2, y2 = self.convert_to_canvas(x2, y2)
-            self.canvas.create_line(x1, y1, x2, y2, fill="green", width=2, tags="overlay")  # Draw the line
-            text_x, text_y = self.place_text_along_line(x1, y1, x2, y2)  # Calculate the xy for text
-            self.canvas.create_text(text_x, text_y, text=(self.entry.get() + " mm"), fill="green", font=self.font,
-                                    tags="overlay")  # Define the length
-        if self.horz_flag:
-            x1, y1, x2, y2 = self.horizontal_line
-            x1, y1 = self.convert_to_canvas(x1, y1)
-            x2, y2 = self.convert_to_canvas(x2, y2)
-            self.canvas.create_line(x1, y1, x2, y2, fill="green", width=2, tags="overlay")  # Draw the line
+        return droop_core.define_line(self.points)
 
     # Calculate the x and y to place text along a line using the bisecting line as reference
     def place_text_along_line(self, x1, y1, x2, y2, distance=10):
-        # Calculate the midpoint of the line
-        mid_x = (x1 + x2) / 2
-        mid_y = (y1 + y2) / 2
-
-        # Calculate the angle of the line and find the bisecting line angle
-        angle = math.atan2(y2 - y1, x2 - x1)
-        angle_bisector = angle + math.pi / 2
-
-        # Calculate the new coordinates for placing text above the line
-        text_x = mid_x - distance * math.cos(angle_bisector)
-        text_y = mid_y - distance * math.sin(angle_bisector)
-
-        return text_x, text_y  # Returns the x and y coordinates for the text
+        return droop_core.place_text_along_line(x1, y1, x2, y2, distance)
 
     # Run the saving steps for the calibration routine and run point selection next
     def end_calibration(self):
         self.points_to_value()
         self.calibration_line = (self.define_line())  # Save line used for calibration
         self.cal_flag = True  # Mark that calibration was completed
+        self.check_calibration()  # Check the new calibration against the scale, clearing a flag set for the old one
         self.re_cal_button.pack(pady=10)  # Allow the user to re calibrate if required
         self.entry.pack_forget()
         # Reset the canvas for point selection
         if self.horz_flag:
             self.re_horz_button.pack(pady=10)
+            self.set_reference()
             self.measure_droop()  # Set up for the measurement process
         else:
             self.draw_horizontal()  # Set up for the horizontal line selection
@@ -382,10 +718,7 @@ class MaterialMeasurement(tk.Tk):
     # Take in the calibration points and convert to a pixel/mm value
     def points_to_value(self):
         try:
-            float_value = float(self.entry.get())
-            x1, y1_line, x2, y2_line = self.define_line()
-            distance = math.sqrt((x2 - x1) ** 2 + (y2_line - y1_line) ** 2)
-            self.cal_value = distance / float_value
+            self.cal_value = droop_core.points_to_value(self.define_line(), self.entry.get())
             # self.save_cal_to_xlsx()
         except (ValueError, TypeError):
             return False
@@ -409,133 +742,322 @@ class MaterialMeasurement(tk.Tk):
         self.horizontal_line = self.define_line()  # Save horizontal line coordinates
         self.horz_flag = True  # Mark that horizontal coordinate search was completed
         self.re_horz_button.pack(pady=10)  # Allow for updated horizontal line
+        if self.cal_flag:
+            self.set_reference()
         self.measure_droop()  # Set up for droop measurement
 
+    # Keep the current image as the reference of the set-up along with the lines drawn on it and save it as the default
+    # profile, restored on the next start. A named profile is left as it was saved, the new set-up no longer matches it.
+    def set_reference(self):
+        import registration
+        self.reference, self.reference_factor = registration.prepare(self.image, self.source.display_scale)
+        self.reference_path = None
+        self.reference_lines = (self.calibration_line, self.horizontal_line)
+        self.drift_label.config(text="")
+        self.image_flags.discard("drift")
+        self.profile_name = setup_profile.DEFAULT_PROFILE
+        self.title("Measurement Window")
+        try:
+            setup_profile.save_profile(self.profile_name, self.calibration_line, self.entry.get(),
+                                       self.horizontal_line, self.reference, self.reference_factor)
+        except (OSError, ValueError) as e:
+            messagebox.showwarning("Profile not saved", f"The setup could not be saved as the default profile: {e}")
+
+    # Register a new image against the reference and move the carried over lines to match any camera drift
+    def register_image(self):
+        self.image_flags.discard("drift")
+        if self.get_reference() is None or not (self.cal_flag and self.horz_flag):
+            return self.drift_label.config(text="")
+        import registration
+        drift = registration.estimate_drift(self.reference, self.reference_factor, self.image,
+                                            self.source.display_scale)
+        if drift["peak"] < MIN_MATCH:
+            self.image_flags.add("drift")
+            return self.drift_label.config(text="Image does not match the set-up reference - check the lines or "
+                                                "Re-Calibrate", fg="red")
+        self.calibration_line = registration.transform_line(self.reference_lines[0], drift)
+        self.horizontal_line = registration.transform_line(self.reference_lines[1], drift)
+        text = f"Camera drift: {drift['dx']:+.1f}, {drift['dy']:+.1f} px, {drift['angle']:+.2f} deg"
+        if abs(drift["dx"]) > DRIFT_PIXELS or abs(drift["dy"]) > DRIFT_PIXELS or abs(drift["angle"]) > DRIFT_DEGREES:
+            self.image_flags.add("drift")
+            return self.drift_label.config(text=text + " - lines moved to match, check them", fg="red")
+        self.drift_label.config(text=text, fg="black")
+
+    # Return the reference array, reading the reference image of a loaded profile the first time it is needed
+    def get_reference(self):
+        if self.reference is None and self.reference_path is not None:
+            self.reference = setup_profile.load_reference(self.reference_path)
+        return self.reference
+
+    # Restore the calibration, horizontal line and reference of a saved profile
+    def apply_profile(self, name):
+        try:
+            setup = setup_profile.load_profile(name)
+        except (OSError, ValueError, KeyError) as e:
+            return messagebox.showwarning("Profile not loaded", f"The setup profile {name} could not be loaded: {e}")
+        self.profile_name = name
+        self.calibration_line = setup["calibration_line"]
+        self.horizontal_line = setup["horizontal_line"]
+        self.entry.delete(0, tk.END)
+        self.entry.insert(0, f"{setup['calibration_length']:g}")
+        self.cal_value = droop_core.points_to_value(self.calibration_line, setup["calibration_length"])
+        self.reference, self.reference_factor = None, setup["reference_factor"]
+        self.reference_path = setup["reference_path"]
+        self.reference_lines = (self.calibration_line, self.horizontal_line)
+        self.cal_flag = self.horz_flag = True
+        self.entry.pack_forget()
+        self.re_cal_button.pack(pady=10)
+        self.re_horz_button.pack(pady=10)
+        self.title(f"Measurement Window - {name}")
+        if self.canvas is not None:
+            self.register_image()
+            self.measure_droop()
+
+    # Pick a saved profile from the profile folder
+    def load_profile(self):
+        path = filedialog.askopenfilename(title="Select a setup profile", initialdir=setup_profile.PROFILE_DIR,
+                                          filetypes=[("Setup profiles", "*.json")])
+        if path:
+            self.apply_profile(os.path.splitext(os.path.basename(path))[0])
+
+    # Save the current set-up under a new name
+    def save_profile_as(self):
+        if not (self.cal_flag and self.horz_flag):
+            return messagebox.showinfo("Setup incomplete", "Accept a calibration and a horizontal line first.")
+        name = simpledialog.askstring("Save Setup Profile", "Profile name:", parent=self)
+        if not name:
+            return
+        try:
+            if self.get_reference() is not None:
+                setup_profile.save_profile(name, self.reference_lines[0], self.entry.get(), self.reference_lines[1],
+                                           self.reference, self.reference_factor)
+            else:
+                setup_profile.save_profile(name, self.calibration_line, self.entry.get(), self.horizontal_line)
+        except (OSError, ValueError) as e:
+            return messagebox.showwarning("Profile not saved", f"The setup profile could not be saved: {e}")
+        self.profile_name = name
+        self.title(f"Measurement Window - {name}")
+
     # Setup for measurment routine to occur on material horizontal droop length
     def measure_droop(self):
         self.accept_points_button.config(text="Accept Measurement and Save", command=self.end_measurement,
                                          state=tk.DISABLED)
         self.label.config(text="Select point at the bottom of the material to measure the horizontal drop")
-        # Clear the canvas 
-        self.canvas.delete("oval")
-        self.points = []  # Reset the points
-        self.scale_points()  # Draw overlays
+        self.reset_points()
+        self.track_button.pack(pady=10)
+        if self.auto_detect.get():
+            self.propose_droop_point()
 
-    # Calculate the horizontal distance from a point (x, y) to a line defined by two points (x1, y1) and (x2, y2)
-    def distance_to_line(self):
-        x, y = self.points[0]
-        x1, y1, x2, y2 = self.horizontal_line
-        A = y2 - y1
-        B = x1 - x2
-        C = x2 * y1 - x1 * y2
-        distance = abs(A * x + B * y + C) / ((A ** 2 + B ** 2) ** 0.5)
+    # Propose the lowest point of the material for the operator to accept or drag into place
+    def propose_droop_point(self):
+        from droop_detect import detect_droop_point
+        point = detect_droop_point(self.image, self.horizontal_line, scale=self.source.display_scale)
+        if point is None:
+            return
+        self.points.append(point)
+        self.overlay.add_point(point)
+        self.points_changed()
+        self.label.config(text="Droop point detected - drag the point to correct it or accept the measurement")
 
-        # Calculate the coordinates for the line
-        self.intersection_x = (B * (B * x - A * y) - A * C) / (A ** 2 + B ** 2)
-        self.intersection_y = (A * (-B * x + A * y) - B * C) / (A ** 2 + B ** 2)
+    # Propose a droop point right away when auto-detect is turned on during a measurement
+    def toggle_auto_detect(self):
+        if self.auto_detect.get() and self.canvas is not None and self.cal_flag and self.horz_flag and not self.points:
+            self.propose_droop_point()
 
-        self.distance = distance / self.cal_value
+    # Track the selected droop point through the images of the folder from the current one on, in name order, and
+    # write the droop of every frame to <lot>_Droop_Series.csv; while tracking, the button stops the run
+    def toggle_tracking(self):
+        if self.tracking is not None:
+            self.tracking["stop"] = True
+            return
+        if not self.points:
+            return messagebox.showinfo("Track Image Sequence", "Select the droop point on this image first")
+        import sequence
+        names = sorted(name for name in os.listdir(self.folder_path) if name.lower().endswith(droop_core.IMAGE_TYPES)
+                       and not os.path.splitext(name)[0].endswith("_M"))
+        files = [os.path.join(self.folder_path, name) for name in names if name >= os.path.basename(self.file)]
+        setup = {"calibration_line": self.calibration_line, "calibration_length": self.entry.get(),
+                 "horizontal_line": self.horizontal_line}
+        output = os.path.join(self.folder_path, f"{self.image_lot}_Droop_Series.csv")
+        self.tracking = {"count": 0, "total": len(files), "stop": False, "error": None, "done": False}
+        tracking, start = self.tracking, self.points[0]
+
+        def run():
+            try:
+                sequence.measure_sequence(self.folder_path, setup, start, output,
+                                          progress=lambda n: tracking.update(count=n),
+                                          stop=lambda: tracking["stop"], frames=sequence.frames_of_files(files))
+            except Exception as e:
+                tracking["error"] = e
+            tracking["done"] = True
+        threading.Thread(target=run, daemon=True).start()
+        self.track_button.config(text="Stop Tracking")
+        self.after(200, self.check_tracking, output)
+
+    # Show the progress of the sequence being tracked until it finishes
+    def check_tracking(self, output):
+        tracking = self.tracking
+        if not tracking["done"]:
+            self.label.config(text=f"Tracking frame {tracking['count']} of {tracking['total']}")
+            self.after(200, self.check_tracking, output)
+            return
+        self.tracking = None
+        self.track_button.config(text="Track Image Sequence")
+        if tracking["error"] is not None:
+            return messagebox.showwarning("Tracking failed", f"The sequence could not be tracked: {tracking['error']}")
+        self.label.config(text=f"Tracked {tracking['count']} frames to {os.path.basename(output)}")
+
+    # Calculate the horizontal distance from the selected point to the horizontal line
+    def distance_to_line(self):
+        self.distance, (self.intersection_x, self.intersection_y) = droop_core.distance_to_line(
+            self.points[0], self.horizontal_line, self.cal_value)
         self.draw_distance()
 
     # Draw the intersection to the canvas
     def draw_distance(self):
         x, y = self.points[0]
-        x, y = self.convert_to_canvas(x, y)
         x1, y1, x2, y2 = self.horizontal_line
-        x1, y1 = self.convert_to_canvas(x1, y1)
-        x2, y2 = self.convert_to_canvas(x2, y2)
-        canvas_x, canvas_y = self.convert_to_canvas(self.intersection_x, self.intersection_y)
         # Draw the dashed lines
-        self.extended_line = self.canvas.create_line(canvas_x, canvas_y, x1, y1, fill="red", dash=(4, 4),
-                                                     tags="overlay")
-        self.distance_line = self.canvas.create_line(x, y, canvas_x, canvas_y, fill="red", dash=(4, 4), tags="overlay")
-        # Assuming canvas is your Tkinter Canvas object
-        self.canvas.create_text(10, 10, anchor="nw", text=f"Distance: {self.distance:.2f}", fill="red", font=self.font,
-                                tags="overlay")
-
-    def save_canvas_to_jpeg(self):
-        # Convert the image to RGB mode
-        if self.image.mode != 'RGB':
-            self.image = self.image.convert('RGB')
-        draw = ImageDraw.Draw(self.image)
+        self.overlay.set_line("extended", (self.intersection_x, self.intersection_y, x1, y1), color="red", width=1,
+                              dash=(4, 4))
+        self.overlay.set_line("distance", (x, y, self.intersection_x, self.intersection_y), color="red", width=1,
+                              dash=(4, 4))
+        self.overlay.set_text("distance_text", 10, 10, f"Distance: {self.distance:.2f}", color="red")
 
-        # Get the current date and time
-        current_datetime = datetime.now()
-        formatted_datetime = current_datetime.strftime("_%Y-%m-%d_%H-%M-%S")
-        file_path, ext = os.path.splitext(self.file)
-        folder_path, image_lot = os.path.split(file_path)  # Isolate the folder and the image lot identifier
-
-        # Add an image label to the output image
-        font = ImageFont.truetype("arial.ttf", size=16)
-        bbox = draw.textbbox((10, 10), image_lot, font=font)
-        draw.rectangle((bbox[0] - 2, bbox[1] - 2, bbox[2] + 2, bbox[3] + 2), fill="white", outline="black", width=1)
-        draw.text((10, 10), image_lot, font=font, fill="black")
-
-        # Draw the calibration line and calibration value
-        x1, y1, x2, y2 = self.calibration_line
-        draw.line((x1, y1, x2, y2), fill="green", width=3)
-        text_x, text_y = self.place_text_along_line(x1, y1, x2, y2, distance=24)
-        bbox = draw.textbbox((text_x, text_y), text=(self.entry.get() + " mm"), font=font)
-        draw.rectangle((bbox[0] - 2, bbox[1] - 2, bbox[2] + 2, bbox[3] + 2), fill="white", outline="black", width=1)
-        draw.text((text_x, text_y), text=(self.entry.get() + " mm"), font=font, fill="green")
-
-        # Draw the horizontal line
-        x1, y1, x2, y2 = self.horizontal_line
-        draw.line((x1, y1, x2, y2), fill="green", width=3)
-        # Draw the selected point and corresponding distance lines
-        x, y = self.points[0]
-        draw.line((self.intersection_x, self.intersection_y, x1, y1), fill="blue", width=3)
-        draw.line((x, y, self.intersection_x, self.intersection_y), fill="blue", width=3)
-        draw.ellipse((x - 2, y - 2, x + 2, y + 2), fill="red")
-        text_x, text_y = self.place_text_along_line(x, y, self.intersection_x,
-                                                    self.intersection_y)  # Calculate the xy for text
-        bbox = draw.textbbox((text_x - 70, text_y - 20), text=f"{self.distance:.2f} mm", font=font)
-        draw.rectangle((bbox[0] - 2, bbox[1] - 2, bbox[2] + 2, bbox[3] + 2), fill="white", outline="black", width=1)
-        draw.text((text_x - 70, text_y - 20), text=f"{self.distance:.2f} mm", font=font, fill="red")
-        bbox = draw.textbbox((10, 40), text=f"Horizontal Droop (mm): {self.distance:.2f}", font=font)
-        draw.rectangle((bbox[0] - 2, bbox[1] - 2, bbox[2] + 2, bbox[3] + 2), fill="white", outline="black", width=1)
-        draw.text((10, 40), text=f"Horizontal Droop (mm): {self.distance:.2f}", font=font, fill="red")
-
-        # Save the image to a JPEG file located in the video path
-        output_path = file_path + formatted_datetime + "_M.png"  # Save to the working directory
-        self.image.save(output_path, format="PNG")
-
-    # Append the material droop measurements to the excel output file
-    def append_row_to_excel(self, file_path, headers):
+    # Capture everything needed to save the current measurement, so the window can move on to the next image
+    def measurement_snapshot(self):
+        return {"file": self.file, "source": self.source, "image_lot": self.image_lot, "time": datetime.now(),
+                "calibration_line": self.calibration_line, "calibration_text": self.entry.get() + " mm",
+                "horizontal_line": self.horizontal_line, "point": self.points[0],
+                "intersection": (self.intersection_x, self.intersection_y), "distance": self.distance,
+                # Size the annotations as they appeared on the display
+                "scale": 1 / self.source.display_scale, "flags": sorted(self.image_flags), "store": self.store}
+
+    # Import the deferred modules on a background thread so they are ready by the time they are first used
+    def warm_imports(self):
+        def run():
+            for name in DEFERRED_IMPORTS:
+                try:
+                    importlib.import_module(name)
+                except ImportError as e:
+                    print(f"Error: {e}")
+        threading.Thread(target=run, daemon=True).start()
+
+    # Report measurements the background writer failed to save
+    def check_writer(self):
+        errors = []
+        while not self.writer.errors.empty():
+            errors.append(self.writer.errors.get())
+        if errors:
+            messagebox.showwarning("Save failed", "These measurements were not fully saved:\n" + "\n".join(errors))
+        self.update_hud()  # Pick up the times of saves finished in the background
+        self.after(1000, self.check_writer)
+
+    # Time the pipeline stages while the performance display is on
+    def toggle_hud(self):
+        if self.show_hud.get():
+            perf.enable()
+        elif not (PERF_LOG or os.environ.get("DROOP_PERF")):
+            perf.disable()  # Spans go back to costing nothing unless they are being logged
+        self.update_hud()
+
+    # Show the latest time of the main stages in the upper right corner of the canvas
+    def update_hud(self):
+        if self.overlay is None:
+            return
+        if not self.show_hud.get():
+            return self.overlay.hide("hud")
+        times = "\n".join(f"{label}: {perf.last[stage]:.0f} ms" if stage in perf.last else f"{label}: -"
+                          for label, stage in (("Frame", "frame"), ("Open", "open_image"),
+                                               ("Decode", "decode_full"), ("Save", "save")))
+        self.overlay.set_text("hud", self.view_size()[0] - 160, 10, f"{times}\nSaves pending: {self.writer.pending()}",
+                              color="blue")
+
+    # Either reuse the journal for the current lot folder or open it, exporting the previous lot's journal
+    def find_or_create_store(self):
+        if self.store is not None and self.store.folder_path == self.folder_path:
+            return self.store
+        self.close_store()
+        self.store = MeasurementStore(self.folder_path, STATION)
+        self.export_button.pack(pady=10)
+        self.statistics_button.pack(pady=10)
+        return self.store
+
+    # Write the journal for the current lot to the excel output file on demand
+    def export_measurements(self):
+        if self.store is None:
+            return
+        self.writer.flush()  # Include the measurements still being saved
         try:
-            # Load the Excel file into a DataFrame
-            df = pd.read_excel(file_path)
-            lot, subject, _ = self.image_lot.split("_")
-            data = [[lot, subject, self.distance]]
-            df = pd.concat([df, pd.DataFrame(data, columns=headers)], ignore_index=True)
-
-            # Write the updated DataFrame back to the Excel file
-            df.to_excel(file_path, index=False)
+            excel_path = self.store.export_to_excel()
+            self.label.config(text=f"Exported measurements to {os.path.basename(excel_path)}")
         except Exception as e:
-            print(f"Error: {e}")
-
-    # Either identify the file used to save the outputted material droop measurements or create it
-    def find_or_create_file(self):
-        folder, lot = os.path.split(self.folder_path)
-        file_name = lot + "_Droop_Measurements.xlsx"
-        headers = ["Lot #", "Subject", "Droop Length (mm)"]
-        file_path = os.path.join(self.folder_path, file_name)
-        if os.path.exists(file_path):
-            return file_path, headers
+            messagebox.showwarning("Export failed", f"The measurements could not be exported: {e}")
+
+    # Show the statistics and control chart of the measurements of the current lot folder
+    def show_statistics(self):
+        if self.statistics_panel is not None and self.statistics_panel.winfo_exists():
+            return self.statistics_panel.lift()
+        from lot_stats import LotStatistics, StatisticsPanel
+        if self.statistics is None:
+            self.writer.flush()  # Include the measurements still being saved
+            self.statistics = LotStatistics.from_rows(self.store.merged_rows())
+        export_path = os.path.join(self.store.folder_path, f"{self.store.lot}_Droop_Statistics.csv")
+        self.statistics_panel = StatisticsPanel(self, self.statistics, f"Statistics - {self.store.lot}", export_path)
+
+    # Add an accepted measurement to the lot statistics, once they have been built
+    def update_statistics(self):
+        if self.statistics is None:
+            return
+        lot, subject = droop_core.parse_image_lot(self.image_lot)  # Checked when the measurement was accepted
+        if self.statistics_panel is not None and self.statistics_panel.winfo_exists():
+            self.statistics_panel.add(lot, subject, self.distance)
         else:
-            # Create the Excel file with specified headers
-            df = pd.DataFrame(columns=headers)
-            df.to_excel(file_path, index=False)
-        return file_path, headers
+            self.statistics.add(lot, subject, self.distance)
+
+    # Export and close the journal of the current lot
+    def close_store(self):
+        if self.statistics_panel is not None and self.statistics_panel.winfo_exists():
+            self.statistics_panel.destroy()
+        self.statistics, self.statistics_panel = None, None
+        if self.store is None:
+            return
+        self.writer.flush()
+        try:
+            self.store.close()
+        except Exception as e:
+            messagebox.showwarning("Export failed", f"The measurements could not be exported: {e}")
+        self.store = None
+
+    # Export the pending measurements before closing the window
+    def on_close(self):
+        self.loader.shutdown(wait=False, cancel_futures=True)
+        self.close_queue()
+        self.close_browser()
+        self.writer.close()  # Finish saving the accepted measurements
+        self.close_store()
+        self.destroy()
 
     # Run saving routine for measurement after point is accepted
     def end_measurement(self):
+        # The journal row needs the lot and subject from the file name, so a badly named image is not accepted
+        try:
+            droop_core.parse_image_lot(self.image_lot)
+        except ValueError:
+            return messagebox.showwarning("Measurement not saved", f"{self.image_lot} is not named LOT_SUBJECT_ID, "
+                                          "so its lot and subject are unknown. Rename the image and open it again.")
         self.distance_to_line()
-        file_path, headers = self.find_or_create_file()
-        self.save_canvas_to_jpeg()
-        self.append_row_to_excel(file_path, headers)
-        self.open_file()
+        self.find_or_create_store()
+        self.writer.submit(self.measurement_snapshot())  # Draw, encode and record the measurement off the event loop
+        if self.browser is not None and self.browser.winfo_exists():
+            self.browser.mark_measured(self.file, self.image_flags)
+        self.update_statistics()
+        if self.work_queue is not None:
+            self.open_next()  # Move on to the next image of the lot folder
+        else:
+            self.open_file()
 
 
-app = MaterialMeasurement()
-app.mainloop()
+if __name__ == "__main__":
+    app = MaterialMeasurement()
+    app.mainloop()
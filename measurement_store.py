@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+import os
+import re
+import socket
+import sqlite3
+import time
+import uuid
+from urllib.request import pathname2url
+import perf
+
+HEADERS = ["Lot #", "Subject", "Droop Length (mm)"]
+LOCK_TIMEOUT = 30.0  # Seconds to wait for another station to finish writing the lot workbook
+STALE_LOCK = 120.0  # Age in seconds after which a lock left by a station that stopped is removed
+
+
+# File name safe name of a station, the computer name by default
+def station_name(station=None):
+    return re.sub(r"[^A-Za-z0-9_-]+", "-", station or socket.gethostname()) or "station"
+
+
+# Journals of every station for the lot in a folder, including one written before journals were kept per station
+def journal_paths(folder_path):
+    prefix = os.path.basename(folder_path) + "_Droop_Measurements"
+    return sorted(os.path.join(folder_path, name) for name in os.listdir(folder_path)
+                  if name.startswith(prefix) and name.endswith(".sqlite"))
+
+
+# Read the rows of a journal as (id, lot, subject, distance, image, recorded, flags), through connection when it is
+# already open. flags is the comma separated checks the measurement failed, or None. Rows written before rows had ids
+# are identified by their journal and position.
+def read_journal(path, connection=None):
+    if connection is None:
+        # Other stations' journals are only read, waiting for a station that is writing to finish
+        reader = sqlite3.connect(f"file:{pathname2url(path)}?mode=ro", uri=True, timeout=5.0)
+    else:
+        reader = connection
+    try:
+        columns = [column[1] for column in reader.execute("PRAGMA table_info(measurements)")]
+        uid = "uid" if "uid" in columns else "NULL"
+        flags = "flags" if "flags" in columns else "NULL"
+        rows = reader.execute(f"SELECT {uid}, id, lot, subject, distance, image, recorded, {flags} FROM measurements "
+                              "ORDER BY id").fetchall()
+    finally:
+        if reader is not connection:
+            reader.close()
+    name = os.path.basename(path)
+    return [(uid or f"{name}:{id}", lot, subject, distance, image, recorded, flags or None)
+            for uid, id, lot, subject, distance, image, recorded, flags in rows]
+
+
+# Return the rows of every station's journal of a lot folder once each, in the order they were recorded. Journals
+# with an open connection in connections, by path, are read through it.
+def merged_rows(folder_path, connections=None):
+    merged = {}
+    for path in journal_paths(folder_path):
+        try:
+            for row in read_journal(path, (connections or {}).get(path)):
+                merged.setdefault(row[0], row)
+        except sqlite3.Error as e:
+            print(f"Error: {os.path.basename(path)}: {e}")  # Picked up again by the next export
+    return sorted(merged.values(), key=lambda row: row[5] or "")  # Python's sort keeps the journal order of ties
+
+
+# Append-only measurement journal kept next to the lot images, exported to the lot workbook in bulk. Every station
+# writes only to its own journal in the lot folder, so benches sharing a folder never contend for a file; the workbook
+# is rebuilt from the journals of all stations, with each row identified by a unique id so none is lost or repeated.
+class MeasurementStore:
+    def __init__(self, folder_path, station=None):
+        self.folder_path = folder_path
+        folder, self.lot = os.path.split(folder_path)
+        self.station = station_name(station)
+        self.prefix = self.lot + "_Droop_Measurements"
+        self.db_path = os.path.join(folder_path, f"{self.prefix}.{self.station}.sqlite")
+        self.excel_path = os.path.join(folder_path, self.prefix + ".xlsx")
+        self.lock_path = os.path.join(folder_path, self.prefix + ".lock")
+        first_journal = not journal_paths(folder_path)
+        # Rows are appended by the output writer thread; the window only uses the journal once the writer is flushed
+        self.connection = sqlite3.connect(self.db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA synchronous=FULL")  # Each insert is on disk before the commit returns
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS measurements (
+                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                    lot TEXT NOT NULL,
+                                    subject TEXT NOT NULL,
+                                    distance REAL NOT NULL,
+                                    image TEXT,
+                                    recorded TEXT DEFAULT CURRENT_TIMESTAMP,
+                                    uid TEXT UNIQUE,
+                                    station TEXT,
+                                    flags TEXT)""")
+        # Journals written before measurements were flagged gain the column, empty for their rows
+        if "flags" not in [column[1] for column in self.connection.execute("PRAGMA table_info(measurements)")]:
+            self.connection.execute("ALTER TABLE measurements ADD COLUMN flags TEXT")
+        self.connection.commit()
+        self.dirty = False  # Track rows not yet written to the workbook
+        # Seed the first journal of a lot with the rows of a workbook written before journals existed
+        if first_journal and os.path.exists(self.excel_path):
+            self.import_excel()
+
+    # Load the rows of an existing lot workbook into the journal. The ids depend only on the workbook, so stations
+    # that import the same workbook at the same time do not repeat its rows.
+    def import_excel(self):
+        import pandas as pd  # Imported on first use, pandas is by far the slowest dependency to load
+        df = pd.read_excel(self.excel_path)
+        rows = [(str(lot), str(subject), float(distance), None, f"xlsx:{index}:{lot}:{subject}:{distance}",
+                 self.station) for index, (lot, subject, distance) in enumerate(df[HEADERS].itertuples(index=False))]
+        with self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO measurements (lot, subject, distance, image, uid, "
+                                        "station) VALUES (?, ?, ?, ?, ?, ?)", rows)
+
+    # Durably insert a single measurement row, independent of the number of rows already stored. flags names the
+    # checks the measurement failed, such as "scale" and "drift".
+    def append(self, lot, subject, distance, image=None, flags=()):
+        with self.connection:  # Commits the insert or rolls it back on error
+            self.connection.execute("INSERT INTO measurements (lot, subject, distance, image, uid, station, flags) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?)", (lot, subject, float(distance), image,
+                                                                     uuid.uuid4().hex, self.station,
+                                                                     ",".join(flags) or None))
+        self.dirty = True
+
+    # Return the rows of every station's journal once each, in the order they were recorded
+    def merged_rows(self):
+        return merged_rows(self.folder_path, {self.db_path: self.connection})
+
+    # Return every stored measurement of the lot in the order it was recorded
+    def rows(self):
+        return [(lot, subject, distance) for _, lot, subject, distance, _, _, _ in self.merged_rows()]
+
+    # Return the file names of the images with a recorded measurement and the (lot, subject) pairs of the rows without
+    # an image, the rows imported from a workbook. Rows with an image only match that image, so measuring one image of
+    # a subject leaves its other images and frames to be measured.
+    def measured(self):
+        names, subjects = set(), set()
+        for _, lot, subject, _, image, _, _ in self.merged_rows():
+            if image:
+                names.add(os.path.basename(image))
+            else:
+                subjects.add((lot, subject))
+        return names, subjects
+
+    # Take the lot workbook lock, so only one station rebuilds the workbook at a time
+    def acquire_lock(self):
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while True:
+            try:
+                os.close(os.open(self.lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+                return
+            except FileExistsError:
+                try:
+                    if time.time() - os.path.getmtime(self.lock_path) > STALE_LOCK:
+                        os.remove(self.lock_path)
+                        continue
+                except OSError:
+                    continue  # Released in the meantime
+                if time.monotonic() > deadline:
+                    raise TimeoutError("another station is still writing the lot workbook")
+                time.sleep(0.2)
+
+    def release_lock(self):
+        try:
+            os.remove(self.lock_path)
+        except FileNotFoundError:
+            pass
+
+    # Write the journals of all stations to the lot workbook in a single pass
+    def export_to_excel(self):
+        import pandas as pd
+        with perf.span("export_excel", lot=self.lot) as span:
+            self.acquire_lock()
+            try:
+                df = pd.DataFrame(self.rows(), columns=HEADERS)
+                span.set(rows=len(df))
+                # Write to a temporary workbook first so a failed export never leaves a partial file behind
+                base, ext = os.path.splitext(self.excel_path)
+                temp_path = f"{base}.{self.station}.tmp{ext}"
+                df.to_excel(temp_path, index=False)
+                try:
+                    os.replace(temp_path, self.excel_path)
+                except PermissionError:
+                    os.remove(temp_path)
+                    raise PermissionError(f"{os.path.basename(self.excel_path)} is open in another program, close it "
+                                          "and export again; the measurements are kept in the journal")
+            finally:
+                self.release_lock()
+        self.dirty = False
+        return self.excel_path
+
+    # Export any pending rows and release the journal
+    def close(self):
+        try:
+            if self.dirty:
+                self.export_to_excel()
+        finally:
+            self.connection.close()
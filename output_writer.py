@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+import os
+import queue
+import threading
+import droop_core
+import perf
+import records
+
+
+# Background thread that appends the row of each accepted measurement to the lot journal, saves its record, and draws,
+# encodes and saves its annotated output unless save_images is False, so saving never holds up the window. At most
+# max_pending measurements wait in the queue; submitting another one blocks until the writer catches up.
+class OutputWriter:
+    def __init__(self, output_format="PNG", compress_level=1, quality=95, max_pending=4, save_images=True):
+        self.output_format = output_format.upper()
+        self.save_images = save_images  # Otherwise annotated images are rendered from the records when needed
+        # Encoder options for the output format; a low PNG compression level trades file size for save time
+        if self.output_format == "PNG":
+            self.options, self.extension = {"compress_level": compress_level}, ".png"
+        else:
+            self.options, self.extension = {"quality": quality}, ".jpg"
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.errors = queue.Queue()  # Messages for failed measurements, reported by the window
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Queue a measurement snapshot, a dict holding the image source, lines, point, intersection, distance and journal
+    def submit(self, snapshot):
+        self.queue.put(snapshot)  # Blocks while the queue is full
+
+    # Number of measurements queued or being written
+    def pending(self):
+        return self.queue.unfinished_tasks
+
+    def run(self):
+        while True:
+            snapshot = self.queue.get()
+            try:
+                if snapshot is None:
+                    return
+                with perf.span("save", file=os.path.basename(snapshot["file"])):
+                    self.write(snapshot)
+            except Exception as e:
+                self.errors.put(f"{os.path.basename(snapshot['file'])}: {e}")
+            finally:
+                self.queue.task_done()
+
+    # Record the row of a measurement in the lot journal, which is the durable record of it, then save its record, and
+    # draw and save its annotated image, adding it to the record. The window has already counted the measurement as
+    # made, so a failure after the row is stored is reported without losing it.
+    def write(self, snapshot):
+        source = snapshot["source"]
+        lot, subject = droop_core.parse_image_lot(snapshot["image_lot"])
+        with perf.span("journal_append"):
+            snapshot["store"].append(lot, subject, snapshot["distance"], image=snapshot["file"],
+                                     flags=snapshot.get("flags", ()))
+        record_path = records.record_path(snapshot["file"], when=snapshot["time"])
+        with perf.span("record"):
+            record = records.make_record(record_path, snapshot["file"], source.full_size, snapshot["image_lot"],
+                                         snapshot["calibration_line"], snapshot["calibration_text"],
+                                         snapshot["horizontal_line"], snapshot["point"], snapshot["intersection"],
+                                         snapshot["distance"], snapshot["scale"], snapshot["time"],
+                                         self.output_format, self.options, snapshot.get("flags", ()))
+        records.save_record(record_path, record)  # Enough to render the annotated image whatever happens next
+        if self.save_images:
+            try:
+                path = self.save_image(snapshot)
+            except Exception as e:
+                self.errors.put(f"{os.path.basename(snapshot['file'])}: annotated image not saved ({e}), the "
+                                "measurement is recorded")
+                return
+            record.update(output=os.path.basename(path), output_sha256=records.file_hash(path))
+            records.save_record(record_path, record)
+
+    # Draw and save the annotated image of a measurement, returning its path
+    def save_image(self, snapshot):
+        source = snapshot["source"]
+        path = droop_core.output_path(snapshot["file"], when=snapshot["time"], ext=self.extension)
+        with perf.span("render_encode", format=self.output_format, width=source.full_size[0],
+                       height=source.full_size[1], streamed=source.pixels is not None) as span:
+            path = droop_core.save_annotated(source, path, snapshot["image_lot"], snapshot["calibration_line"],
+                                             snapshot["calibration_text"], snapshot["horizontal_line"],
+                                             snapshot["point"], snapshot["intersection"], snapshot["distance"],
+                                             s=snapshot["scale"], output_format=self.output_format, **self.options)
+            span.set(bytes=os.path.getsize(path))
+        return path
+
+    # Wait until every queued measurement has been written
+    def flush(self):
+        self.queue.join()
+
+    # Write the queued measurements and stop the thread
+    def close(self):
+        self.queue.put(None)
+        self.thread.join()
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+import tkinter as tk
+
+
+# Persistent canvas items for the lines, labels and point handles drawn over the image. Geometry is kept in image
+# coordinates and every item is created once, then moved with canvas.coords when the view or the geometry changes.
+class OverlayLayer:
+    def __init__(self, canvas, to_canvas, place_text, font, radius=3):
+        self.canvas = canvas
+        self.to_canvas = to_canvas  # Converts an image coordinate pair into canvas coordinates
+        self.place_text = place_text  # Positions a label alongside a line given in canvas coordinates
+        self.font = font
+        self.radius = radius  # Radius of a point handle in canvas pixels
+        self.items = {}  # Named lines and texts
+        self.handles = []  # Canvas ids of the point handles in point order
+        self.points = []  # Image coordinates of the point handles
+        self.clicks = []  # Image coordinates of the click each point was snapped from, or None
+        self.click_marks = []  # Canvas ids of the click markers, or None
+        self.handle_index = {}  # Map from the canvas id of a handle to its point index
+
+    # Show a line given in image coordinates (x1, y1, x2, y2) with an optional label alongside it
+    def set_line(self, name, line, color="green", width=2, dash=None, label=None):
+        if line is None:
+            return self.hide(name)
+        item = self.items.get(name)
+        if item is None:
+            options = {"dash": dash} if dash else {}
+            item = self.items[name] = {
+                "kind": "line",
+                "color": color,
+                "line": self.canvas.create_line(0, 0, 0, 0, fill=color, width=width, tags="overlay", **options),
+                "label": self.canvas.create_text(0, 0, fill=color, font=self.font, tags="overlay")}
+        item["coords"] = line
+        self.canvas.itemconfig(item["line"], state=tk.NORMAL)
+        self.canvas.itemconfig(item["label"], text=label or "", state=tk.NORMAL if label else tk.HIDDEN)
+        self.place_line(item)
+
+    # Show a text fixed at a canvas position, independent of the zoom
+    def set_text(self, name, x, y, text, color="red"):
+        item = self.items.get(name)
+        if item is None:
+            item = self.items[name] = {
+                "kind": "text",
+                "text": self.canvas.create_text(x, y, anchor="nw", fill=color, font=self.font, tags="overlay")}
+        self.canvas.itemconfig(item["text"], text=text, state=tk.NORMAL)
+
+    # Hide a named line or text without deleting its canvas items
+    def hide(self, name):
+        item = self.items.get(name)
+        if item is None:
+            return
+        if item["kind"] == "line":
+            item["coords"] = None
+            self.canvas.itemconfig(item["line"], state=tk.HIDDEN)
+            self.canvas.itemconfig(item["label"], state=tk.HIDDEN)
+        else:
+            self.canvas.itemconfig(item["text"], state=tk.HIDDEN)
+
+    # Move the canvas items of a line to its image coordinates in the current view
+    def place_line(self, item):
+        x1, y1 = self.to_canvas(item["coords"][0], item["coords"][1])
+        x2, y2 = self.to_canvas(item["coords"][2], item["coords"][3])
+        self.canvas.coords(item["line"], x1, y1, x2, y2)
+        if self.canvas.itemcget(item["label"], "state") != tk.HIDDEN:
+            self.canvas.coords(item["label"], *self.place_text(x1, y1, x2, y2))
+
+    # Add a handle for a point given in image coordinates, marking the click it was snapped from when given
+    def add_point(self, point, click=None):
+        mark = None
+        if click is not None:
+            mark = self.canvas.create_oval(0, 0, 0, 0, outline="gray50", tags=("overlay", "click"))
+        handle = self.canvas.create_oval(0, 0, 0, 0, fill="red", tags=("oval", "handle"))
+        self.handle_index[handle] = len(self.handles)
+        self.handles.append(handle)
+        self.points.append(point)
+        self.clicks.append(click)
+        self.click_marks.append(mark)
+        self.place_handle(len(self.handles) - 1)
+
+    # Remove the handle of the most recently added point
+    def pop_point(self):
+        if not self.handles:
+            return
+        handle = self.handles.pop()
+        self.points.pop()
+        self.clicks.pop()
+        mark = self.click_marks.pop()
+        del self.handle_index[handle]
+        self.canvas.delete(handle)
+        if mark is not None:
+            self.canvas.delete(mark)
+
+    # Move the handle of an existing point, which is then no longer a snapped click
+    def move_point(self, index, point):
+        self.points[index] = point
+        if self.click_marks[index] is not None:
+            self.canvas.delete(self.click_marks[index])
+            self.clicks[index] = self.click_marks[index] = None
+        self.place_handle(index)
+
+    # Match the handles to a list of points, creating or deleting only the difference
+    def set_points(self, points):
+        while len(self.handles) > len(points):
+            self.pop_point()
+        for index, point in enumerate(points):
+            if index < len(self.handles):
+                self.move_point(index, point)
+            else:
+                self.add_point(point)
+
+    def place_handle(self, index):
+        x, y = self.to_canvas(*self.points[index])
+        r = self.radius
+        self.canvas.coords(self.handles[index], x - r, y - r, x + r, y + r)
+        if self.click_marks[index] is not None:
+            x, y = self.to_canvas(*self.clicks[index])
+            self.canvas.coords(self.click_marks[index], x - r - 1, y - r - 1, x + r + 1, y + r + 1)
+
+    # Return the index of the point whose handle lies under a canvas position, or None
+    def hit_test(self, x, y, tolerance=3):
+        reach = self.radius + tolerance
+        for handle in reversed(self.canvas.find_overlapping(x - reach, y - reach, x + reach, y + reach)):
+            if handle in self.handle_index:
+                return self.handle_index[handle]  # Topmost handle wins when handles overlap
+        return None
+
+    # Reposition every item after the view was zoomed or panned
+    def refresh(self):
+        for item in self.items.values():
+            if item["kind"] == "line" and item["coords"] is not None:
+                self.place_line(item)
+        for index in range(len(self.handles)):
+            self.place_handle(index)
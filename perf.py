@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""
+Timing of the stages of the measurement pipeline. Wrap a stage in a span:
+
+    with perf.span("decode", file=path) as s:
+        ...
+        s.set(width=width, height=height)
+
+While timing is off, span() returns a shared span that does nothing. Once enabled, the latest time of each stage is
+kept for the on-screen HUD and, when a log folder is given, every span is appended as a JSON line to a rotating log.
+Logs collected from several stations are summarized with:
+
+    python perf.py perf.jsonl [perf.jsonl.1 ...] [--slowest N]
+"""
+import json
+import os
+import socket
+import sys
+import threading
+import time
+from datetime import datetime
+
+LOG_DIR = os.path.join(os.path.expanduser("~"), ".leaflet_droop", "logs")
+LOG_BYTES = 5 * 2 ** 20  # Size at which the log is rotated
+LOG_BACKUPS = 5  # Rotated logs kept
+
+enabled = False
+last = {}  # Latest time in ms of each stage
+_logger = None
+_station = socket.gethostname()
+
+
+# Span that does nothing, returned while timing is off
+class NullSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **fields):
+        pass
+
+
+NULL_SPAN = NullSpan()
+
+
+# Times a stage and records it on exit along with its fields
+class Span:
+    def __init__(self, stage, fields):
+        self.stage = stage
+        self.fields = fields
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        ms = (time.perf_counter() - self.start) * 1000
+        last[self.stage] = ms
+        if _logger is not None:
+            record = {"time": datetime.now().isoformat(timespec="milliseconds"), "station": _station,
+                      "thread": threading.current_thread().name, "stage": self.stage, "ms": round(ms, 3),
+                      "memory_mb": memory_mb(), **self.fields}
+            if exc_type is not None:
+                record["error"] = f"{exc_type.__name__}: {exc}"
+            _logger.info(json.dumps(record, default=str))
+        return False
+
+    # Add fields that are only known once the stage is under way, such as the size of a decoded image
+    def set(self, **fields):
+        self.fields.update(fields)
+
+
+# Time a stage of the pipeline; fields are written to the log with the time
+def span(stage, **fields):
+    if not enabled:
+        return NULL_SPAN
+    return Span(stage, fields)
+
+
+# Resident memory of the process in MB, or None where it cannot be read without psutil
+def memory_mb():
+    try:
+        import psutil
+        return round(psutil.Process().memory_info().rss / 2 ** 20, 1)
+    except ImportError:
+        pass
+    try:
+        with open("/proc/self/statm") as file:
+            return round(int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20, 1)
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+# Start timing stages, also writing every span to a rotating JSONL log in log_dir when it is given
+def enable(log_dir=None):
+    global enabled, _logger
+    enabled = True
+    if log_dir is None or _logger is not None:
+        return
+    import logging.handlers
+    os.makedirs(log_dir, exist_ok=True)
+    handler = logging.handlers.RotatingFileHandler(os.path.join(log_dir, "perf.jsonl"), maxBytes=LOG_BYTES,
+                                                   backupCount=LOG_BACKUPS, encoding="utf-8")
+    handler.setFormatter(logging.Formatter("%(message)s"))
+    _logger = logging.getLogger("droop.perf")
+    _logger.propagate = False
+    _logger.setLevel(logging.INFO)
+    _logger.addHandler(handler)
+    _logger.info(json.dumps({"time": datetime.now().isoformat(timespec="milliseconds"), "station": _station,
+                             "stage": "session", "python": sys.version.split()[0], "memory_mb": memory_mb()}))
+
+
+# Stop timing stages and close the log
+def disable():
+    global enabled, _logger
+    enabled = False
+    if _logger is not None:
+        for handler in list(_logger.handlers):
+            _logger.removeHandler(handler)
+            handler.close()
+        _logger = None
+
+
+# Read the spans of one or more logs, skipping lines that are not complete records
+def read_logs(paths):
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if "ms" in record:
+                    records.append(record)
+    return records
+
+
+# Median and 95th percentile time of every stage at every station, slowest first
+def summarize(records):
+    import statistics
+    times = {}
+    for record in records:
+        times.setdefault((record.get("station"), record["stage"]), []).append(record["ms"])
+    rows = []
+    for (station, stage), values in times.items():
+        values.sort()
+        rows.append((station, stage, len(values), statistics.median(values),
+                     values[min(len(values) - 1, int(0.95 * len(values)))]))
+    return sorted(rows, key=lambda row: row[4], reverse=True)
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(description="Summarize the stage times of perf.jsonl logs")
+    parser.add_argument("logs", nargs="+", help="perf.jsonl logs, from one or several stations")
+    parser.add_argument("--slowest", type=int, default=10, help="number of slowest spans listed (default: 10)")
+    args = parser.parse_args(argv)
+
+    records = read_logs(args.logs)
+    print(f"{'Station':<20} {'Stage':<18} {'Count':>7} {'Median ms':>10} {'95% ms':>10}")
+    for station, stage, count, median, p95 in summarize(records):
+        print(f"{str(station):<20} {stage:<18} {count:>7} {median:>10.1f} {p95:>10.1f}")
+    print(f"\nSlowest {args.slowest} spans:")
+    for record in sorted(records, key=lambda record: record["ms"], reverse=True)[:args.slowest]:
+        details = ", ".join(f"{key}={value}" for key, value in record.items()
+                            if key not in ("time", "station", "stage", "ms", "thread"))
+        print(f"{record['ms']:10.1f} ms  {record.get('station')}  {record['stage']}  {details}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
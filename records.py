@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Render the annotated images of saved measurement records, or check that records still match their images:
+
+    python records.py <record.json|folder> [...] [--output DIR] [--check] [--workers N]
+
+Every accepted measurement is saved as a small record (<image>_<date>_M.json) next to its annotated image, holding
+the hash of the source image and everything the annotated image is drawn from, so the image itself need not be kept.
+Annotated images are rendered from the records into a local cache and written next to each record (or to --output);
+--check only verifies the source images and any annotated images still on disk against the hashes in the records.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+from concurrent.futures import ProcessPoolExecutor
+import droop_core
+
+RECORD_VERSION = 1
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".leaflet_droop", "renders")
+CACHE_MB = 2048  # Largest size of the render cache, the least recently used images are removed beyond it
+HASH_CHUNK = 2 ** 20
+
+
+# SHA-256 of a file, read in chunks
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# Name the record of a measurement, like the annotated output it describes
+def record_path(file, output_dir=None, when=None):
+    return droop_core.output_path(file, output_dir, when, ext=".json")
+
+
+# Build the record of a measurement saved at path. The source image is stored relative to the record, with its hash,
+# so a record and its image can be moved together. All coordinates are in full resolution image pixels. flags names
+# the checks the measurement failed, such as "scale" and "drift".
+def make_record(path, file, size, image_lot, calibration_line, calibration_text, horizontal_line, point,
+                intersection, distance, scale, when, output_format="PNG", options=None, flags=()):
+    import PIL
+    try:
+        image = os.path.relpath(file, os.path.dirname(os.path.abspath(path)))
+    except ValueError:
+        image = os.path.abspath(file)  # On another drive
+    return {"version": RECORD_VERSION, "image": image, "image_sha256": file_hash(file), "image_size": list(size),
+            "image_lot": image_lot, "calibration_line": list(calibration_line), "calibration_text": calibration_text,
+            "horizontal_line": list(horizontal_line), "point": list(point), "intersection": list(intersection),
+            "distance": float(distance), "scale": float(scale), "format": output_format.upper(),
+            "options": dict(options or {}), "flags": list(flags), "time": when.isoformat(timespec="seconds"),
+            "pillow": PIL.__version__}
+
+
+# Write a record, replacing any earlier one in a single step so a reader never sees a partial record
+def save_record(path, record):
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as file:
+        json.dump(record, file, indent=2)
+    os.replace(temp_path, path)
+
+
+def load_record(path):
+    with open(path) as file:
+        return json.load(file)
+
+
+# Path of the source image of a record saved at path
+def source_of(path, record):
+    return os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(path)), record["image"]))
+
+
+# Key of the rendered image of a record in the cache, from everything the rendering depends on
+def cache_key(record):
+    inputs = {key: value for key, value in record.items() if key not in ("output", "output_sha256", "flags")}
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode()).hexdigest()[:32]
+
+
+# Remove the least recently used rendered images until the cache fits in limit bytes
+def prune_cache(cache_dir=CACHE_DIR, limit=CACHE_MB * 2 ** 20):
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.is_file():
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= limit:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass  # In use by another render, removed next time
+
+
+# Render the annotated image of a record, or take it from the cache, and return the cached path. The source image
+# must still match the hash in the record, so a rendered image always shows exactly what was measured.
+def render(path, cache_dir=CACHE_DIR):
+    record = load_record(path)
+    key = cache_key(record)
+    extension = ".png" if record["format"] == "PNG" else ".jpg"
+    for cached in (os.path.join(cache_dir, key + extension), os.path.join(cache_dir, key + ".png")):
+        if os.path.exists(cached):
+            os.utime(cached)  # Most recently used
+            return cached
+    source_file = source_of(path, record)
+    if file_hash(source_file) != record["image_sha256"]:
+        raise ValueError(f"{os.path.basename(source_file)} has changed since it was measured")
+    from image_source import ImageSource
+    os.makedirs(cache_dir, exist_ok=True)
+    # Only the full resolution image is drawn on, the display copy is decoded as small as possible
+    source = ImageSource(source_file, (64, 64))
+    temp_path = os.path.join(cache_dir, f"{key}.{os.getpid()}.tmp{extension}")
+    temp_path = droop_core.save_annotated(source, temp_path, record["image_lot"], record["calibration_line"],
+                                          record["calibration_text"], record["horizontal_line"], record["point"],
+                                          record["intersection"], record["distance"], s=record["scale"],
+                                          output_format=record["format"], **record["options"])
+    cached = os.path.join(cache_dir, key + os.path.splitext(temp_path)[1])
+    os.replace(temp_path, cached)
+    prune_cache(cache_dir)
+    return cached
+
+
+# Render the annotated image of a record to output_dir, or next to the record, named like the record. Returns the
+# path written.
+def export(path, output_dir=None, cache_dir=CACHE_DIR):
+    cached = render(path, cache_dir)
+    target = os.path.splitext(os.path.join(output_dir or os.path.dirname(path), os.path.basename(path)))[0]
+    target += os.path.splitext(cached)[1]
+    shutil.copyfile(cached, target)
+    return target
+
+
+# Check a record against its source image and, while it is kept, its annotated image. Returns a list of problems.
+def check(path):
+    record = load_record(path)
+    problems = []
+    source_file = source_of(path, record)
+    if not os.path.exists(source_file):
+        problems.append(f"{record['image']} is missing")
+    elif file_hash(source_file) != record["image_sha256"]:
+        problems.append(f"{record['image']} has changed since it was measured")
+    output = record.get("output")
+    if output is not None:
+        output_file = os.path.join(os.path.dirname(os.path.abspath(path)), output)
+        if os.path.exists(output_file) and file_hash(output_file) != record["output_sha256"]:
+            problems.append(f"{output} does not match the record")
+    return problems
+
+
+# Records among the given files and folders
+def find_records(paths):
+    records = []
+    for path in paths:
+        if os.path.isdir(path):
+            records.extend(os.path.join(path, name) for name in sorted(os.listdir(path))
+                           if name.endswith("_M.json"))
+        else:
+            records.append(path)
+    return records
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Render or check the annotated images of measurement records")
+    parser.add_argument("paths", nargs="+", help="record files (.json) or folders holding them")
+    parser.add_argument("--output", help="folder for the rendered images (default: next to each record)")
+    parser.add_argument("--check", action="store_true", help="only check the records against their images")
+    parser.add_argument("--workers", type=int, help="number of worker processes (default: one per CPU)")
+    args = parser.parse_args(argv)
+
+    records = find_records(args.paths)
+    failed = 0
+    if args.check:
+        for path in records:
+            for problem in check(path):
+                print(f"Error: {os.path.basename(path)}: {problem}")
+                failed += 1
+        print(f"Checked {len(records)} records, {failed} problems")
+        return 1 if failed else 0
+    if args.output:
+        os.makedirs(args.output, exist_ok=True)
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(export, path, args.output) for path in records]
+        for path, future in zip(records, futures):
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error: {os.path.basename(path)}: {e}")
+                failed += 1
+    print(f"Rendered {len(records) - failed} of {len(records)} records")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
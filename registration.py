@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+from PIL import Image
+
+REFERENCE_SIZE = 512  # Longest side of the downsampled copies that are registered
+
+
+# Downsample an image to a grayscale array for registration. The image may be a reduced copy with scale image pixels
+# per full resolution pixel. Returns the array and its pixels per full resolution pixel.
+def prepare(image, scale=1.0, size=None):
+    gray = image.convert("L")
+    if size is None:
+        ratio = REFERENCE_SIZE / max(gray.size)
+        size = (max(1, round(gray.width * ratio)), max(1, round(gray.height * ratio)))
+    factor = size[0] / gray.width * scale
+    return np.asarray(gray.resize(size, Image.Resampling.BILINEAR), dtype=np.float32), factor
+
+
+# Hann window used to suppress the image borders before the transforms
+def hann(shape):
+    return np.outer(np.hanning(shape[0]), np.hanning(shape[1])).astype(np.float32)
+
+
+# Sub-pixel offset of a peak from the samples on either side of it
+def parabolic_offset(left, centre, right):
+    curvature = left - 2 * centre + right
+    return 0.0 if curvature == 0 else float(np.clip(0.5 * (left - right) / curvature, -0.5, 0.5))
+
+
+# Estimate the translation (dx, dy) taking array a to array b by phase correlation, with the height of the correlation
+# peak as a measure of how well the arrays match (1 for identical arrays)
+def phase_correlate(a, b):
+    window = hann(a.shape)
+    fa = np.fft.fft2((a - a.mean()) * window)
+    fb = np.fft.fft2((b - b.mean()) * window)
+    cross = fb * fa.conj()
+    surface = np.fft.ifft2(cross / (np.abs(cross) + 1e-9)).real
+    iy, ix = np.unravel_index(int(np.argmax(surface)), surface.shape)
+    height, width = surface.shape
+    dy = iy + parabolic_offset(surface[iy - 1, ix], surface[iy, ix], surface[(iy + 1) % height, ix])
+    dx = ix + parabolic_offset(surface[iy, ix - 1], surface[iy, ix], surface[iy, (ix + 1) % width])
+    # Peaks past the middle are negative shifts wrapped around
+    dy = dy - height if dy > height / 2 else dy
+    dx = dx - width if dx > width / 2 else dx
+    return dx, dy, float(surface[iy, ix])
+
+
+# Magnitude spectrum of an array resampled onto a polar grid of angles over half a turn and radii
+def polar_spectrum(a, n_angles):
+    spectrum = np.log1p(np.abs(np.fft.fftshift(np.fft.fft2((a - a.mean()) * hann(a.shape)))))
+    height, width = a.shape
+    cy, cx = height / 2, width / 2
+    radii = np.linspace(min(cy, cx) * 0.1, min(cy, cx) * 0.9, int(min(cy, cx) // 2))
+    angles = np.linspace(0, math.pi, n_angles, endpoint=False)
+    rows = np.round(cy + radii[None, :] * np.sin(angles[:, None])).astype(int) % height
+    columns = np.round(cx + radii[None, :] * np.cos(angles[:, None])).astype(int) % width
+    return spectrum[rows, columns]
+
+
+# Estimate the rotation in degrees taking array a to array b from the angular shift of their magnitude spectra, which
+# do not depend on translation
+def estimate_rotation(a, b, n_angles=720):
+    pa = polar_spectrum(a, n_angles)
+    pb = polar_spectrum(b, n_angles)
+    fa = np.fft.fft(pa - pa.mean(axis=0), axis=0)
+    fb = np.fft.fft(pb - pb.mean(axis=0), axis=0)
+    correlation = np.fft.ifft((fb * fa.conj()).sum(axis=1)).real
+    i = int(np.argmax(correlation))
+    shift = i + parabolic_offset(correlation[i - 1], correlation[i], correlation[(i + 1) % n_angles])
+    shift = shift - n_angles if shift > n_angles / 2 else shift
+    return float(-shift * 180 / n_angles)  # Spectrum angles increase clockwise in image coordinates
+
+
+# Estimate the rigid drift of an image against a reference prepared with prepare(). Returns a dict with the shift (dx,
+# dy) in full resolution pixels, the rotation in degrees about the image centre, the centre and the peak of the final
+# correlation as a match score.
+def estimate_drift(reference, factor, image, scale=1.0):
+    height, width = reference.shape
+    moved, moved_factor = prepare(image, scale, size=(width, height))
+    # Undo the rotation before measuring the translation, refining the angle once on the unrotated copy
+    angle = 0.0
+    unrotated = moved
+    for _ in range(2):
+        angle += estimate_rotation(reference, unrotated)
+        unrotated = np.asarray(Image.fromarray(moved).rotate(-angle, resample=Image.Resampling.BILINEAR),
+                               dtype=np.float32)
+    dx, dy, peak = phase_correlate(reference, unrotated)
+    # Rotating about the centre and then shifting: rotate the translation into the moved image frame
+    theta = math.radians(angle)
+    shift_x = float(dx * math.cos(theta) + dy * math.sin(theta)) / moved_factor
+    shift_y = float(-dx * math.sin(theta) + dy * math.cos(theta)) / moved_factor
+    return {"dx": shift_x, "dy": shift_y, "angle": angle, "centre": (width / 2 / factor, height / 2 / factor),
+            "peak": peak}
+
+
+# Move a line (x1, y1, x2, y2) from the reference image into the drifted image
+def transform_line(line, drift):
+    theta = math.radians(drift["angle"])
+    cx, cy = drift["centre"]
+    moved = []
+    for x, y in ((line[0], line[1]), (line[2], line[3])):
+        # Image rotations by a positive angle are counter clockwise on screen, where y points down
+        rx = cx + (x - cx) * math.cos(theta) + (y - cy) * math.sin(theta)
+        ry = cy - (x - cx) * math.sin(theta) + (y - cy) * math.cos(theta)
+        moved += [rx + drift["dx"], ry + drift["dy"]]
+    return tuple(moved)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+MAX_DUTY_CYCLE = 0.4  # Largest fraction of a tick run above the middle level for the marks to count as ticks
+MIN_PERIODICITY = 0.2  # Smallest autocorrelation peak of a strip that is searched for ticks
+MAX_CANDIDATE_STRIPS = 32  # Most strips searched for ticks, from the most periodic down
+
+
+# Moving average along the last axis with a window of size samples, keeping the length of the input
+def moving_average(a, size):
+    pad = size // 2
+    padded = np.pad(a, [(0, 0)] * (a.ndim - 1) + [(pad, size - 1 - pad)], mode="edge")
+    cumsum = np.cumsum(padded, axis=-1)
+    cumsum = np.concatenate([np.zeros(a.shape[:-1] + (1,)), cumsum], axis=-1)
+    return (cumsum[..., size:] - cumsum[..., :-size]) / size
+
+
+# Locate the peaks of a profile and return the first and last of the longest run spaced one period apart, with the
+# number of periods between them. The profile is smoothed over a quarter period and only the highest point within
+# half a period either side counts as a peak, so a wide or noisy tick gives a single peak.
+def regular_ticks(profile, period):
+    profile = moving_average(profile, 2 * (period // 8) + 1)  # An odd window, so the peaks stay in place
+    threshold = profile.mean() + profile.std()
+    radius = max(1, period // 2)
+    highest = np.lib.stride_tricks.sliding_window_view(np.pad(profile, radius, mode="edge"), 2 * radius + 1).max(axis=1)
+    centre = profile[1:-1]
+    peaks = np.flatnonzero((centre > profile[:-2]) & (centre >= highest[1:-1]) & (centre > threshold)) + 1
+    if len(peaks) < 3:
+        return 0.0, 0.0, 0
+    # Refine the peaks to sub-pixel positions with a parabola through the neighbouring samples
+    left, mid, right = profile[peaks - 1], profile[peaks], profile[peaks + 1]
+    curvature = left - 2 * mid + right
+    offsets = np.divide(0.5 * (left - right), curvature, out=np.zeros_like(mid), where=curvature != 0)
+    ticks = peaks + np.clip(offsets, -0.5, 0.5)
+
+    regular = np.abs(np.diff(ticks) - period) <= 0.3 * period
+    best_start, best_length, start = 0, 0, None
+    for i, ok in enumerate(np.append(regular, False)):
+        if ok and start is None:
+            start = i
+        elif not ok and start is not None:
+            if i - start > best_length:
+                best_start, best_length = start, i - start
+            start = None
+    return float(ticks[best_start]), float(ticks[best_start + best_length]), best_length
+
+
+# Fraction of a tick run [first, last] of a profile that lies above the level halfway between its dark and light
+# extremes. Ticks are narrow marks, so this duty cycle is well under a half; the ramps of a sawtooth edge or the
+# waves of a texture spend about half of every period above it, and the gaps between wide marks more.
+def duty_cycle(profile, first, last):
+    run = profile[int(first):int(np.ceil(last)) + 1]
+    low, high = np.percentile(run, [5, 95])
+    return float(np.mean(run > (low + high) / 2))
+
+
+# Locate the tick run of one strip profile for a period, with the ticks either light or dark. Returns (first tick,
+# last tick, number of intervals, sign of the ticks), or None when neither gives a run of narrow ticks.
+def tick_run(profile, period):
+    best = None
+    for sign in (1, -1):
+        first, last, intervals = regular_ticks(sign * profile, period)
+        if intervals >= 2 and duty_cycle(sign * profile, first, last) <= MAX_DUTY_CYCLE and \
+                (best is None or intervals > best[2]):
+            best = first, last, intervals, sign
+    return best
+
+
+# Whether a profile has ticks of the same sign at the positions of a tick run, one period apart
+def repeats(profile, period, run):
+    first, last, intervals, sign = run
+    other = regular_ticks(sign * profile, period)
+    if other[2] < 2 or duty_cycle(sign * profile, other[0], other[1]) > MAX_DUTY_CYCLE:
+        return False
+    shift = (other[0] - first + period / 2) % period - period / 2
+    return abs(shift) <= period / 4 and min(last, other[1]) - max(first, other[0]) >= 2 * period
+
+
+# Find the strip of rows with the strongest periodic tick pattern and locate its ticks. Returns (confidence, period,
+# first tick, last tick, number of tick intervals, row) in array pixels, or None when no periodic pattern is found.
+# The strips are tried from the most periodic down, and a strip only counts when its ticks are narrow and a
+# neighbouring strip has the same ticks, since the marks of a scale are taller than a strip while the edge of a
+# part or a texture seldom is.
+def find_ticks(gray, min_period, max_period, strip_height):
+    height, width = gray.shape
+    n_strips = height // strip_height
+    if n_strips == 0 or width < 4 * max_period:
+        return None
+    # Column profile of every strip, with the slow variation in brightness removed
+    profiles = gray[:n_strips * strip_height].reshape(n_strips, strip_height, width).mean(axis=1)
+    profiles = profiles - moving_average(profiles, 2 * max_period + 1)
+    # Autocorrelation of every profile at once, normalized so the zero lag is 1
+    spectrum = np.fft.rfft(profiles, n=2 * width, axis=1)
+    autocorrelation = np.fft.irfft(spectrum * spectrum.conj(), axis=1)[:, :width]
+    energy = autocorrelation[:, :1]
+    autocorrelation = np.divide(autocorrelation, energy, out=np.zeros_like(autocorrelation), where=energy > 0)
+    # Only lags at a local maximum count, so smooth profiles that merely decay from the zero lag are not periodic
+    window = autocorrelation[:, min_period:max_period + 1]
+    is_peak = (window > autocorrelation[:, min_period - 1:max_period]) & \
+              (window >= autocorrelation[:, min_period + 1:max_period + 2])
+    window = np.where(is_peak, window, 0)
+    scores = window.max(axis=1)
+    best = None
+    for strip in np.argsort(-scores)[:MAX_CANDIDATE_STRIPS]:
+        score = float(scores[strip])
+        if score < MIN_PERIODICITY or (best is not None and score <= best[0]):
+            break
+        # Multiples of the tick spacing also correlate, so take the shortest lag with a strong peak as the period
+        period = int(np.argmax(window[strip] >= 0.5 * score)) + min_period
+        run = tick_run(profiles[strip], period)
+        if run is None or not any(repeats(profiles[n], period, run) for n in (strip - 1, strip + 1)
+                                  if 0 <= n < n_strips):
+            continue
+        first, last, intervals, _ = run
+        # Confidence also reflects how much of the detected pattern is regular
+        confidence = score * min(1.0, intervals / 10)
+        if best is None or confidence > best[0]:
+            best = confidence, period, first, last, intervals, (int(strip) + 0.5) * strip_height
+    return best
+
+
+# Propose the calibration line from the ticks of a scale in the image. The image may be a reduced copy with scale
+# image pixels per full resolution pixel. Returns a dict with the calibration line (x1, y1, x2, y2) in full resolution
+# pixels, its length in mm, the pixels per mm and a confidence between 0 and 1, or None when no scale is found.
+def detect_scale(image, tick_mm=1.0, scale=1.0, min_period=3, max_period=None):
+    gray = np.asarray(image.convert("L"), dtype=np.float32)
+    height, width = gray.shape
+    max_period = max_period or max(min_period + 1, min(height, width) // 20)
+    strip_height = max(4, min(height, width) // 100)
+    best = None
+    # Search for a horizontal scale, then for a vertical one in the transposed image
+    for vertical, array in ((False, gray), (True, gray.T)):
+        found = find_ticks(array, min_period, max_period, strip_height)
+        if found is not None and (best is None or found[0] > best[1][0]):
+            best = vertical, found
+    if best is None:
+        return None
+    vertical, (confidence, period, first, last, intervals, row) = best
+    line = (row, first, row, last) if vertical else (first, row, last, row)
+    line = tuple(value / scale for value in line)
+    length_mm = intervals * tick_mm
+    return {"calibration_line": line, "calibration_length": length_mm,
+            "pixels_per_mm": (last - first) / scale / length_mm, "confidence": confidence}
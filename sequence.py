@@ -0,0 +1,235 @@
+# -*- coding: utf-8 -*-
+"""
+Track the droop point through a timed image sequence or a video and write droop against time:
+
+    python sequence.py <folder|stack.tif|video> --setup setup.json (--point X Y | --detect) [--output series.csv]
+                       [--interval SECONDS] [--template PX] [--search PX]
+
+The set-up file is the same as for batch.py (a setup profile also works). Frames are the images of a folder in name
+order, the pages of a multi-page TIFF or the frames of a video (video needs opencv-python). The droop point, given in
+full resolution pixels of the first frame or detected on it, is followed from frame to frame by normalized cross
+correlation of the patch around it within a search window around its last position.
+"""
+import argparse
+import csv
+import math
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image, ImageSequence
+import droop_core
+from registration import parabolic_offset
+
+VIDEO_TYPES = (".mp4", ".avi", ".mov", ".mkv", ".wmv")
+HEADERS = ["Frame", "Source", "Time (s)", "X (px)", "Y (px)", "Droop Length (mm)", "Match Score"]
+TEMPLATE_SIZE = 31  # Side of the patch tracked around the droop point in pixels
+SEARCH_RADIUS = 40  # Largest movement of the point between frames in pixels
+MIN_SCORE = 0.5  # Match score below which the point is considered lost in a frame
+REFRESH_SCORE = 0.8  # Match score below which the tracked patch is taken again from the latest frame
+
+
+# Decode an image file as a grayscale float array, letting JPEGs decode straight to grayscale
+def load_gray(path):
+    with Image.open(path) as image:
+        image.draft("L", image.size)
+        return np.asarray(image.convert("L"), dtype=np.float32)
+
+
+# List the frames of a sequence as (name, time in seconds, loader) without decoding them. Times come from interval
+# when it is given, else from the video clock, the file modification times or the page number.
+def list_frames(path, interval=None):
+    if os.path.isdir(path):
+        files = [os.path.join(path, name) for name in sorted(os.listdir(path))
+                 if name.lower().endswith(droop_core.IMAGE_TYPES) and not os.path.splitext(name)[0].endswith("_M")]
+        return frames_of_files(files, interval)
+    if path.lower().endswith(VIDEO_TYPES):
+        return video_frames(path, interval)
+    return stack_frames(path, interval)
+
+
+# Frames of a list of image files
+def frames_of_files(files, interval=None):
+    start = os.path.getmtime(files[0]) if files else 0
+    for index, file in enumerate(files):
+        time = index * interval if interval else os.path.getmtime(file) - start
+        yield os.path.basename(file), time, (lambda file=file: load_gray(file))
+
+
+# Pages of a multi-page image, one second apart unless interval is given
+def stack_frames(path, interval=None):
+    with Image.open(path) as image:
+        for index, page in enumerate(ImageSequence.Iterator(image)):
+            array = np.asarray(page.convert("L"), dtype=np.float32)
+            yield f"{os.path.basename(path)}[{index}]", index * (interval or 1.0), (lambda array=array: array)
+
+
+# Frames of a video, read one at a time
+def video_frames(path, interval=None):
+    try:
+        import cv2
+    except ImportError:
+        raise ImportError("reading video needs opencv-python (pip install opencv-python)")
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise OSError(f"cannot open video {path}")
+    try:
+        index = 0
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                return
+            time = index * interval if interval else capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+            array = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY).astype(np.float32)
+            yield f"{os.path.basename(path)}[{index}]", time, (lambda array=array: array)
+            index += 1
+    finally:
+        capture.release()
+
+
+# Decode frames on a few threads ahead of the tracker, keeping at most lookahead decoded frames waiting
+def decoded(frames, lookahead=4, workers=2):
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        waiting = deque()
+        for name, time, load in frames:
+            waiting.append((name, time, executor.submit(load)))
+            if len(waiting) > lookahead:
+                name, time, future = waiting.popleft()
+                yield name, time, future.result()
+        while waiting:
+            name, time, future = waiting.popleft()
+            yield name, time, future.result()
+
+
+# Sums over every height x width window of an array, for the windows that lie within it
+def window_sums(a, height, width):
+    c = np.pad(a, ((1, 0), (1, 0))).cumsum(axis=0).cumsum(axis=1)
+    return c[height:, width:] - c[:-height, width:] - c[height:, :-width] + c[:-height, :-width]
+
+
+# Normalized cross correlation of a template at every position within a search array, computed for all positions
+# at once with FFTs and window sums. Entry (i, j) is the score of the template with its upper left corner at (j, i).
+def match_template(search, template):
+    height, width = template.shape
+    t = template - template.mean()
+    t_norm = math.sqrt(float((t * t).sum()))
+    shape = (search.shape[0] + height - 1, search.shape[1] + width - 1)
+    correlation = np.fft.irfft2(np.fft.rfft2(search, shape) * np.fft.rfft2(t[::-1, ::-1], shape), shape)
+    correlation = correlation[height - 1:search.shape[0], width - 1:search.shape[1]]
+    sums = window_sums(search, height, width)
+    variance = window_sums(search * search, height, width) - sums * sums / (height * width)
+    denominator = np.sqrt(np.maximum(variance, 0)) * t_norm
+    return np.divide(correlation, denominator, out=np.zeros_like(correlation), where=denominator > 1e-6)
+
+
+# Patch of a frame centred on the pixel nearest to a point, with the offset of the point from that pixel, or
+# (None, None) when it does not fit in the frame
+def patch(frame, point, size):
+    half = size // 2
+    x, y = int(round(point[0])), int(round(point[1]))
+    if x - half < 0 or y - half < 0 or x + half >= frame.shape[1] or y + half >= frame.shape[0]:
+        return None, None
+    return frame[y - half:y + half + 1, x - half:x + half + 1], (point[0] - x, point[1] - y)
+
+
+# Find a template in a frame within radius pixels of a point. Returns the new point at sub-pixel precision and the
+# match score, or (None, 0) when the search window leaves the frame.
+def find(frame, template, point, radius):
+    half = template.shape[0] // 2
+    x, y = int(round(point[0])), int(round(point[1]))
+    x0, y0 = max(0, x - radius - half), max(0, y - radius - half)
+    x1, y1 = min(frame.shape[1], x + radius + half + 1), min(frame.shape[0], y + radius + half + 1)
+    if x1 - x0 < template.shape[1] or y1 - y0 < template.shape[0]:
+        return None, 0.0
+    scores = match_template(frame[y0:y1, x0:x1], template)
+    i, j = np.unravel_index(int(np.argmax(scores)), scores.shape)
+    dy = parabolic_offset(*scores[i - 1:i + 2, j]) if 0 < i < scores.shape[0] - 1 else 0.0
+    dx = parabolic_offset(*scores[i, j - 1:j + 2]) if 0 < j < scores.shape[1] - 1 else 0.0
+    return (x0 + j + half + dx, y0 + i + half + dy), float(scores[i, j])
+
+
+# Follow a point through decoded frames (name, time, array), yielding (index, name, time, point, score) for every
+# frame. The patch around the point in the first frame is tracked, and taken again from the latest frame whenever the
+# match weakens, so the tracker follows the material as it deforms. Frames where the point is lost repeat the last
+# point with its low score.
+def track(frames, start_point, template_size=TEMPLATE_SIZE, search_radius=SEARCH_RADIUS):
+    point, template, offset = start_point, None, None
+    for index, (name, time, frame) in enumerate(frames):
+        if template is None:
+            template, offset = patch(frame, point, template_size)
+            if template is None:
+                raise ValueError("the droop point is too close to the edge of the frame to track")
+            yield index, name, time, point, 1.0
+            continue
+        found, score = find(frame, template, point, search_radius)
+        if found is not None and score >= MIN_SCORE:
+            point = (found[0] + offset[0], found[1] + offset[1])  # The point sits off the centre of its patch
+            if score < REFRESH_SCORE:
+                refreshed, refreshed_offset = patch(frame, point, template_size)
+                if refreshed is not None:
+                    template, offset = refreshed, refreshed_offset
+        yield index, name, time, point, score
+
+
+# Track the droop point through a sequence and write the series to a CSV file, row by row as frames are tracked.
+# progress is called with the number of frames tracked, and stop, when given, ends the run early when it returns
+# True. Returns the number of frames written.
+def measure_sequence(path, setup, start_point, output, interval=None, template_size=TEMPLATE_SIZE,
+                     search_radius=SEARCH_RADIUS, progress=None, stop=None, frames=None):
+    cal_value = droop_core.points_to_value(setup["calibration_line"], setup["calibration_length"])
+    frames = list_frames(path, interval) if frames is None else frames
+    count = 0
+    with open(output, "w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(HEADERS)
+        for index, name, time, point, score in track(decoded(frames), start_point, template_size, search_radius):
+            distance, _ = droop_core.distance_to_line(point, setup["horizontal_line"], cal_value)
+            writer.writerow([index, name, f"{time:.3f}", f"{point[0]:.2f}", f"{point[1]:.2f}", f"{distance:.4f}",
+                             f"{score:.3f}"])
+            count += 1
+            if progress is not None:
+                progress(count)
+            if stop is not None and stop():
+                break
+    return count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Track the droop point through an image sequence or video")
+    parser.add_argument("source", help="folder of images, multi-page TIFF or video")
+    parser.add_argument("--setup", required=True, help="saved calibration and horizontal line (.json)")
+    parser.add_argument("--point", type=float, nargs=2, metavar=("X", "Y"), help="droop point in the first frame")
+    parser.add_argument("--detect", action="store_true", help="detect the droop point in the first frame")
+    parser.add_argument("--output", help="CSV file for the series (default: <source>_Droop_Series.csv)")
+    parser.add_argument("--interval", type=float, help="seconds between frames (default: from the files or video)")
+    parser.add_argument("--template", type=int, default=TEMPLATE_SIZE, help="side of the tracked patch in pixels")
+    parser.add_argument("--search", type=int, default=SEARCH_RADIUS, help="largest move between frames in pixels")
+    args = parser.parse_args(argv)
+
+    setup = droop_core.load_setup(args.setup)
+    if args.point is None and not args.detect:
+        parser.error("either --point or --detect is required")
+    source = os.path.abspath(args.source)
+    output = args.output or os.path.splitext(source.rstrip(os.sep))[0] + "_Droop_Series.csv"
+    frames = list_frames(source, args.interval)
+    start = args.point
+    if start is None:
+        from droop_detect import detect_droop_point
+        first = next(iter(list_frames(source, args.interval)))
+        start = detect_droop_point(Image.fromarray(first[2]().astype(np.uint8)), setup["horizontal_line"])
+        if start is None:
+            print("Error: no droop point detected in the first frame")
+            return 1
+    try:
+        count = measure_sequence(source, setup, tuple(start), output, args.interval, args.template, args.search,
+                                 progress=lambda n: n % 25 or print(f"\rTracked {n} frames", end="", flush=True),
+                                 frames=frames)
+    except (ValueError, OSError, ImportError) as e:
+        print(f"Error: {e}")
+        return 1
+    print(f"\nTracked {count} frames, series written to {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
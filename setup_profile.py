@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import json
+import os
+import droop_core
+
+PROFILE_DIR = os.path.join(os.path.expanduser("~"), ".leaflet_droop", "profiles")
+LAST_PROFILE = os.path.join(PROFILE_DIR, "last_profile.txt")
+DEFAULT_PROFILE = "default"  # Profile every accepted set-up is saved to; named profiles are only saved on request
+
+
+# Paths of the set-up file and the reference image of a named profile. Names are plain file names, so a profile is
+# always in the profile folder.
+def profile_paths(name):
+    if not name or name in (".", "..") or set(name) & set("/\\:"):  # Separators of every platform, and drives
+        raise ValueError(f"{name!r} is not a valid profile name")
+    return os.path.join(PROFILE_DIR, name + ".json"), os.path.join(PROFILE_DIR, name + "_reference.png")
+
+
+# Save the calibration, horizontal line and registration reference of a set-up under a name and make it the profile
+# loaded on the next start. The set-up file can also be passed to batch.py.
+def save_profile(name, calibration_line, calibration_length, horizontal_line, reference=None, reference_factor=None):
+    import numpy as np
+    from PIL import Image
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    setup_path, reference_path = profile_paths(name)
+    droop_core.save_setup(setup_path, calibration_line, calibration_length, horizontal_line,
+                          reference_factor=reference_factor)
+    if reference is not None:
+        Image.fromarray(np.clip(reference, 0, 255).astype(np.uint8)).save(reference_path, format="PNG")
+    with open(LAST_PROFILE, "w") as file:
+        file.write(name)
+
+
+# Load a named profile. Returns the set-up dict with the path of the registration reference image and its pixels per
+# full resolution pixel added (both None when the profile has no reference). The reference itself is read with
+# load_reference when it is first needed.
+def load_profile(name):
+    setup_path, reference_path = profile_paths(name)
+    setup = droop_core.load_setup(setup_path)
+    with open(setup_path) as file:
+        setup["reference_factor"] = json.load(file).get("reference_factor")
+    has_reference = setup["reference_factor"] is not None and os.path.exists(reference_path)
+    setup["reference_path"] = reference_path if has_reference else None
+    if not has_reference:
+        setup["reference_factor"] = None
+    with open(LAST_PROFILE, "w") as file:
+        file.write(name)
+    return setup
+
+
+# Read the registration reference image of a profile as an array
+def load_reference(path):
+    import numpy as np
+    from PIL import Image
+    with Image.open(path) as reference:
+        return np.asarray(reference.convert("L"), dtype=np.float32)
+
+
+# Name of the profile used most recently, or None
+def last_profile():
+    try:
+        with open(LAST_PROFILE) as file:
+            name = file.read().strip()
+        return name if os.path.exists(profile_paths(name)[0]) else None
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import math
+from datetime import datetime
+import pytest
+import droop_core
+
+
+def test_define_line_through_collinear_points():
+    points = [(10, 21), (30, 61), (20, 41)]
+    assert droop_core.fit_line(points) == pytest.approx((2, 1))
+    assert droop_core.define_line(points) == pytest.approx((10, 21, 30, 61))
+
+
+def test_points_to_value_is_pixels_per_mm():
+    assert droop_core.points_to_value((0, 0, 30, 40), 10) == pytest.approx(5)
+
+
+# Distance from a point to a sloped line, with the foot of the perpendicular on the line
+def test_distance_to_line():
+    line = (0, 0, 100, 100)
+    distance, (x, y) = droop_core.distance_to_line((100, 0), line, 2.0)
+    assert distance == pytest.approx(100 / math.sqrt(2) / 2)
+    assert (x, y) == pytest.approx((50, 50))
+
+
+def test_parse_image_lot():
+    assert droop_core.parse_image_lot("LOT3_S1_A") == ("LOT3", "S1")
+    with pytest.raises(ValueError):
+        droop_core.parse_image_lot("scan")
+
+
+def test_output_path():
+    when = datetime(2026, 10, 18, 9, 5, 1)
+    assert droop_core.output_path("/lot/LOT3_S1_A.jpg", when=when) == "/lot/LOT3_S1_A_2026-10-18_09-05-01_M.png"
+    assert droop_core.output_path("/lot/LOT3_S1_A.jpg", "/out", when, ".json") == \
+        "/out/LOT3_S1_A_2026-10-18_09-05-01_M.json"
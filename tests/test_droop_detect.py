@@ -0,0 +1,36 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from PIL import Image
+from droop_detect import detect_droop_point
+
+
+# A bright strip of material hanging from the line at y = 20 to y = 80, over columns 40 to 59
+@pytest.fixture
+def hanging():
+    a = np.zeros((120, 100), dtype=np.uint8)
+    a[20:80, 40:60] = 200
+    return Image.fromarray(a)
+
+
+def test_lowest_point(hanging):
+    assert detect_droop_point(hanging, (0, 20, 100, 20)) == pytest.approx((50, 80), abs=0.05)
+
+
+def test_lowest_point_of_reduced_copy(hanging):
+    point = detect_droop_point(hanging.resize((50, 60), Image.Resampling.BILINEAR), (0, 20, 100, 20), scale=0.5)
+    assert point == pytest.approx((50, 80), abs=0.5)
+
+
+def test_nothing_under_the_line():
+    assert detect_droop_point(Image.new("L", (100, 120)), (0, 20, 100, 20)) is None
+
+
+# On a noisy background the walk follows the bar down to its end rather than the noise taken for material
+@pytest.mark.parametrize("sigma", [25, 30])
+def test_lowest_point_on_noisy_background(sigma):
+    rng = np.random.default_rng(3)
+    a = rng.normal(90, sigma, (720, 960))
+    a[220:400, 470:490] = 220
+    image = Image.fromarray(a.clip(0, 255).astype(np.uint8))
+    assert detect_droop_point(image, (0, 220, 960, 220)) == pytest.approx((480, 400), abs=0.5)
@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from PIL import Image
+from edge_snap import EdgeMap
+from large_image import MappedImage
+
+
+# Dark background with a bright half plane from x = 50 on, so the edge lies on the boundary at x = 50
+@pytest.fixture
+def step():
+    a = np.full((100, 100), 40, dtype=np.uint8)
+    a[:, 50:] = 200
+    return a
+
+
+def test_snap_moves_across_the_edge(step):
+    x, y = EdgeMap.from_image(Image.fromarray(step)).snap(46.3, 30.2, 8)
+    assert x == pytest.approx(50, abs=0.1)
+    assert y == pytest.approx(30.2, abs=0.6)
+
+
+def test_no_edge_within_radius(step):
+    assert EdgeMap.from_image(Image.fromarray(step)).snap(20, 30, 8) is None
+
+
+# Images read from disk compute the gradient around each click and snap to the same point
+def test_mapped_image_matches_image_in_memory(step):
+    in_memory = EdgeMap.from_image(Image.fromarray(step)).snap(53.7, 60.5, 8)
+    mapped = EdgeMap(pixels=MappedImage(step)).snap(53.7, 60.5, 8)
+    assert mapped == pytest.approx(in_memory, abs=0.05)
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from PIL import Image
+import large_image
+
+
+@pytest.fixture
+def pixels():
+    rng = np.random.default_rng(2)
+    return rng.integers(0, 256, (130, 170, 3), dtype=np.uint8)
+
+
+# The streamed PNG writer gives the image it was fed, whatever the strip heights
+def test_write_png_round_trip(tmp_path, pixels):
+    path = str(tmp_path / "out.png")
+    strips = (Image.fromarray(pixels[y:y + 37]) for y in range(0, pixels.shape[0], 37))
+    large_image.write_png(path, (170, 130), strips)
+    with Image.open(path) as image:
+        assert np.array_equal(np.asarray(image), pixels)
+
+
+def test_write_png_rejects_missing_rows(tmp_path, pixels):
+    path = tmp_path / "out.png"
+    with pytest.raises(ValueError):
+        large_image.write_png(str(path), (170, 130), [Image.fromarray(pixels[:100])])
+    assert not path.exists()
+
+
+# A compressed image over the ceiling is decoded to a temporary file with the same pixels
+def test_open_mapped_spills_compressed_image(tmp_path, pixels):
+    path = str(tmp_path / "big.png")
+    Image.fromarray(pixels).save(path)
+    assert large_image.open_mapped(path) is None  # Fits in memory
+    mapped = large_image.open_mapped(path, memory_ceiling=1000)
+    assert isinstance(mapped.array, np.memmap)
+    assert np.array_equal(np.asarray(mapped.array), pixels)
+    assert np.array_equal(np.asarray(mapped.crop((10, 20, 60, 50))), pixels[20:50, 10:60])
+
+
+# Uncompressed TIFFs are mapped straight from the file, and 16-bit images are scaled to 8 bits from their white level
+def test_open_mapped_maps_16_bit_tiff(tmp_path):
+    a = (np.arange(64 * 48, dtype=np.uint16).reshape(48, 64) * 1000 // (64 * 48)).astype(np.uint16)
+    path = str(tmp_path / "deep.tif")
+    Image.fromarray(a).save(path, compression="raw")
+    mapped = large_image.open_mapped(path)
+    assert isinstance(mapped.array, np.memmap) and mapped.size == (64, 48)
+    assert np.array_equal(np.asarray(mapped.array), a)
+    assert mapped.white == pytest.approx(np.percentile(a, 99.9), rel=0.01)
@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from lot_stats import LotStatistics
+
+
+# Journal rows (MeasurementStore.merged_rows) of a few lots and subjects, with outliers that violate the limits
+@pytest.fixture
+def rows():
+    rng = np.random.default_rng(5)
+    values = rng.normal(12, 0.5, 400)
+    values[[50, 120, 333]] = [20, 3, 25]
+    return [(f"u{i}", f"LOT{i % 3}", f"S{i % 7}", float(value), None, f"2026-10-18 09:{i // 60:02d}:{i % 60:02d}",
+             None) for i, value in enumerate(values)]
+
+
+def test_from_rows_matches_adding_one_at_a_time(rows):
+    built = LotStatistics.from_rows(rows)
+    added = LotStatistics()
+    for _, lot, subject, distance, _, _, _ in rows:
+        added.add(lot, subject, distance)
+    assert built.keys() == added.keys()
+    for key in added.keys():
+        assert built.row(key) == pytest.approx(added.row(key), rel=1e-9)
+    assert built.series.keys() == added.series.keys()
+    for lot, series in added.series.items():
+        assert [violation for _, violation in built.series[lot]] == [violation for _, violation in series]
+        assert [value for value, _ in built.series[lot]] == pytest.approx([value for value, _ in series])
+    assert sum(built.groups[(lot, None)].violations for lot in ("LOT0", "LOT1", "LOT2")) >= 3
+
+
+def test_no_rows():
+    assert LotStatistics.from_rows([]).rows() == []
@@ -0,0 +1,47 @@
+# -*- coding: utf-8 -*-
+import os
+import pandas as pd
+import pytest
+from measurement_store import HEADERS, MeasurementStore
+from work_queue import unmeasured_images
+
+
+@pytest.fixture
+def lot(tmp_path):
+    folder = tmp_path / "LOT3"
+    folder.mkdir()
+    return str(folder)
+
+
+# Two stations save into the same lot folder, both starting from a workbook written before journals existed
+def test_two_station_merge_loses_and_repeats_nothing(lot):
+    pd.DataFrame([["LOT3", "S0", 1.0], ["LOT3", "S0", 1.5]], columns=HEADERS).to_excel(
+        os.path.join(lot, "LOT3_Droop_Measurements.xlsx"), index=False)
+    a, b = MeasurementStore(lot, "bench-a"), MeasurementStore(lot, "bench-b")
+    b.import_excel()  # As a station that found no journal at the same moment would
+    for i in range(10):
+        (a if i % 2 else b).append("LOT3", f"S{i}", float(i), image=os.path.join(lot, f"LOT3_S{i}_A.png"))
+    rows = a.merged_rows()
+    assert rows == b.merged_rows()
+    assert len(rows) == 12
+    assert len({row[0] for row in rows}) == 12
+    a.export_to_excel()
+    exported = pd.read_excel(a.excel_path)
+    assert sorted(exported["Droop Length (mm)"]) == [0, 1, 1, 1.5, 2, 3, 4, 5, 6, 7, 8, 9]
+    a.close()
+    b.close()
+
+
+# Measuring one image of a subject leaves its other images in the queue; imported rows without an image match the
+# whole subject
+def test_measured_images(lot):
+    for name in ("LOT3_S1_A.png", "LOT3_S1_B.png", "LOT3_S2_A.png", "LOT3_S9_A.png", "LOT3_S1_A_2026_M.png"):
+        open(os.path.join(lot, name), "wb").close()
+    store = MeasurementStore(lot, "bench-a")
+    store.append("LOT3", "S1", 1.0, image=os.path.join(lot, "LOT3_S1_A.png"), flags=["drift"])
+    with store.connection:
+        store.connection.execute("INSERT INTO measurements (lot, subject, distance, uid) VALUES ('LOT3', 'S9', 2, 'x')")
+    remaining = [os.path.basename(path) for path in unmeasured_images(lot, store.measured())]
+    assert remaining == ["LOT3_S1_B.png", "LOT3_S2_A.png"]
+    assert store.merged_rows()[0][6] == "drift"
+    store.close()
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+from datetime import datetime
+import numpy as np
+import pytest
+from PIL import Image
+import droop_core
+from image_source import ImageSource
+import records
+
+
+# An image measured and saved as the output writer does: the annotated image and its record
+@pytest.fixture
+def measured(tmp_path):
+    rng = np.random.default_rng(4)
+    file = str(tmp_path / "LOT3_S1_A.png")
+    Image.fromarray(rng.integers(0, 256, (240, 320, 3), dtype=np.uint8)).save(file)
+    source = ImageSource(file, (160, 120))
+    when = datetime(2026, 10, 18, 9, 30)
+    annotations = ("LOT3_S1_A", (20, 20, 220, 20), "10 mm", (0, 60, 320, 62), (150, 200), (150, 61.4), 6.95)
+    output = droop_core.save_annotated(source, droop_core.output_path(file, when=when), *annotations, s=1.0,
+                                       compress_level=1)
+    path = records.record_path(file, when=when)
+    record = records.make_record(path, file, source.full_size, *annotations, 1.0, when, "PNG",
+                                 {"compress_level": 1}, flags=["scale"])
+    record.update(output="LOT3_S1_A_2026-10-18_09-30-00_M.png", output_sha256=records.file_hash(output))
+    records.save_record(path, record)
+    return file, output, path
+
+
+def test_render_reproduces_the_output(tmp_path, measured):
+    _, output, path = measured
+    cache = str(tmp_path / "cache")
+    rendered = records.render(path, cache)
+    assert records.file_hash(rendered) == records.load_record(path)["output_sha256"] == records.file_hash(output)
+    assert records.render(path, cache) == rendered  # From the cache the second time
+
+
+def test_check_finds_changed_source(measured):
+    file, _, path = measured
+    assert records.check(path) == []
+    with open(file, "ab") as changed:
+        changed.write(b"\0")
+    assert records.check(path) == ["LOT3_S1_A.png has changed since it was measured"]
+    with pytest.raises(ValueError):
+        records.render(path)
+
+
+def test_flags_do_not_change_the_render(measured):
+    record = records.load_record(measured[2])
+    assert record["flags"] == ["scale"]
+    assert records.cache_key(record) == records.cache_key(dict(record, flags=[]))
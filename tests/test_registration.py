@@ -0,0 +1,48 @@
+# -*- coding: utf-8 -*-
+import math
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+import registration
+
+
+# Smooth random texture, like a rig background
+@pytest.fixture(scope="module")
+def scene():
+    rng = np.random.default_rng(3)
+    image = Image.fromarray((rng.random((600, 800)) * 255).astype(np.uint8)).filter(ImageFilter.GaussianBlur(4))
+    a = np.asarray(image, dtype=np.float32)
+    return Image.fromarray(((a - a.min()) / (a.max() - a.min()) * 255).astype(np.uint8))
+
+
+def test_known_shift(scene):
+    reference, factor = registration.prepare(scene)
+    # The content moves 12 px right and 8 px up
+    moved = scene.transform(scene.size, Image.Transform.AFFINE, (1, 0, -12, 0, 1, 8),
+                            resample=Image.Resampling.BILINEAR)
+    drift = registration.estimate_drift(reference, factor, moved)
+    assert drift["dx"] == pytest.approx(12, abs=0.5)
+    assert drift["dy"] == pytest.approx(-8, abs=0.5)
+    assert drift["angle"] == pytest.approx(0, abs=0.1)
+    assert registration.transform_line((100, 100, 300, 120), drift) == pytest.approx((112, 92, 312, 112), abs=0.5)
+
+
+def test_known_rotation(scene):
+    reference, factor = registration.prepare(scene)
+    moved = scene.rotate(1.5, resample=Image.Resampling.BILINEAR)  # Counter clockwise about the centre
+    drift = registration.estimate_drift(reference, factor, moved)
+    assert drift["angle"] == pytest.approx(1.5, abs=0.1)
+    # Where a point of the reference ends up in the rotated image
+    theta, (cx, cy), (x, y) = math.radians(1.5), (400, 300), (500, 200)
+    expected = (cx + (x - cx) * math.cos(theta) + (y - cy) * math.sin(theta),
+                cy - (x - cx) * math.sin(theta) + (y - cy) * math.cos(theta))
+    assert registration.transform_line((x, y, x, y), drift)[:2] == pytest.approx(expected, abs=0.5)
+
+
+# The image registered may be a reduced display copy; shifts are still in full resolution pixels
+def test_shift_of_reduced_copy(scene):
+    reference, factor = registration.prepare(scene)
+    moved = scene.transform(scene.size, Image.Transform.AFFINE, (1, 0, 20, 0, 1, -10),
+                            resample=Image.Resampling.BILINEAR)
+    drift = registration.estimate_drift(reference, factor, moved.resize((400, 300)), scale=0.5)
+    assert (drift["dx"], drift["dy"]) == pytest.approx((-20, 10), abs=1.0)
@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from PIL import Image
+from benchmarks.pipeline import synthetic_image
+from image_source import ImageSource
+from scale_detect import detect_scale, regular_ticks
+
+
+# The benchmark image: 20 px ticks every 60 px along the bottom, from x = 400 to 2000
+@pytest.fixture(scope="module")
+def synthetic(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp("scale") / "LOT1_S1_A.jpg")
+    synthetic_image(path, (4000, 3000))
+    return path
+
+
+# Display sizes given by MaterialMeasurement.display_size on 1600x900 to 3840x2160 screens, and a 4:3 one. The
+# sawtooth lower edge of the part repeats every 50 px and must not be taken for the scale.
+@pytest.mark.parametrize("size", [(853, 480), (1024, 576), (1280, 720), (1365, 768), (2048, 1152), (1280, 960)])
+def test_ticks_of_synthetic_image_at_display_size(synthetic, size):
+    source = ImageSource(synthetic, size)
+    detected = detect_scale(source.display, tick_mm=1.0, scale=source.display_scale)
+    assert detected is not None
+    assert detected["calibration_length"] == 26
+    assert detected["pixels_per_mm"] == pytest.approx(60, rel=0.01)
+    assert detected["confidence"] > 0.5
+    x1, y1, x2, y2 = detected["calibration_line"]
+    assert y1 == y2 and 2700 <= y1 <= 2850
+    assert x1 == pytest.approx(410, abs=5) and x2 == pytest.approx(1970, abs=5)
+
+
+# Each flat topped, noisy tick counts once
+def test_one_peak_per_wide_tick():
+    rng = np.random.default_rng(1)
+    profile = rng.normal(0, 2, 400)
+    for x in range(20, 380, 19):
+        profile[x:x + 6] += 100
+    first, last, intervals = regular_ticks(profile, 19)
+    assert intervals == len(range(20, 380, 19)) - 1
+    assert last - first == pytest.approx(19 * intervals, abs=1)
+
+
+# A light scale with 3 px dark ticks every 20 px from x = 100 to 500, on a plain background
+def ruler(vertical=False):
+    a = np.full((400, 600), 200, dtype=np.uint8)
+    for x in range(100, 501, 20):
+        a[300:330, x:x + 3] = 30
+    return Image.fromarray(a.T.copy() if vertical else a)
+
+
+def test_ticks_of_horizontal_ruler():
+    detected = detect_scale(ruler(), tick_mm=0.5)
+    assert detected is not None
+    assert detected["calibration_length"] == 10
+    assert detected["pixels_per_mm"] == pytest.approx(40, rel=0.01)
+    x1, y1, x2, y2 = detected["calibration_line"]
+    assert y1 == y2 and 300 <= y1 <= 330
+    assert x1 == pytest.approx(101.5, abs=1.5) and x2 - x1 == pytest.approx(400, abs=1.5)
+
+
+def test_ticks_of_vertical_ruler_in_reduced_copy():
+    detected = detect_scale(ruler(vertical=True).resize((200, 300)), scale=0.5)
+    assert detected is not None
+    assert detected["pixels_per_mm"] == pytest.approx(20, rel=0.02)
+    x1, y1, x2, y2 = detected["calibration_line"]
+    assert x1 == x2 and 300 <= x1 <= 330
+
+
+def test_no_scale_on_plain_image():
+    assert detect_scale(Image.new("L", (600, 400), 128)) is None
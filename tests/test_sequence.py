@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+import pytest
+from PIL import Image, ImageFilter
+from sequence import match_template, track
+
+
+# Frames of a textured scene whose content moves by a known whole pixel offset in each frame
+@pytest.fixture
+def frames():
+    rng = np.random.default_rng(7)
+    scene = Image.fromarray((rng.random((300, 300)) * 255).astype(np.uint8)).filter(ImageFilter.GaussianBlur(2))
+    scene = np.asarray(scene, dtype=np.float32)
+    offsets = [(0, 0), (3, 5), (7, 11), (6, 18), (2, 24)]
+    return offsets, [(f"frame{i}.png", float(i), np.roll(scene, (dy, dx), axis=(0, 1)))
+                     for i, (dx, dy) in enumerate(offsets)]
+
+
+def test_track_follows_known_motion(frames):
+    offsets, frames = frames
+    start = (140.3, 120.6)
+    results = list(track(frames, start))
+    assert [index for index, _, _, _, _ in results] == list(range(len(frames)))
+    for (_, _, _, point, score), (dx, dy) in zip(results, offsets):
+        assert point == pytest.approx((start[0] + dx, start[1] + dy), abs=0.25)
+        assert score > 0.9
+
+
+def test_match_template_scores_exact_match_one():
+    rng = np.random.default_rng(1)
+    search = rng.random((40, 50)).astype(np.float32)
+    scores = match_template(search, search[12:21, 30:39])
+    assert np.unravel_index(int(np.argmax(scores)), scores.shape) == (12, 30)
+    assert scores.max() == pytest.approx(1, abs=1e-4)
+
+
+def test_point_at_the_edge_is_rejected(frames):
+    _, frames = frames
+    with pytest.raises(ValueError):
+        list(track(frames, (3, 3)))
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+import os
+import pytest
+import setup_profile
+
+
+@pytest.fixture(autouse=True)
+def profile_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(setup_profile, "PROFILE_DIR", str(tmp_path))
+    monkeypatch.setattr(setup_profile, "LAST_PROFILE", str(tmp_path / "last_profile.txt"))
+    return tmp_path
+
+
+def test_save_and_load(profile_dir):
+    setup_profile.save_profile("rig A", (0, 0, 100, 0), "10", (0, 50, 100, 50))
+    assert setup_profile.last_profile() == "rig A"
+    setup = setup_profile.load_profile("rig A")
+    assert setup["calibration_line"] == (0, 0, 100, 0) and setup["calibration_length"] == 10
+    assert setup["reference_path"] is None
+
+
+@pytest.mark.parametrize("name", ["", "..", "../rig", "rigs/a", "rigs\\a", "C:rig"])
+def test_names_with_paths_are_rejected(profile_dir, name):
+    with pytest.raises(ValueError):
+        setup_profile.save_profile(name, (0, 0, 100, 0), "10", (0, 50, 100, 50))
+    assert os.listdir(profile_dir) == []
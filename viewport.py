@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+import math
+from collections import OrderedDict
+from PIL import Image
+
+
+# Resolution pyramid of an image used to render only the region visible in the canvas
+class ZoomPyramid:
+    def __init__(self, image, max_levels=4):
+        self.image = image  # Level 0 is the source image itself
+        self.width, self.height = image.size
+        self.max_levels = max_levels  # Bound on the number of reduced levels held in memory
+        self.levels = OrderedDict()  # Reduced levels in least recently used order
+
+    # Find the coarsest level that still has at least as many pixels as the requested zoom displays
+    def level_for(self, zoom):
+        k = 0
+        while zoom * 2 ** (k + 1) <= 1 and min(self.width, self.height) >> (k + 1) > 0:
+            k += 1
+        return self.get_level(k), 1 / 2 ** k  # Return the level and its scale relative to the source
+
+    # Return the level reduced by 2**k, building it from the closest finer level already cached
+    def get_level(self, k):
+        if k == 0:
+            return self.image
+        if k in self.levels:
+            self.levels.move_to_end(k)
+            return self.levels[k]
+        finer = max((j for j in self.levels if j < k), default=0)
+        source = self.levels[finer] if finer else self.image
+        level = source.reduce(2 ** (k - finer))
+        self.levels[k] = level
+        while len(self.levels) > self.max_levels:
+            self.levels.popitem(last=False)  # Drop the least recently used level
+        return level
+
+    # Render the part of the image under a view_width x view_height viewport with the image's upper left corner at
+    # (image_x, image_y) in viewport coordinates, returning the rendered region and its viewport position
+    def render(self, zoom, image_x, image_y, view_width, view_height, resample=Image.Resampling.BILINEAR):
+        # Canvas rectangle covered by the image, snapped to whole canvas pixels
+        dx0 = max(0, math.floor(image_x))
+        dy0 = max(0, math.floor(image_y))
+        dx1 = min(view_width, math.ceil(image_x + self.width * zoom))
+        dy1 = min(view_height, math.ceil(image_y + self.height * zoom))
+        if dx1 <= dx0 or dy1 <= dy0:
+            return None, 0, 0  # Nothing of the image is visible
+        level, scale = self.level_for(zoom)
+        # Source rectangle under the canvas rectangle, expressed in level pixels
+        level_width, level_height = level.size
+        box = (min(max((dx0 - image_x) / zoom * scale, 0), level_width),
+               min(max((dy0 - image_y) / zoom * scale, 0), level_height),
+               min(max((dx1 - image_x) / zoom * scale, 0), level_width),
+               min(max((dy1 - image_y) / zoom * scale, 0), level_height))
+        view = level.resize((dx1 - dx0, dy1 - dy0), resample, box=box)
+        return view, dx0, dy0
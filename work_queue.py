@@ -0,0 +1,86 @@
+# -*- coding: utf-8 -*-
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import droop_core
+from image_source import ImageSource
+
+
+# Return the images of a lot folder in name order, leaving out annotated outputs and images already measured.
+# measured is the (file names, (lot, subject) pairs) returned by MeasurementStore.measured; an image is matched by its
+# subject only against rows imported from a workbook, which have no image.
+def unmeasured_images(folder, measured=(set(), set())):
+    names, subjects = measured
+    files = []
+    for name in sorted(os.listdir(folder)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in droop_core.IMAGE_TYPES or stem.endswith("_M") or name in names:
+            continue
+        try:
+            if droop_core.parse_image_lot(stem) in subjects:
+                continue
+        except ValueError:
+            pass  # Not named LOT_SUBJECT_X, so it can only be matched by file name
+        files.append(os.path.join(folder, name))
+    return files
+
+
+# Images of a lot waiting to be measured. The next few images are decoded at display size on a thread pool while the
+# current one is measured, and their full resolution images too while they fit in memory_budget bytes, so moving to
+# the next image does not wait on the disk or the decoder.
+class WorkQueue:
+    def __init__(self, files, display_size, prefetch=3, workers=2, memory_budget=512 * 2 ** 20, memory_ceiling=None):
+        self.files = list(files)
+        self.display_size = display_size
+        self.memory_ceiling = memory_ceiling  # Passed on to ImageSource
+        self.prefetch = prefetch
+        self.memory_budget = memory_budget
+        self.reserved = {}  # Bytes of decoded full resolution images held for each prefetched file
+        self.lock = threading.Lock()
+        self.pending = {}  # Future of the ImageSource of each prefetched file
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="prefetch")
+        self.fill()
+
+    # Number of images left to measure
+    def __len__(self):
+        return len(self.files)
+
+    # Start preparing the next prefetch images that are not already being prepared
+    def fill(self):
+        for file in self.files[:self.prefetch]:
+            if file not in self.pending:
+                self.pending[file] = self.executor.submit(self.prepare, file)
+
+    # Decode an image at display size, and at full resolution while the prefetched images fit in the memory budget
+    def prepare(self, file):
+        source = ImageSource(file, self.display_size, self.memory_ceiling)
+        if source.pixels is not None:
+            return source  # Read from disk as needed, there is nothing more to decode
+        width, height = source.full_size
+        size = width * height * 4  # Upper bound for the decoded image at up to 4 bytes per pixel
+        with self.lock:
+            fits = sum(self.reserved.values()) + size <= self.memory_budget
+            if fits:
+                self.reserved[file] = size
+        if fits:
+            source.full()
+        return source
+
+    # Remove the next image from the queue and return its path and the future of its ImageSource, which is usually
+    # done already and is otherwise decoded on the thread pool. Returns None when every image has been measured.
+    def next(self):
+        if not self.files:
+            return None
+        file = self.files.pop(0)
+        future = self.pending.pop(file, None)
+        if future is None:
+            future = self.executor.submit(ImageSource, file, self.display_size, self.memory_ceiling)
+        with self.lock:
+            self.reserved.pop(file, None)  # The image is now the current one, outside the prefetch budget
+        self.fill()
+        return file, future
+
+    # Stop preparing images
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.pending.clear()